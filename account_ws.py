@@ -0,0 +1,221 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import ssl
+import threading
+import time
+
+import certifi
+import websockets
+
+from market_ws import PING_INTERVAL, MAX_RECONNECT_DELAY
+from metrics import RETRIES
+
+OKX_PRIVATE_WS_URLS = {
+    "live": "wss://ws.okx.com:8443/ws/v5/private",
+    "demo": "wss://wspap.okx.com:8443/ws/v5/private",
+}
+RECONCILE_INTERVAL = 60  # REST 全量校正持仓的间隔秒数
+OPEN_ORDER_STATES = {"live", "partially_filled"}
+MAX_ALGO_ORDERS = 1000  # 已结束的策略单只保留最近的这么多条
+
+
+def login_args(api_key: str, secret_key: str, passphrase: str, timestamp: str = None) -> dict:
+    """私有频道登录参数：sign = Base64(HMAC-SHA256(timestamp + "GET" + "/users/self/verify"))"""
+    timestamp = timestamp or str(int(time.time()))
+    digest = hmac.new(secret_key.encode(), f"{timestamp}GET/users/self/verify".encode(), hashlib.sha256).digest()
+    return {"apiKey": api_key, "passphrase": passphrase, "timestamp": timestamp, "sign": base64.b64encode(digest).decode()}
+
+
+class AccountStateCache:
+    """OKX 私有 WebSocket 持仓/订单缓存：登录后订阅 positions、orders 和 orders-algo，在后台线程中运行并自动重连
+
+    持仓以 (instId, posSide) 为键，只保留持仓量不为 0 的仓位；订单以 ordId 为键，只保留未完成的订单；
+    策略单（含开仓附带的止盈止损）以 algoClOrdId 为键，保留最新状态以便确认是否已触发。
+    fetch_positions 返回 REST 全量持仓（失败返回 None），每 reconcile_interval 秒用它校正一次缓存，
+    比快照新的推送（uTime 更大）不会被覆盖。断线期间 ready 为 False，调用方应回退到 REST 查询。
+    """
+
+    def __init__(self, api_key: str, secret_key: str, passphrase: str, demo: bool = True, url: str = None,
+                 fetch_positions=None, reconcile_interval: float = RECONCILE_INTERVAL):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.passphrase = passphrase
+        self.url = url or OKX_PRIVATE_WS_URLS["demo" if demo else "live"]
+        self.fetch_positions = fetch_positions
+        self.reconcile_interval = reconcile_interval
+        self.ready = False
+        self.reconnects = 0
+        self.last_reconcile_time = 0.0
+        self._positions = {}
+        self._orders = {}
+        self._algo_orders = {}
+        self._subscribed_at = None  # 最近一次订阅的时间（毫秒），收到订阅后的持仓快照后清空
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._stopping = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="account-ws", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stopping = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(lambda: [t.cancel() for t in asyncio.all_tasks(self._loop)])
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def get_positions(self, symbol: str = None) -> list:
+        with self._lock:
+            return [dict(p) for (inst_id, _), p in self._positions.items() if symbol is None or inst_id == symbol]
+
+    def get_open_orders(self, symbol: str = None) -> list:
+        with self._lock:
+            return [dict(o) for o in self._orders.values() if symbol is None or o.get("instId") == symbol]
+
+    def get_algo_order(self, algo_cl_ord_id: str):
+        with self._lock:
+            algo = self._algo_orders.get(algo_cl_ord_id)
+            return dict(algo) if algo is not None else None
+
+    def discard_position(self, symbol: str, pos_side: str):
+        """平仓成功后立即移除，不等推送"""
+        with self._lock:
+            self._positions.pop((symbol, pos_side), None)
+
+    def apply_positions(self, data: list, snapshot: bool = False, since: float = 0):
+        """合并持仓推送；snapshot=True 时用 data 替换缓存中 uTime 不晚于 since（毫秒）的仓位"""
+        with self._lock:
+            if snapshot:
+                self._positions = {k: p for k, p in self._positions.items() if int(p.get("uTime") or 0) > since}
+            for position in data:
+                key = (position.get("instId"), position.get("posSide") or "net")
+                cached = self._positions.get(key)
+                if snapshot and cached is not None:
+                    continue
+                if cached is not None and int(position.get("uTime") or 0) < int(cached.get("uTime") or 0):
+                    continue
+                if position.get("pos") in (None, "", "0"):
+                    self._positions.pop(key, None)
+                else:
+                    self._positions[key] = position
+
+    def apply_orders(self, data: list):
+        with self._lock:
+            for order in data:
+                if order.get("state") in OPEN_ORDER_STATES:
+                    self._orders[order["ordId"]] = order
+                else:
+                    self._orders.pop(order.get("ordId"), None)
+
+    def apply_algo_orders(self, data: list):
+        with self._lock:
+            for algo in data:
+                key = algo.get("algoClOrdId") or algo.get("algoId")
+                self._algo_orders.pop(key, None)
+                self._algo_orders[key] = algo  # 重新插入，保持按更新时间排序
+            while len(self._algo_orders) > MAX_ALGO_ORDERS:
+                self._algo_orders.pop(next(iter(self._algo_orders)))
+
+    def reconcile(self) -> bool:
+        """用 REST 全量持仓校正缓存，返回是否成功"""
+        if self.fetch_positions is None:
+            return False
+        started = time.time() * 1000
+        positions = self.fetch_positions()
+        if positions is None:
+            return False
+        self.apply_positions(positions, snapshot=True, since=started)
+        self.last_reconcile_time = time.time()
+        logging.info("持仓缓存已校正，当前持仓数: %s", len(positions))
+        return True
+
+    def _on_message(self, raw: str):
+        if raw == "pong":
+            return
+        message = json.loads(raw)
+        if "event" in message:
+            if message["event"] in ("error", "login") and message.get("code") not in (None, "0"):
+                raise ConnectionError(f"私有频道错误: {message.get('code')} {message.get('msg')}")
+            logging.info("私有频道事件: %s %s", message['event'], message.get('arg', ''))
+            return
+        channel = message.get("arg", {}).get("channel")
+        data = message.get("data") or []
+        if channel == "positions":
+            if self._subscribed_at is not None:
+                # 订阅后的首条推送是全量快照：替换缓存，断线期间已平掉的仓位随之移除
+                self.apply_positions(data, snapshot=True, since=self._subscribed_at)
+                self._subscribed_at = None
+                self.ready = True
+            else:
+                self.apply_positions(data)
+        elif channel == "orders":
+            self.apply_orders(data)
+        elif channel == "orders-algo":
+            self.apply_algo_orders(data)
+
+    async def _consume(self):
+        delay = 1
+        connected_before = False
+        ssl_context = None
+        if self.url.startswith("wss://"):
+            ssl_context = ssl.create_default_context(cafile=certifi.where())
+        while not self._stopping:
+            try:
+                async with websockets.connect(self.url, ssl=ssl_context, ping_interval=None) as ws:
+                    await ws.send(json.dumps({"op": "login", "args": [login_args(self.api_key, self.secret_key, self.passphrase)]}))
+                    self._on_message(await asyncio.wait_for(ws.recv(), timeout=PING_INTERVAL))
+                    self._subscribed_at = time.time() * 1000
+                    await ws.send(json.dumps({"op": "subscribe", "args": [
+                        {"channel": "positions", "instType": "ANY"},
+                        {"channel": "orders", "instType": "ANY"},
+                        {"channel": "orders-algo", "instType": "ANY"},
+                    ]}))
+                    logging.info("私有频道已登录并订阅: %s", self.url)
+                    if connected_before:
+                        self.reconnects += 1
+                        RETRIES.inc(operation="account_ws_reconnect")
+                    connected_before = True
+                    delay = 1
+                    while True:
+                        try:
+                            raw = await asyncio.wait_for(ws.recv(), timeout=PING_INTERVAL)
+                        except asyncio.TimeoutError:
+                            await ws.send("ping")
+                            continue
+                        self._on_message(raw)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.ready = False
+                if self._stopping:
+                    break
+                logging.warning("私有频道断开: %s, %s，%s 秒后重连", self.url, e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    async def _reconcile_loop(self):
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await loop.run_in_executor(None, self.reconcile)
+            except Exception as e:
+                logging.warning("持仓缓存校正失败: %s", e)
+
+    async def _main(self):
+        await asyncio.gather(self._consume(), self._reconcile_loop(), return_exceptions=True)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._main())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
@@ -1,15 +1,29 @@
+import asyncio
+import copy
+import functools
+import itertools
 import time
-import requests
 import logging
-import pandas as pd
-from okx import MarketData, Trade, Account
+import math
 import uuid
-from datetime import datetime, timezone, timedelta
 from flask import Flask
-from threading import Thread
+from threading import Thread, Lock, get_native_id
+from concurrent.futures import ThreadPoolExecutor
 import os
-from urllib3.exceptions import NameResolutionError
-from tenacity import retry, stop_after_attempt, wait_exponential
+import atexit
+import numpy as np
+from indicators import IndicatorEngine, rolling_mean, ema as ema_series, rsi as rsi_series
+from candle_store import CandleStore, sync_candles, aggregate_candles, OKX_HISTORY_PAGE_LIMIT
+from candle_archive import CandleArchive, BAR_SECONDS
+from okx_clients import get_market_api, get_trade_api, get_account_api, get_public_api
+from notifier import TelegramNotifier
+from execution_scheduler import ExecutionScheduler
+from order_batch import submit_batch, all_ok
+from log_setup import setup_logging
+from rate_limiter import backoff_delay, set_thread_priority, PRIORITY_TRADE
+from state_snapshot import write_snapshot, read_snapshot
+import metrics
+from metrics import INDICATOR_SECONDS, RETRIES, LOOP_ITERATIONS, LAST_CANDLE_AGE, LAST_TICK_AGE
 
 # ============ 配置区域 ============
 
@@ -31,7 +45,10 @@ TEST_MODE = False
 TEST_CLOSE_POSITION = False
 ONLY_TEST_CLOSE = False
 SYMBOL = "BTC-USDT-SWAP"
+SYMBOLS = [s.strip() for s in os.getenv("SYMBOLS", SYMBOL).split(",") if s.strip()]  # 同时运行策略的产品
 CHECK_INTERVAL = 5
+MARKET_DATA_MODE = os.getenv("MARKET_DATA_MODE", "rest")  # "rest"=REST 轮询，"ws"=WebSocket 推送
+ACCOUNT_DATA_MODE = os.getenv("ACCOUNT_DATA_MODE", "ws")  # "ws"=私有频道缓存持仓，"rest"=每次平仓前查询
 COOLDOWN = 1800  # 30分钟冷却期
 ORDER_SIZE = 0.1
 MIN_ORDER_SIZE = 0.001
@@ -39,15 +56,39 @@ RSI_PERIOD = 14
 MA_PERIODS = [20, 60, 120]
 CANDLE_LIMIT = max(MA_PERIODS) + 20
 BAR_INTERVAL = "1m"  # 5分钟周期
+BAR_INTERVALS = [b.strip() for b in os.getenv("BAR_INTERVALS", BAR_INTERVAL).split(",") if b.strip()]  # 同步K线、计算指标的周期
+TRADE_BAR = os.getenv("TRADE_BAR") or BAR_INTERVALS[0]  # 每个产品只在这一个周期上交易，其余周期只计算指标
+if TRADE_BAR not in BAR_INTERVALS:
+    BAR_INTERVALS.insert(0, TRADE_BAR)
+MAX_AGGREGATE_SECS = 21600  # 6H 及以上的K线按 UTC+8 切分，不能由小周期按 UTC 聚合
 RSI_OVERBOUGHT = 80
 RSI_OVERSOLD = 20
 STOP_LOSS_PERCENT = 0.02
+ATTACH_ALGO_ORDERS = os.getenv("ATTACH_ALGO_ORDERS", "1") == "1"  # 开仓时附带交易所止盈止损单，不依赖本地轮询
 TAKE_PROFIT_PERCENT = 0.04
 MIN_AMPLITUDE_PERCENT = 2.0
 MIN_SHADOW_RATIO = 1.0
 MIN_PROFIT = 0.1  # 最小盈利阈值 USDT
-MESSAGE_COUNT = 0  # 每日消息计数器
-MESSAGE_LIMIT = 100  # 每日消息上限
+MESSAGE_LIMIT = 100  # 每日消息上限（UTC 零点重置）
+CALL_TIMEOUT = 30  # 线程池中单次 OKX 调用的最长等待秒数
+PRICE_TIMEOUT = 10  # 拉取价格的最长等待秒数，超时则等下一轮
+EXIT_PRIORITY = 0  # 下单队列优先级：平仓先于开仓
+ENTRY_PRIORITY = 1
+ALGO_CONFIRM_INTERVAL = 30  # 未收到止盈止损单推送时，用 REST 确认其状态的最短间隔秒数
+HEALTH_STALL_SECS = 120  # 行情任务超过此秒数没有完成一轮，/health 报告不健康
+SNAPSHOT_INTERVAL = 30  # 状态快照的保存间隔秒数（下单执行后也会立即保存）
+ORDER_BOOK_CHANNEL = os.getenv("ORDER_BOOK_CHANNEL", "")  # "books" / "books5"：WebSocket 模式下维护本地订单簿，空字符串不订阅
+ORDER_TYPE = os.getenv("ORDER_TYPE", "market")  # "market" 市价；"post_only" 挂在己方最优价，超时未成交改市价；"ioc" 带价格保护的立即成交或取消
+MAX_SLIPPAGE_BPS = 20  # 预估滑点超过此值时告警；IOC 限价偏离对手方最优价的上限
+POST_ONLY_WAIT = 3  # 只挂单等待成交的秒数，超时撤单后剩余数量以市价成交
+ORDER_POLL_INTERVAL = 0.5  # 查询限价单成交状态的间隔秒数
+CANCEL_CONFIRM_TIMEOUT = 5  # 撤单后等待订单进入终态的秒数，未确认前不补市价单
+EXECUTION_ALGO = os.getenv("EXECUTION_ALGO", "")  # "twap" / "pov" / "iceberg"：数量不小于 EXECUTION_MIN_SIZE 的开仓单拆成子单执行，空字符串不拆单
+EXECUTION_MIN_SIZE = 1.0  # 拆单执行的最小开仓数量
+EXECUTION_DURATION = 60  # 拆单执行的最长秒数，到期未成交部分市价补齐
+TWAP_SLICES = 6  # TWAP 分片数
+POV_RATE = 0.1  # POV 参与率：子单数量占同期市场成交量的比例
+ICEBERG_DISPLAY_SIZE = 0.2  # 冰山单每次露出的数量
 
 # 确保日志目录存在
 LOG_DIR = "/tmp"  # 使用 /tmp 目录，Hugging Face 通常允许写入
@@ -58,33 +99,58 @@ try:
 except Exception as e:
     print(f"无法创建日志目录 {LOG_DIR}: {str(e)}")
 
-# 配置日志
-try:
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(funcName)s - %(message)s",
-        handlers=[
-            logging.FileHandler(LOG_FILE, mode='a'),  # 写入 /tmp 日志文件
-            logging.StreamHandler()  # 同时输出到控制台
-        ]
-    )
-    logging.info(f"日志配置成功，写入文件: {LOG_FILE}")
-except PermissionError as e:
-    print(f"无法写入日志文件 {LOG_FILE}: {str(e)}")
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(funcName)s - %(message)s",
-        handlers=[logging.StreamHandler()]  # 回退到仅控制台
-    )
-    logging.warning("日志文件写入失败，仅使用控制台输出")
+# 快照是 pickle 格式，默认放在用户私有的状态目录而不是共享的 /tmp；设为空字符串则不保存/恢复
+SNAPSHOT_FILE = os.getenv("STATE_SNAPSHOT_FILE", os.path.join(os.getenv("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"), "trading_bot", "bot_state.pkl"))
+CANDLE_ARCHIVE_DIR = os.getenv("CANDLE_ARCHIVE_DIR", os.path.join(LOG_DIR, "candle_archive"))  # 本地K线归档目录，设为空字符串则不归档
+
+# 配置日志：交易线程只把记录放入队列，格式化、限流后的写文件（按大小轮转）和控制台输出都在后台线程
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+setup_logging(LOG_FILE, level=getattr(logging, LOG_LEVEL, logging.INFO))
+logging.info("日志配置成功，写入文件: %s", LOG_FILE)
+
+_candle_stores = {}  # (产品, K线周期) -> 本地K线缓存
+_indicator_engines = {}  # (产品, K线周期) -> 增量指标引擎
+_candle_archives = {}  # (产品, K线周期) -> 本地K线归档
+_candle_lock = Lock()  # K线同步与状态快照互斥，保证快照中的K线缓存和指标引擎一致
+_restored_stores = set()  # 从快照恢复、尚未用 REST 补齐重启期间K线的 (产品, K线周期)
+_market_feed = None  # WebSocket 模式下的行情订阅
+_account_cache = None  # 私有频道持仓/订单缓存
+_pos_mode = None  # 启动时缓存的持仓模式 long_short_mode / net_mode
+_tick_sizes = {}  # 产品 -> 价格精度
+_heartbeats = {}  # 运行时任务 -> 最近一次完成处理的时间
+_last_tick_times = {}  # 产品 -> 最近一次收到价格的时间
+_notifier = TelegramNotifier(BOT_TOKEN, CHAT_ID, daily_limit=MESSAGE_LIMIT, api_url=os.getenv("TELEGRAM_API_URL", "https://api.telegram.org"))
+atexit.register(_notifier.stop)  # 退出前发送完队列中的消息
 
 app = Flask(__name__)
 
+def bot_health() -> tuple:
+    """以行情任务的心跳判断机器人是否在运行，返回 (是否健康, 说明)"""
+    last = _heartbeats.get("market_data")
+    if last is None:
+        return False, "机器人未运行"
+    age = time.time() - last
+    if age > HEALTH_STALL_SECS:
+        return False, f"行情任务已 {age:.0f} 秒无响应"
+    return True, "OK"
+
 # Flask 健康检查端点
 @app.route('/health', methods=['GET'])
 def health():
-    logging.info("进入健康检查端点")
-    return "OK", 200
+    logging.debug("进入健康检查端点")
+    healthy, detail = bot_health()
+    return detail, 200 if healthy else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+def _candle_ages() -> dict:
+    now = time.time()
+    return {key: now - store.last_ts / 1000 for key, store in list(_candle_stores.items()) if len(store)}
+
+LAST_CANDLE_AGE.set_function(_candle_ages)
+LAST_TICK_AGE.set_function(lambda: {(symbol,): time.time() - t for symbol, t in list(_last_tick_times.items())})
 
 @app.route('/', methods=['GET'])
 def index():
@@ -93,233 +159,540 @@ def index():
 
 # ============ 功能函数 ============
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
 def send_telegram_message(message: str):
-    global MESSAGE_COUNT
-    logging.info(f"进入 send_telegram_message, 消息: {message}")
-    try:
-        MESSAGE_COUNT += 1
-        if MESSAGE_COUNT > MESSAGE_LIMIT:
-            logging.warning(f"每日消息数 {MESSAGE_COUNT} 超过上限 {MESSAGE_LIMIT}，跳过发送")
-            return False
-
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        payload = {"chat_id": CHAT_ID, "text": message}
-        response = requests.post(url, json=payload, timeout=10)
-        if response.status_code == 429:
-            retry_after = response.json().get('parameters', {}).get('retry_after', 60)
-            logging.warning(f"限流: 等待 {retry_after} 秒重试")
-            time.sleep(retry_after)
-            raise Exception("Retry due to rate limit")
-        if response.status_code != 200:
-            logging.error(f"发送失败: 状态码 {response.status_code}, 响应: {response.text}")
-            return False
-        logging.info("Telegram 消息发送成功")
-        return True
-    except NameResolutionError as e:
-        logging.error(f"DNS 解析失败: {str(e)}")
-        try:
-            response = requests.post("https://149.154.167.220/bot{BOT_TOKEN}/sendMessage", json=payload, timeout=10)
-            if response.status_code != 200:
-                logging.error(f"备用 DNS 发送失败: {response.status_code}, {response.text}")
-                return False
-            logging.info("备用 DNS 发送成功")
-            return True
-        except Exception as e2:
-            logging.error(f"备用 DNS 失败: {str(e2)}")
-            return False
-    except Exception as e:
-        logging.error(f"发送异常: {str(e)}")
-        return False
+    # 只入队，由后台线程合并、限流后发送，不阻塞下单和主循环
+    return _notifier.notify(message)
+
+def candle_column(data, index: int) -> np.ndarray:
+    """OKX 格式K线（最新在前）的一列，按时间从旧到新"""
+    return np.array([float(candle[index]) for candle in reversed(data)])
+
+def is_missing(value) -> bool:
+    return value is None or math.isnan(value)
 
 def calculate_rsi(data, periods=RSI_PERIOD):
-    logging.info(f"进入 calculate_rsi, 数据长度: {len(data)}, 周期: {periods}")
+    logging.debug("进入 calculate_rsi, 数据长度: %s, 周期: %s", len(data), periods)
     try:
-        reversed_data = data[::-1]
-        closes = pd.Series([float(candle[4]) for candle in reversed_data])
-        delta = closes.diff()
-        up = delta.clip(lower=0).rolling(window=periods).mean()
-        down = -delta.clip(upper=0).rolling(window=periods).mean()
-        rs = up / down
-        rsi = pd.Series(100 - (100 / (1 + rs)), index=closes.index)
-        latest_rsi = rsi.iloc[-1]
-        if pd.isna(latest_rsi):
+        latest_rsi = float(rsi_series(candle_column(data, 4), periods)[-1])
+        if math.isnan(latest_rsi):
             logging.warning("RSI 计算结果为 NaN")
             return None
-        if down.iloc[-1] == 0:
-            latest_rsi = 100
-        logging.info(f"RSI 计算成功: {latest_rsi:.2f}")
+        logging.debug("RSI 计算成功: %.2f", latest_rsi)
         return latest_rsi
     except Exception as e:
-        logging.error(f"RSI 计算失败: {str(e)}")
+        logging.error("RSI 计算失败: %s", e)
         return None
 
 def calculate_ma_ema(data, periods):
-    logging.info(f"进入 calculate_ma_ema, 数据长度: {len(data)}, 周期: {periods}")
+    logging.debug("进入 calculate_ma_ema, 数据长度: %s, 周期: %s", len(data), periods)
     try:
-        reversed_data = data[::-1]
-        closes = pd.Series([float(candle[4]) for candle in reversed_data])
-        ma = {f"MA{p}": closes.rolling(window=p).mean().iloc[-1] for p in periods}
-        ema = {f"EMA{p}": closes.ewm(span=p, adjust=False).mean().iloc[-1] for p in periods}
-        logging.info("MA/EMA 计算成功")
+        closes = candle_column(data, 4)
+        ma = {f"MA{p}": float(rolling_mean(closes, p)[-1]) for p in periods}
+        ema = {f"EMA{p}": float(ema_series(closes, p)[-1]) for p in periods}
+        logging.debug("MA/EMA 计算成功")
         return ma, ema
     except Exception as e:
-        logging.error(f"MA/EMA 计算失败: {str(e)}")
+        logging.error("MA/EMA 计算失败: %s", e)
         return {}, {}
 
 def calculate_ma_concentration(ma, ema):
-    logging.info(f"进入 calculate_ma_concentration")
-    all_lines = [line for line in list(ma.values()) + list(ema.values()) if not pd.isna(line)]
-    logging.info(f"参与计算的均线值: {len(all_lines)} 条")
+    logging.debug("进入 calculate_ma_concentration")
+    all_lines = [line for line in list(ma.values()) + list(ema.values()) if not is_missing(line)]
+    logging.debug("参与计算的均线值: %s 条", len(all_lines))
     if len(all_lines) < 2:
         logging.warning("有效均线数量不足，无法计算密集度")
         return float('inf')
     max_diff = max(all_lines) - min(all_lines)
-    logging.info(f"均线密集度计算成功: {max_diff:.2f}")
+    logging.debug("均线密集度计算成功: %.2f", max_diff)
     return max_diff
 
 def calculate_avg_volume(data, periods=10):
-    logging.info(f"进入 calculate_avg_volume, 数据长度: {len(data)}, 周期: {periods}")
+    logging.debug("进入 calculate_avg_volume, 数据长度: %s, 周期: %s", len(data), periods)
     try:
-        reversed_data = data[::-1]
-        volumes = pd.Series([float(candle[5]) for candle in reversed_data])
-        avg_volume = volumes.rolling(window=periods).mean().iloc[-1]
-        logging.info(f"平均成交量计算成功")
+        avg_volume = float(rolling_mean(candle_column(data, 5), periods)[-1])
+        logging.debug("平均成交量计算成功")
         return avg_volume
     except Exception as e:
-        logging.error(f"平均成交量计算失败: {str(e)}")
+        logging.error("平均成交量计算失败: %s", e)
         return None
 
 def determine_position(close, ma, ema):
-    logging.info(f"进入 determine_position, 收盘价: {close}")
-    all_lines = [line for line in list(ma.values()) + list(ema.values()) if not pd.isna(line)]
+    logging.debug("进入 determine_position, 收盘价: %s", close)
+    all_lines = [line for line in list(ma.values()) + list(ema.values()) if not is_missing(line)]
     if not all_lines:
         logging.warning("无有效均线数据")
         return "无有效均线"
     if all(close > line for line in all_lines):
-        logging.info("收盘价在所有均线之上")
+        logging.debug("收盘价在所有均线之上")
         return "在所有均线之上"
     elif all(close < line for line in all_lines):
-        logging.info("收盘价在所有均线之下")
+        logging.debug("收盘价在所有均线之下")
         return "在所有均线之下"
     else:
-        logging.info("收盘价在均线之间")
+        logging.debug("收盘价在均线之间")
         return "在均线之间"
 
+def get_candle_store(symbol: str, bar: str) -> CandleStore:
+    key = (symbol, bar)
+    if key not in _candle_stores:
+        _candle_stores[key] = CandleStore(CANDLE_LIMIT)
+    return _candle_stores[key]
+
+def get_candle_archive(symbol: str, bar: str):
+    if not CANDLE_ARCHIVE_DIR:
+        return None
+    key = (symbol, bar)
+    if key not in _candle_archives:
+        _candle_archives[key] = CandleArchive.for_symbol(CANDLE_ARCHIVE_DIR, symbol, bar)
+    return _candle_archives[key]
+
+def warm_start_store(symbol: str, bar: str, store: CandleStore) -> bool:
+    """用本地归档的最近K线预填空缓存，之后只需从交易所补齐归档之后的几根
+
+    归档过旧、或最近 store.capacity 根K线不连续（停机、归档写入失败留下的断档）时不使用，由 backfill_candles 回补。
+    """
+    archive = get_candle_archive(symbol, bar)
+    if archive is None or len(store) > 0 or archive.last_ts is None:
+        return False
+    interval_ms = get_interval_seconds(bar) * 1000
+    if (time.time() * 1000 - archive.last_ts) // interval_ms >= OKX_HISTORY_PAGE_LIMIT:
+        return False
+    records = archive.read()[-store.capacity:]
+    if len(records) < store.capacity or np.any(np.diff(records["ts"]) != interval_ms):
+        logging.info("本地归档最近的K线不足或有断档，改为从交易所回补: %s %s", symbol, bar)
+        return False
+    for record in records:
+        store.upsert(*record.tolist())
+    logging.info("从本地归档预热K线缓存: %s %s, K线数: %s", symbol, bar, len(store))
+    return True
+
+def archive_closed_candles(symbol: str, bar: str, store: CandleStore):
+    """把缓存中已收盘且尚未归档的K线追加到本地归档（最新一根之前的K线都已收盘）"""
+    archive = get_candle_archive(symbol, bar)
+    if archive is None or len(store) < 2:
+        return
+    last_ts = archive.last_ts or 0
+    if store.row(-2)[0] <= last_ts:
+        return
+    ts, ohlcv = store.latest()
+    mask = (ts > last_ts) & (ts < store.last_ts)
+    try:
+        archive.append(zip(ts[mask].tolist(), *ohlcv[mask].T.tolist()))
+    except OSError as e:
+        logging.warning("K线归档写入失败: %s %s, %s", symbol, bar, e)
+
+def update_indicator_engine(symbol: str, bar: str, store: CandleStore, reseed: bool, changed_rows):
+    key = (symbol, bar)
+    engine = _indicator_engines.get(key)
+    if engine is None or reseed:
+        logging.info("初始化增量指标引擎: %s %s, K线数: %s", symbol, bar, len(store))
+        engine = IndicatorEngine(RSI_PERIOD, MA_PERIODS, window=CANDLE_LIMIT)
+        engine.seed_arrays(store.latest()[0], store.closes(), store.volumes())
+        _indicator_engines[key] = engine
+        return engine
+    for ts, _, _, _, close, volume in changed_rows:
+        engine.on_candle(ts, close, volume)
+    return engine
+
 def get_interval_seconds(interval: str) -> int:
-    logging.info(f"进入 get_interval_seconds, 周期: {interval}")
-    interval_map = {
-        "1m": 60, "3m": 180, "5m": 300, "15m": 900, "30m": 1800,
-        "1H": 3600, "2H": 7200, "4H": 14400, "6H": 21600, "12H": 43200,
-        "1D": 86400
-    }
-    seconds = interval_map.get(interval, 60)
-    logging.info(f"周期转换成功: {seconds}秒")
+    logging.debug("进入 get_interval_seconds, 周期: %s", interval)
+    seconds = BAR_SECONDS.get(interval, 60)
+    logging.debug("周期转换成功: %s秒", seconds)
     return seconds
 
 def get_account_config():
-    logging.info("进入 get_account_config")
+    logging.debug("进入 get_account_config")
     try:
         flag = "1" if IS_DEMO else "0"
-        account = Account.AccountAPI(api_key=API_KEY, api_secret_key=SECRET_KEY, passphrase=PASS_PHRASE, flag=flag)
+        account = get_account_api(API_KEY, SECRET_KEY, PASS_PHRASE, flag)
         result = account.get_account_config()
         if result.get("code") == "0" and result.get("data"):
-            logging.info("账户配置查询成功")
+            logging.debug("账户配置查询成功")
             return result["data"][0]
         else:
             error_details = result.get("msg", "未知错误")
-            logging.error(f"查询账户配置失败: {error_details}")
+            logging.error("查询账户配置失败: %s", error_details)
             return {}
     except Exception as e:
-        logging.error(f"查询账户配置异常: {str(e)}")
+        logging.error("查询账户配置异常: %s", e)
         return {}
 
-def get_positions():
-    logging.info("进入 get_positions")
+def get_positions(symbol: str = SYMBOL):
+    logging.debug("进入 get_positions, 产品: %s", symbol)
     try:
         flag = "1" if IS_DEMO else "0"
-        account = Account.AccountAPI(api_key=API_KEY, api_secret_key=SECRET_KEY, passphrase=PASS_PHRASE, flag=flag)
-        result = account.get_positions(instId=SYMBOL)
+        account = get_account_api(API_KEY, SECRET_KEY, PASS_PHRASE, flag)
+        result = account.get_positions(instId=symbol)
         if result.get("code") == "0" and result.get("data"):
-            logging.info("持仓查询成功")
+            logging.debug("持仓查询成功")
             return result["data"]
         else:
             error_details = result.get("msg", "未知错误")
-            logging.error(f"查询持仓失败: {error_details}")
+            logging.error("查询持仓失败: %s", error_details)
             return []
     except Exception as e:
-        logging.error(f"查询持仓异常: {str(e)}")
+        logging.error("查询持仓异常: %s", e)
         return []
 
-def get_latest_price_and_indicators(symbol: str, fetch_candles=True) -> tuple:
-    logging.info(f"进入 get_latest_price_and_indicators, 产品: {symbol}, 获取K线: {fetch_candles}")
-    attempt = 0
-    max_attempts = 5
-    while attempt < max_attempts:
+def fetch_all_positions():
+    """REST 查询全部持仓，用于校正持仓缓存；失败返回 None（与无持仓区分）"""
+    try:
+        flag = "1" if IS_DEMO else "0"
+        account = get_account_api(API_KEY, SECRET_KEY, PASS_PHRASE, flag)
+        result = account.get_positions()
+        if result.get("code") == "0":
+            return result.get("data") or []
+        logging.error("查询全部持仓失败: %s", result.get('msg', '未知错误'))
+    except Exception as e:
+        logging.error("查询全部持仓异常: %s", e)
+    return None
+
+def get_pos_mode() -> str:
+    """持仓模式只在启动时查询一次，失败时下次使用再查"""
+    global _pos_mode
+    if _pos_mode is None:
+        _pos_mode = get_account_config().get("posMode")
+        if _pos_mode:
+            logging.info("账户持仓模式: %s", _pos_mode)
+    return _pos_mode or "long_short_mode"
+
+def get_tick_size(symbol: str):
+    """产品价格精度（tickSz），首次查询后缓存；查询失败返回 None"""
+    if symbol not in _tick_sizes:
         try:
-            attempt += 1
-            flag = "1" if IS_DEMO else "0"
-            market = MarketData.MarketAPI(flag=flag)
-            ticker_data = market.get_ticker(instId=symbol)
-            if ticker_data.get("code") != "0":
-                logging.warning(f"Ticker API 失败 (尝试 {attempt}): {ticker_data.get('msg')}")
-                time.sleep(2)
-                continue
-            price = float(ticker_data["data"][0]["last"])
-            logging.info("价格获取成功")
-            
-            if not fetch_candles:
-                logging.info("仅获取价格，跳过K线数据")
-                return (price, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None)
-            
-            marketDataAPI = MarketData.MarketAPI(flag=flag)
-            result = marketDataAPI.get_history_candlesticks(
-                instId=symbol,
-                bar=BAR_INTERVAL,
-                limit=str(CANDLE_LIMIT)
-            )
-            if result.get("code") == "0" and result.get("data"):
-                logging.info("K线数据获取成功")
-                candle = result["data"][0]
-                candle_ts = int(candle[0]) // 1000
-                prev_candle = result["data"][1] if len(result["data"]) > 1 else candle
-                open_price = float(candle[1])
-                high = float(candle[2])
-                low = float(candle[3])
-                close = float(candle[4])
-                volume = float(candle[5])
-                prev_close = float(prev_candle[4])
-                
-                upper_shadow = high - max(open_price, close)
-                lower_shadow = min(open_price, close) - low
-                amplitude_percent = (high - low) / low * 100 if low != 0 else 0.0
-                rsi = calculate_rsi(result["data"])
-                ma, ema = calculate_ma_ema(result["data"], MA_PERIODS)
-                position = determine_position(close, ma, ema)
-                avg_volume = calculate_avg_volume(result["data"])
-                ma_concentration = calculate_ma_concentration(ma, ema)
-                
-                logging.info("指标计算完成")
-                return price, volume, upper_shadow, lower_shadow, amplitude_percent, rsi, ma, ema, position, close, prev_close, avg_volume, open_price, high, low, ma_concentration
-            else:
-                logging.warning(f"K线 API 失败 (尝试 {attempt}): {result.get('msg')}")
-                time.sleep(2)
-                continue
+            public = get_public_api("1" if IS_DEMO else "0")
+            result = public.get_instruments(instType=get_inst_type(symbol), instId=symbol)
+            if result.get("code") != "0" or not result.get("data"):
+                logging.error("查询产品信息失败: %s, %s", symbol, result.get('msg', '未知错误'))
+                return None
+            _tick_sizes[symbol] = result["data"][0]["tickSz"]
         except Exception as e:
-            logging.warning(f"获取数据失败 (尝试 {attempt}): {str(e)}")
-            time.sleep(2)
+            logging.error("查询产品信息异常: %s, %s", symbol, e)
+            return None
+    return _tick_sizes[symbol]
+
+def format_price(symbol: str, price: float) -> str:
+    """按产品价格精度格式化下单价格，精度未知时保留 8 位有效数字"""
+    tick_size = get_tick_size(symbol)
+    if not tick_size:
+        return f"{price:.8g}"
+    decimals = len(tick_size.split(".")[1]) if "." in tick_size else 0
+    return f"{round(price / float(tick_size)) * float(tick_size):.{decimals}f}"
+
+def build_attach_algo_ords(symbol: str, stop_loss: float, take_profit: float) -> list:
+    """开仓单附带的止盈止损：按最新价触发，市价（ordPx=-1）成交"""
+    algo = {"attachAlgoClOrdId": "a" + str(int(time.time() * 1000)) + uuid.uuid4().hex[:8]}
+    if take_profit:
+        algo.update(tpTriggerPx=format_price(symbol, take_profit), tpOrdPx="-1", tpTriggerPxType="last")
+    if stop_loss:
+        algo.update(slTriggerPx=format_price(symbol, stop_loss), slOrdPx="-1", slTriggerPxType="last")
+    return [algo]
+
+def cached_position_open(symbol: str, pos_side: str):
+    """私有频道缓存中是否有该方向的持仓，缓存不可用时返回 None"""
+    if _account_cache is None or not _account_cache.ready:
+        return None
+    return any(p.get("posSide") in (pos_side, "net") for p in _account_cache.get_positions(symbol))
+
+def get_exchange_exit_status(symbol: str, pos_side: str, algo_cl_ord_id: str, position_seen: bool = False):
+    """交易所止盈止损的状态："protected" 仍在保护，"closed" 已触发平仓，None 无法确认（回退到本地检查）
+
+    只有推送或 REST 确认策略单处于生效状态才算 "protected"。"closed" 只在策略单已触发，
+    或开仓后缓存中出现过的持仓（position_seen）又消失时返回；开仓后持仓推送可能还没到，缓存中没有持仓不代表已平仓。
+    """
+    if _account_cache is None or not _account_cache.ready:
+        return None
+    algo = _account_cache.get_algo_order(algo_cl_ord_id)
+    if algo is not None and algo.get("state") == "effective":
+        return "closed"
+    if position_seen and not cached_position_open(symbol, pos_side):
+        return "closed"
+    if algo is not None and algo.get("state") in ("live", "pause", "partially_effective"):
+        return "protected"
+    return None  # 尚未收到状态，或 canceled / order_failed：保护失效
+
+def exit_algo_unknown(algo_cl_ord_id: str) -> bool:
+    """私有频道缓存可用但还没有该止盈止损单的状态（推送未到或丢失）"""
+    return _account_cache is not None and _account_cache.ready and _account_cache.get_algo_order(algo_cl_ord_id) is None
+
+def fetch_exit_algo(symbol: str, algo_cl_ord_id: str):
+    """用 REST 查询止盈止损单并写入缓存，返回策略单信息；查询失败返回 None"""
+    try:
+        trade = get_trade_api(API_KEY, SECRET_KEY, PASS_PHRASE, "1" if IS_DEMO else "0")
+        result = trade.get_algo_order_details(algoClOrdId=algo_cl_ord_id)
+        if result.get("code") != "0" or not result.get("data"):
+            logging.warning("查询止盈止损单失败: %s %s, %s", symbol, algo_cl_ord_id, result.get("msg"))
+            return None
+        if _account_cache is not None:
+            _account_cache.apply_algo_orders(result["data"])
+        return result["data"][0]
+    except Exception as e:
+        logging.warning("查询止盈止损单异常: %s %s, %s", symbol, algo_cl_ord_id, e)
+        return None
+
+def get_open_positions(symbol: str = SYMBOL) -> list:
+    """持仓量不为 0 的仓位：缓存可用时不发请求，否则回退到 REST 查询"""
+    if _account_cache is not None and _account_cache.ready:
+        return _account_cache.get_positions(symbol)
+    return [p for p in get_positions(symbol) if p.get("pos") not in (None, "", "0")]
+
+def get_base_bar(bars) -> str:
+    return min(bars, key=get_interval_seconds)
+
+def can_aggregate(base_bar: str, bar: str) -> bool:
+    """大周期能否由最小周期的本地K线聚合得到"""
+    base_secs, secs = get_interval_seconds(base_bar), get_interval_seconds(bar)
+    return secs > base_secs and secs % base_secs == 0 and secs < MAX_AGGREGATE_SECS and secs // base_secs <= CANDLE_LIMIT
+
+def get_inst_type(symbol: str) -> str:
+    parts = symbol.split("-")
+    if parts[-1] == "SWAP":
+        return "SWAP"
+    if len(parts) == 3 and parts[-1].isdigit():
+        return "FUTURES"
+    return "OPTION" if len(parts) > 3 else "SPOT"
+
+def get_latest_prices(symbols) -> dict:
+    """批量获取最新价格：WebSocket 已推送的直接使用，其余按产品类型各调用一次 get_tickers"""
+    logging.debug("进入 get_latest_prices, 产品: %s", symbols)
+    prices = {}
+    if _market_feed is not None:
+        prices = {s: _market_feed.prices[s] for s in symbols if s in _market_feed.prices}
+    missing = [s for s in symbols if s not in prices]
+    if not missing:
+        return prices
+    flag = "1" if IS_DEMO else "0"
+    market = get_market_api(flag)
+    if len(missing) == 1:
+        result = market.get_ticker(instId=missing[0])
+        tickers = {missing[0]: result}
+    else:
+        tickers = {inst_type: market.get_tickers(instType=inst_type) for inst_type in sorted({get_inst_type(s) for s in missing})}
+    wanted = set(missing)
+    for key, result in tickers.items():
+        if result.get("code") != "0":
+            logging.warning("Ticker API 失败: %s, %s", key, result.get('msg'))
             continue
-    logging.error(f"达到最大尝试次数 {max_attempts}，无法获取数据")
+        for ticker in result.get("data", []):
+            if ticker.get("instId") in wanted and ticker.get("last"):
+                prices[ticker["instId"]] = float(ticker["last"])
+    logging.debug("价格获取成功: %s/%s", len(prices), len(symbols))
+    return prices
+
+def sync_bar_candles(market, symbol: str, bar: str):
+    """同步单个周期的K线缓存：WebSocket 推送优先，否则走 REST；缓存为空时先用本地归档预热"""
+    store = get_candle_store(symbol, bar)
+    warm = len(store) == 0 and warm_start_store(symbol, bar, store)
+    restored = (symbol, bar) in _restored_stores
+    feed = _market_feed
+    if feed is None or symbol not in feed.symbols or bar not in feed.bars:
+        synced = sync_candles(market, store, symbol, bar, get_interval_seconds(bar))
+    elif len(store) > 0 and not warm and not restored and not feed.take_resync(symbol, bar):
+        # WebSocket 推送的K线直接写入缓存，无需 REST 请求
+        synced = False, store.upsert_okx(feed.drain_candles(symbol, bar))
+    else:
+        feed.drain_candles(symbol, bar)
+        synced = sync_candles(market, store, symbol, bar, get_interval_seconds(bar))
+    if synced is None:
+        if warm:
+            store.clear()  # 没能补齐归档之后的K线，下次重新预热
+        return None
+    _restored_stores.discard((symbol, bar))
+    archive_closed_candles(symbol, bar, store)
+    return (True, []) if warm else synced
+
+def sync_symbol_candles(market, symbol: str, bars) -> dict:
+    """同步一个产品全部周期的K线：最小周期从交易所同步，大周期尽量由它聚合，返回 {周期: (是否重建, 变化行)}"""
+    bars = sorted(set(bars), key=get_interval_seconds)
+    base_bar = bars[0]
+    results = {}
+    base = sync_bar_candles(market, symbol, base_bar)
+    if base is not None:
+        results[base_bar] = base
+    for bar in bars[1:]:
+        store = get_candle_store(symbol, bar)
+        if base is not None and not base[0] and len(store) > 0 and can_aggregate(base_bar, bar):
+            results[bar] = (False, aggregate_candles(get_candle_store(symbol, base_bar), store, get_interval_seconds(bar), base[1]))
+            archive_closed_candles(symbol, bar, store)
+            continue
+        synced = sync_bar_candles(market, symbol, bar)
+        if synced is not None:
+            results[bar] = synced
+    return results
+
+def build_indicator_data(symbol: str, bar: str, price: float, synced) -> tuple:
+    """用K线缓存和增量指标引擎组装策略所需的数据"""
+    store = get_candle_store(symbol, bar)
+    if synced is None or len(store) == 0:
+        return None
+    reseed, changed_rows = synced
+    candle_ts, open_price, high, low, close, volume = store.row(-1)
+    prev_close = store.row(-2)[4] if len(store) > 1 else close
+
+    upper_shadow = high - max(open_price, close)
+    lower_shadow = min(open_price, close) - low
+    amplitude_percent = (high - low) / low * 100 if low != 0 else 0.0
+    with INDICATOR_SECONDS.time(bar=bar):
+        engine = update_indicator_engine(symbol, bar, store, reseed, changed_rows)
+        rsi = engine.rsi
+        ma, ema = engine.ma, engine.ema
+        position = determine_position(close, ma, ema)
+        avg_volume = engine.avg_volume
+        ma_concentration = engine.ma_concentration
+
+    logging.debug("指标计算完成: %s %s", symbol, bar)
+    return price, volume, upper_shadow, lower_shadow, amplitude_percent, rsi, ma, ema, position, close, prev_close, avg_volume, open_price, high, low, ma_concentration
+
+def get_latest_price_and_indicators(symbol: str, fetch_candles=True, bar: str = BAR_INTERVAL) -> tuple:
+    logging.debug("进入 get_latest_price_and_indicators, 产品: %s, 周期: %s, 获取K线: %s", symbol, bar, fetch_candles)
+    # 网络错误和限流的重试由 okx_clients 的请求调度器统一处理，这里失败即返回
+    try:
+        flag = "1" if IS_DEMO else "0"
+        market = get_market_api(flag)
+        price = get_latest_prices([symbol]).get(symbol)
+        if price is None:
+            logging.error("价格获取失败: %s", symbol)
+            return None
+
+        if not fetch_candles:
+            logging.info("仅获取价格，跳过K线数据")
+            return (price, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None)
+
+        data = build_indicator_data(symbol, bar, price, sync_bar_candles(market, symbol, bar))
+        if data is None:
+            logging.error("K线同步失败: %s %s", symbol, bar)
+        return data
+    except Exception as e:
+        logging.error("获取数据失败: %s", e)
+        return None
+
+def get_order_book(symbol: str):
+    """WebSocket 维护的本地订单簿，不可用时返回 None"""
+    return _market_feed.get_book(symbol) if _market_feed is not None else None
+
+def estimate_slippage(symbol: str, side: str, size: float):
+    """下单前按本地订单簿估算市价单滑点并记录，滑点过大或深度不足时告警；没有订单簿时返回 None"""
+    book = get_order_book(symbol)
+    estimate = book.estimate_fill(side, size) if book is not None else None
+    if estimate is None:
+        return None
+    logging.info("预估成交: %s %s %s, 均价 %.8g, 滑点 %.1f bps", symbol, side.upper(), size, estimate["avg_price"], estimate["slippage_bps"])
+    if estimate["slippage_bps"] > MAX_SLIPPAGE_BPS or estimate["filled"] < size:
+        logging.warning("盘口深度不足: %s %s %s, 预估滑点 %.1f bps, 可成交 %s", symbol, side.upper(), size, estimate["slippage_bps"], estimate["filled"])
+    return estimate
+
+def build_order_params(symbol: str, side: str, price: float) -> dict:
+    """按 ORDER_TYPE 生成 ordType 和限价：只挂单挂在己方最优价，IOC 以对手方最优价加保护偏移为限价；缺少盘口时按需回退"""
+    book = get_order_book(symbol)
+    if ORDER_TYPE == "post_only" and book is not None:
+        best = book.best_bid() if side == "buy" else book.best_ask()
+        if best is not None:
+            return {"ordType": "post_only", "px": format_price(symbol, best)}
+    elif ORDER_TYPE == "ioc":
+        protected = book.protected_price(side, MAX_SLIPPAGE_BPS) if book is not None else None
+        if protected is None:
+            protected = price * (1 + MAX_SLIPPAGE_BPS / 10000) if side == "buy" else price * (1 - MAX_SLIPPAGE_BPS / 10000)
+        return {"ordType": "ioc", "px": format_price(symbol, protected)}
+    return {"ordType": "market"}
+
+def wait_order_fill(trade, symbol: str, ord_id: str, timeout: float) -> tuple:
+    """轮询订单直到完全成交、被撤销或超时，返回 (状态, 已成交数量)"""
+    deadline = time.time() + timeout
+    while True:
+        result = trade.get_order(instId=symbol, ordId=ord_id)
+        data = (result.get("data") or [{}])[0] if result.get("code") == "0" else {}
+        state, filled = data.get("state"), float(data.get("accFillSz") or 0)
+        if state in ("filled", "canceled", "mmp_canceled") or time.time() >= deadline:
+            return state, filled
+        time.sleep(ORDER_POLL_INTERVAL)
+
+def is_scheduled(size: float) -> bool:
+    """开仓数量是否走拆单执行"""
+    return bool(EXECUTION_ALGO) and size >= EXECUTION_MIN_SIZE
+
+def get_passive_price(symbol: str, side: str):
+    """己方最优价：优先读本地订单簿，否则查询 ticker 的买一/卖一；都不可用时返回 None（子单改为市价）"""
+    book = get_order_book(symbol)
+    if book is not None:
+        return book.best_bid() if side == "buy" else book.best_ask()
+    try:
+        result = get_market_api("1" if IS_DEMO else "0").get_ticker(instId=symbol)
+        data = result["data"][0] if result.get("code") == "0" and result.get("data") else {}
+        price = data.get("bidPx" if side == "buy" else "askPx")
+        return float(price) if price else None
+    except Exception as e:
+        logging.warning("查询盘口价格异常: %s, %s", symbol, e)
+        return None
+
+def get_traded_volume(symbol: str, since: float):
+    """since（秒）所在分钟起的 1m K线成交量之和，供 POV 计算参与量；查询失败返回 None"""
+    try:
+        result = get_market_api("1" if IS_DEMO else "0").get_candlesticks(instId=symbol, bar="1m", limit="100")
+        if result.get("code") != "0":
+            return None
+        start_ms = int(since // 60 * 60 * 1000)
+        return sum(float(c[5]) for c in result.get("data", []) if int(c[0]) >= start_ms)
+    except Exception as e:
+        logging.warning("查询成交量异常: %s, %s", symbol, e)
+        return None
+
+def place_scheduled_order(trade, side: str, price: float, size: float, symbol: str, pos_params: dict) -> dict:
+    """按 EXECUTION_ALGO 拆单执行，返回与 place_order 接口相同格式的结果，execution 为执行报告"""
+    book = get_order_book(symbol)
+    arrival_price = (book.mid() if book is not None else None) or price
+    scheduler = ExecutionScheduler(
+        trade,
+        symbol,
+        pos_params,
+        quote=functools.partial(get_passive_price, symbol),
+        market_volume=functools.partial(get_traded_volume, symbol),
+        format_price=functools.partial(format_price, symbol),
+        lot_size=MIN_ORDER_SIZE,
+        poll_interval=ORDER_POLL_INTERVAL,
+    )
+    parent = scheduler.run(side, size, EXECUTION_ALGO, EXECUTION_DURATION, arrival_price,
+                           slices=TWAP_SLICES, rate=POV_RATE, display_size=ICEBERG_DISPLAY_SIZE)
+    report = parent.report()
+    logging.info("拆单执行报告: %s %s %s, 成交 %s/%s, 均价 %.8g, 到达价 %.8g, 滑点 %.1f bps, 子单 %s, 改价 %s, 耗时 %.1fs",
+                 symbol, side.upper(), report["algo"], round(report["filled"], 10), size, report["avg_price"], report["arrival_price"],
+                 report["slippage_bps"], report["children"], report["replaced"], report["duration"])
+    if report["filled"] <= 0:
+        return {"code": "1", "msg": f"{report['algo']} 拆单执行未成交", "data": [], "execution": report}
+    return {"code": "0", "msg": "", "data": [{"ordId": parent.children[0].ord_id, "sCode": "0", "sMsg": ""}],
+            "filled_sz": report["filled"], "execution": report}
+
+def place_position_tpsl(trade, symbol: str, side: str, attach_algo_ords: list, pos_params: dict):
+    """为整个仓位挂一张止盈止损策略单（closeFraction=1，随持仓全部平掉）
+
+    沿用 build_attach_algo_ords 的触发价和 ID，成功时原样返回 attach_algo_ords 以便调用方跟踪，失败返回 None。
+    """
+    algo = dict(attach_algo_ords[0])
+    algo_cl_ord_id = algo.pop("attachAlgoClOrdId")
+    ord_type = "oco" if "tpTriggerPx" in algo and "slTriggerPx" in algo else "conditional"
+    # 单向持仓模式下全部平仓需要只减仓
+    extra = {} if pos_params else {"reduceOnly": "true"}
+    result = trade.place_algo_order(instId=symbol, tdMode="cross", side="sell" if side == "buy" else "buy", ordType=ord_type,
+                                    closeFraction="1", algoClOrdId=algo_cl_ord_id, **algo, **pos_params, **extra)
+    if result.get("code") == "0" and result.get("data") and result["data"][0].get("sCode") == "0":
+        return attach_algo_ords
+    error_details = result["data"][0].get("sMsg", "") if result.get("data") else result.get("msg", "未知错误")
+    logging.error("仓位止盈止损挂单失败: %s, %s", symbol, error_details)
+    send_telegram_message(f"❌ 仓位止盈止损挂单失败: {symbol}, {error_details}，由本地轮询止盈止损")
     return None
 
-def place_order(side: str, price: float, size: float, stop_loss: float = None, take_profit: float = None):
-    logging.info(f"进入 place_order, side: {side}, 价格: {price}, 数量: {size}, 止损: {stop_loss}, 止盈: {take_profit}")
+def place_order(side: str, price: float, size: float, stop_loss: float = None, take_profit: float = None, symbol: str = SYMBOL):
+    logging.info("进入 place_order, 产品: %s, side: %s, 价格: %s, 数量: %s, 止损: %s, 止盈: %s", symbol, side, price, size, stop_loss, take_profit)
     try:
         flag = "1" if IS_DEMO else "0"
-        trade = Trade.TradeAPI(api_key=API_KEY, api_secret_key=SECRET_KEY, passphrase=PASS_PHRASE, flag=flag)
+        trade = get_trade_api(API_KEY, SECRET_KEY, PASS_PHRASE, flag)
         pos_side = "long" if side == "buy" else "short"
+        # 单向持仓模式下不能传 posSide
+        pos_params = {"posSide": pos_side} if get_pos_mode() == "long_short_mode" else {}
+        attach_algo_ords = None
+        if ATTACH_ALGO_ORDERS and (stop_loss or take_profit):
+            attach_algo_ords = build_attach_algo_ords(symbol, stop_loss, take_profit)
         order_id = str(int(time.time() * 1000)) + str(uuid.uuid4())[:8]
-        logging.info(f"尝试下单: {side.upper()}, 价格: {price}, 数量: {size}, 订单ID: {order_id}")
+        logging.info("尝试下单: %s, 价格: %s, 数量: %s, 订单ID: %s", side.upper(), price, size, order_id)
         
         sz = str(size)
         if float(sz) <= 0:
@@ -327,74 +700,242 @@ def place_order(side: str, price: float, size: float, stop_loss: float = None, t
             logging.error(error_msg)
             return None
             
-        order = trade.place_order(
-            instId=SYMBOL,
-            tdMode="cross",
-            side=side,
-            posSide=pos_side,
-            ordType="market",
-            sz=sz,
-        )
+        if is_scheduled(size):
+            order_params = {"ordType": EXECUTION_ALGO}
+            order = place_scheduled_order(trade, side, price, size, symbol, pos_params)
+            if order.get("code") == "0" and attach_algo_ords:
+                # 子单不附带止盈止损，全部结束后为整个仓位挂一张
+                attach_algo_ords = place_position_tpsl(trade, symbol, side, attach_algo_ords, pos_params)
+        else:
+            estimate_slippage(symbol, side, size)
+            order_params = build_order_params(symbol, side, price)
+            order = trade.place_order(
+                instId=symbol,
+                tdMode="cross",
+                side=side,
+                sz=sz,
+                attachAlgoOrds=attach_algo_ords,
+                **order_params,
+                **pos_params,
+            )
+            if order.get("code") == "0" and order.get("data") and order["data"][0].get("sCode") == "0" and order_params["ordType"] != "market":
+                order, attach_algo_ords = settle_limit_order(trade, order, order_params["ordType"], side, size, stop_loss, take_profit, symbol, pos_params, attach_algo_ords)
         if order.get("code") == "0" and order.get("data") and order["data"][0].get("sCode") == "0":
-            msg = f"✅ 下单成功: {side.upper()} | 止损: {stop_loss:.2f} | 止盈: {take_profit:.2f}"
+            msg = f"✅ 下单成功: {symbol} {side.upper()} | 止损: {stop_loss:.2f} | 止盈: {take_profit:.2f}"
+            if order_params["ordType"] != "market":
+                msg += f" | {order_params['ordType']} 成交 {order['filled_sz']:g}/{size:g}"
+            if "execution" in order:
+                report = order["execution"]
+                msg += f" | 均价 {report['avg_price']:.8g}, 到达价 {report['arrival_price']:.8g}, 滑点 {report['slippage_bps']:.1f} bps"
+            if attach_algo_ords:
+                # 调用方据此跟踪交易所止盈止损单
+                order["algo_cl_ord_id"] = attach_algo_ords[0]["attachAlgoClOrdId"]
+                msg += " | 交易所止盈止损已挂单"
             logging.info(msg)
             send_telegram_message(msg)
             return order
         else:
             error_details = order.get("data")[0].get("sMsg", "") or order.get("msg", "") if order.get("data") else order.get("msg", "未知错误")
-            error_msg = f"下单失败: {side.upper()}, 错误: {error_details}"
+            error_msg = f"下单失败: {symbol} {side.upper()}, 错误: {error_details}"
             logging.error(error_msg)
             send_telegram_message(f"❌ {error_msg}")
             return None
     except Exception as e:
-        error_msg = f"下单异常: {side.upper()}, 异常: {str(e)}"
+        error_msg = f"下单异常: {symbol} {side.upper()}, 异常: {str(e)}"
         logging.error(error_msg)
         send_telegram_message(f"❌ {error_msg}")
         return None
 
-def close_position():
-    logging.info("进入 close_position")
+def settle_limit_order(trade, order: dict, ord_type: str, side: str, size: float, stop_loss: float, take_profit: float,
+                       symbol: str, pos_params: dict, attach_algo_ords: list) -> tuple:
+    """等待限价单结果：IOC 未成交视为下单失败；只挂单超时后撤单，剩余数量改用市价单。
+    返回 (订单结果, 实际生效的附带止盈止损)，订单结果中 filled_sz 为总成交数量
+    """
+    ord_id = order["data"][0].get("ordId")
+    if ord_type == "ioc":
+        _, filled = wait_order_fill(trade, symbol, ord_id, POST_ONLY_WAIT)
+        if filled <= 0:
+            return {"code": "1", "msg": "IOC 在保护价内未成交", "data": []}, attach_algo_ords
+        order["filled_sz"] = filled
+        return order, attach_algo_ords
+    state, filled = wait_order_fill(trade, symbol, ord_id, POST_ONLY_WAIT)
+    if state != "filled":
+        trade.cancel_order(instId=symbol, ordId=ord_id)
+        # 撤单后 OKX 仍可能补报成交，订单进入终态后的成交数量才是最终值
+        state, filled = wait_order_fill(trade, symbol, ord_id, CANCEL_CONFIRM_TIMEOUT)
+        if state not in ("filled", "canceled", "mmp_canceled"):
+            logging.error("只挂单撤单未确认: %s %s, 状态 %s, 已成交 %s，不补市价单", symbol, side.upper(), state, filled)
+            if filled <= 0:
+                return {"code": "1", "msg": f"只挂单撤单未确认（{state}）", "data": []}, attach_algo_ords
+            order["filled_sz"] = filled
+            return order, attach_algo_ords
+    remaining = round(size - filled, 8)
+    if remaining >= MIN_ORDER_SIZE:
+        logging.info("只挂单未完全成交: %s %s, 已成交 %s, 剩余 %s 改用市价单", symbol, side.upper(), filled, remaining)
+        # 挂单一点都没成交时，附带的止盈止损随撤单失效，由市价单重新附带
+        fallback_algo_ords = None
+        if attach_algo_ords and filled <= 0:
+            fallback_algo_ords = build_attach_algo_ords(symbol, stop_loss, take_profit)
+        fallback = trade.place_order(instId=symbol, tdMode="cross", side=side, ordType="market", sz=str(remaining),
+                                     attachAlgoOrds=fallback_algo_ords, **pos_params)
+        if fallback.get("code") == "0" and fallback.get("data") and fallback["data"][0].get("sCode") == "0":
+            fallback["filled_sz"] = size
+            if attach_algo_ords and filled > 0:
+                # 挂单附带的止盈止损只覆盖已成交部分，撤掉后为整个仓位挂一张
+                cancel_exit_algo(trade, symbol, attach_algo_ords[0]["attachAlgoClOrdId"])
+                fallback_algo_ords = place_position_tpsl(trade, symbol, side, build_attach_algo_ords(symbol, stop_loss, take_profit), pos_params)
+            return fallback, fallback_algo_ords
+        if filled <= 0:
+            return fallback, attach_algo_ords
+        logging.error("剩余数量市价单失败: %s %s, %s", symbol, side.upper(), fallback.get("msg"))
+    order["filled_sz"] = filled
+    return order, attach_algo_ords
+
+def build_close_leg(symbol: str, position: dict, cl_ord_id: str) -> dict:
+    """批量下单中平掉一个持仓的市价腿：双向持仓按 posSide 平仓，单向持仓只减仓"""
+    pos_side = position.get("posSide") or "net"
+    pos = str(position.get("pos") or "0")
+    if pos_side == "net":
+        side = "buy" if pos.startswith("-") else "sell"
+    else:
+        side = "sell" if pos_side == "long" else "buy"
+    leg = {"instId": symbol, "tdMode": position.get("mgnMode") or "cross", "side": side, "ordType": "market",
+           "sz": pos.lstrip("-"), "clOrdId": cl_ord_id}
+    leg.update({"reduceOnly": "true"} if pos_side == "net" else {"posSide": pos_side})
+    return leg
+
+def cancel_exit_algo(trade, symbol: str, algo_cl_ord_id: str):
+    """撤销 algo_cl_ord_id 对应的止盈止损单（可能已触发或失效），失败只记录日志"""
+    try:
+        result = trade.cancel_algo_order([{"instId": symbol, "algoClOrdId": algo_cl_ord_id}])
+        if result.get("code") != "0":
+            logging.info("撤销止盈止损单未成功（可能已失效）: %s %s, %s", symbol, algo_cl_ord_id, result.get("msg"))
+    except Exception as e:
+        logging.warning("撤销止盈止损单异常: %s %s, %s", symbol, algo_cl_ord_id, e)
+
+def report_close_legs(symbol: str, legs: list, results: list) -> bool:
+    """逐笔记录并通知平仓腿的结果，返回是否全部成功"""
+    for leg, item in zip(legs, results):
+        pos_side = leg.get("posSide", "net")
+        if item.get("sCode") == "0":
+            msg = f"✅ 平仓成功: {symbol} posSide={pos_side}"
+            logging.info(msg)
+            send_telegram_message(msg)
+            if _account_cache is not None:
+                _account_cache.discard_position(symbol, pos_side)
+        else:
+            send_telegram_message(f"❌ 平仓失败: {symbol} posSide={pos_side}, 错误代码: {item.get('sCode')}, 错误: {item.get('sMsg')}")
+    return all_ok(results)
+
+def flip_position(symbol: str, positions: list, side: str, size: float, stop_loss: float = None, take_profit: float = None,
+                  algo_cl_ord_id: str = None) -> tuple:
+    """反手：先用一次批量下单平掉 positions，逐笔确认全部平仓成功后再按 side 市价开新仓
+
+    返回 (平仓是否全部成功, 开仓结果)，开仓结果格式同 place_order，失败为 None。批量下单不是原子操作，
+    有平仓腿失败时不开新仓，剩余持仓留给下一次平仓处理，避免两个方向的持仓同时存在。
+    """
+    logging.info("进入 flip_position, 产品: %s, 新方向: %s, 数量: %s, 平仓: %s", symbol, side, size,
+                 [p.get("posSide") or "net" for p in positions])
     try:
         flag = "1" if IS_DEMO else "0"
-        trade = Trade.TradeAPI(api_key=API_KEY, api_secret_key=SECRET_KEY, passphrase=PASS_PHRASE, flag=flag)
+        trade = get_trade_api(API_KEY, SECRET_KEY, PASS_PHRASE, flag)
+        order_id = str(int(time.time() * 1000)) + uuid.uuid4().hex[:8]
+        close_legs = [build_close_leg(symbol, p, f"{order_id}c{i}") for i, p in enumerate(positions)]
+        results = submit_batch(trade.place_multiple_orders, close_legs, "平仓")
+        if not report_close_legs(symbol, close_legs, results):
+            error_msg = f"反手平仓未全部成功，不开新仓: {symbol} {side.upper()}"
+            logging.error(error_msg)
+            send_telegram_message(f"❌ {error_msg}")
+            return False, None
+        if algo_cl_ord_id:
+            cancel_exit_algo(trade, symbol, algo_cl_ord_id)
+        pos_params = {"posSide": "long" if side == "buy" else "short"} if get_pos_mode() == "long_short_mode" else {}
+        attach_algo_ords = None
+        if ATTACH_ALGO_ORDERS and (stop_loss or take_profit):
+            attach_algo_ords = build_attach_algo_ords(symbol, stop_loss, take_profit)
+        order = trade.place_order(instId=symbol, tdMode="cross", side=side, ordType="market", sz=str(size),
+                                  clOrdId=f"{order_id}o", attachAlgoOrds=attach_algo_ords, **pos_params)
+        data = (order.get("data") or [{}])[0]
+        if order.get("code") != "0" or data.get("sCode") != "0":
+            error_msg = f"反手开仓失败: {symbol} {side.upper()}, 错误: {data.get('sMsg') or order.get('msg') or '未知错误'}"
+            logging.error(error_msg)
+            send_telegram_message(f"❌ {error_msg}")
+            return True, None
+        msg = f"✅ 反手开仓成功: {symbol} {side.upper()} | 止损: {stop_loss:.2f} | 止盈: {take_profit:.2f}"
+        if attach_algo_ords:
+            order["algo_cl_ord_id"] = attach_algo_ords[0]["attachAlgoClOrdId"]
+            msg += " | 交易所止盈止损已挂单"
+        logging.info(msg)
+        send_telegram_message(msg)
+        return True, order
+    except Exception as e:
+        error_msg = f"反手异常: {symbol} {side.upper()}, 异常: {str(e)}"
+        logging.error(error_msg)
+        send_telegram_message(f"❌ {error_msg}")
+        return False, None
+
+def close_position(symbol: str = SYMBOL, positions: list = None, algo_cl_ord_id: str = None):
+    """只平实际持有的方向；positions 为调用方已查到的持仓，省去一次查询
+
+    多个持仓（双向持仓模式下多空同时存在）时用一次批量下单全部市价平掉，平仓后撤销 algo_cl_ord_id 对应的止盈止损单。
+    """
+    logging.info("进入 close_position, 产品: %s", symbol)
+    try:
+        flag = "1" if IS_DEMO else "0"
+        trade = get_trade_api(API_KEY, SECRET_KEY, PASS_PHRASE, flag)
         order_id = str(int(time.time() * 1000)) + str(uuid.uuid4())[:8]
         
-        account_config = get_account_config()
-        pos_mode = account_config.get('posMode', 'unknown')
-        logging.info(f"账户保证金模式查询成功")
-        
-        positions = get_positions()
+        if positions is None:
+            positions = get_open_positions(symbol)
         if not positions:
-            msg = f"ℹ️ 无持仓可平"
+            msg = f"ℹ️ {symbol} 无持仓可平"
             logging.info(msg)
             send_telegram_message(msg)
             return {"code": "0", "data": [], "msg": "无持仓"}
-        
+
+        if len(positions) > 1:
+            legs = [build_close_leg(symbol, p, f"{order_id}c{i}") for i, p in enumerate(positions)]
+            logging.info("尝试批量平仓: %s, 订单ID: %s", [leg.get("posSide", "net") for leg in legs], order_id)
+            results = submit_batch(trade.place_multiple_orders, legs, "平仓")
+            report_close_legs(symbol, legs, results)
+            if not any(item.get("sCode") == "0" for item in results):
+                error_msg = f"平仓失败: {symbol}"
+                logging.error(error_msg)
+                send_telegram_message(f"❌ {error_msg}")
+                return None
+            if algo_cl_ord_id:
+                # 市价单平仓不会像 close-position 的 autoCxl 那样撤掉附带的止盈止损，平仓后单独撤销
+                cancel_exit_algo(trade, symbol, algo_cl_ord_id)
+            return {"code": "0" if all_ok(results) else "2", "data": results, "msg": "批量平仓完成"}
+
         success = False
         results = []
-        for pos_side in ["long", "short"]:
-            logging.info(f"尝试平仓: posSide={pos_side}, 订单ID: {order_id}")
+        for position in positions:
+            pos_side = position.get("posSide") or "net"
+            logging.info("尝试平仓: posSide=%s, 订单ID: %s", pos_side, order_id)
             params = {
-                "instId": SYMBOL,
-                "mgnMode": "cross",
+                "instId": symbol,
+                "mgnMode": position.get("mgnMode") or "cross",
                 "posSide": pos_side,
-                "autoCxl": False,
+                "autoCxl": True,  # 同时撤销附带的止盈止损等平仓挂单
                 "clOrdId": order_id
             }
             result = trade.close_positions(**params)
             if result.get("code") == "0":
                 if result.get("data") and len(result["data"]) > 0:
-                    msg = f"✅ 平仓成功: posSide={pos_side}"
+                    msg = f"✅ 平仓成功: {symbol} posSide={pos_side}"
                     logging.info(msg)
                     send_telegram_message(msg)
                     success = True
+                    if _account_cache is not None:
+                        _account_cache.discard_position(symbol, pos_side)
                 else:
                     msg = f"ℹ️ 平仓调用成功，但无 {pos_side} 持仓"
                     logging.info(msg)
                 results.append(result)
             else:
                 error_details = result.get("msg", "未知错误")
-                error_msg = f"平仓失败: posSide={pos_side}, 错误代码: {result.get('code')}, 错误: {error_details}"
+                error_msg = f"平仓失败: {symbol} posSide={pos_side}, 错误代码: {result.get('code')}, 错误: {error_details}"
                 logging.error(error_msg)
                 send_telegram_message(f"❌ {error_msg}")
                 results.append(result)
@@ -403,222 +944,637 @@ def close_position():
             logging.info("至少一个持仓平仓成功")
             return {"code": "0", "data": results, "msg": "至少一个持仓平仓成功"}
         else:
-            error_msg = f"平仓失败"
+            error_msg = f"平仓失败: {symbol}"
             logging.error(error_msg)
             send_telegram_message(f"❌ {error_msg}")
             return None
     except Exception as e:
-        error_msg = f"平仓异常: {str(e)}"
+        error_msg = f"平仓异常: {symbol}, {str(e)}"
         logging.error(error_msg)
         send_telegram_message(f"❌ {error_msg}")
         return None
 
-def run_bot():
-    logging.info(f"进入 run_bot, 配置: K线周期={BAR_INTERVAL}, 测试模式={TEST_MODE}")
-    interval_secs = get_interval_seconds(BAR_INTERVAL)
-    send_telegram_message(f"🤖 交易机器人启动！K线周期: {BAR_INTERVAL}, 测试模式: {TEST_MODE}")
-    
-    current_position = None
-    entry_price = 0.0
-    stop_loss = 0.0
-    take_profit = 0.0
-    last_signal = None
-    last_candle_ts = 0
-    last_ma_position = "未知"
-    recorded_candle = None
-    test_mode_signal = "buy"
-    last_price = 0.0
-    last_trade_time = 0
-    buy_confirm_count = 0
-    sell_confirm_count = 0
+def start_account_cache():
+    global _account_cache
+    logging.info("进入 start_account_cache, 持仓模式: %s", ACCOUNT_DATA_MODE)
+    if ACCOUNT_DATA_MODE != "ws":
+        return None
+    from account_ws import AccountStateCache  # 只在启动机器人时导入 websockets 等依赖
+    _account_cache = AccountStateCache(
+        API_KEY,
+        SECRET_KEY,
+        PASS_PHRASE,
+        demo=IS_DEMO,
+        url=os.getenv("OKX_WS_PRIVATE_URL"),
+        fetch_positions=fetch_all_positions,
+    )
+    _account_cache.start()
+    logging.info("私有频道持仓缓存已启动")
+    return _account_cache
 
-    while True:
-        try:
-            logging.info("进入主循环")
-            current_time = datetime.now(timezone.utc)
-            current_timestamp = int(current_time.timestamp())
-            cycle_start = (current_timestamp // interval_secs) * interval_secs
-            seconds_to_next_cycle = (cycle_start + interval_secs) - current_timestamp
-            if seconds_to_next_cycle > 0:
-                time.sleep(seconds_to_next_cycle)
-
-            price_data = get_latest_price_and_indicators(SYMBOL, fetch_candles=False)
-            if price_data is None or len(price_data) == 0:
-                logging.error(f"无法获取 {SYMBOL} 的价格，API 调用失败")
-                send_telegram_message(f"❌ 程序错误: 无法获取 {SYMBOL} 的价格")
-                time.sleep(60)
-                continue
+def start_market_feed():
+    global _market_feed
+    logging.info("进入 start_market_feed, 行情模式: %s", MARKET_DATA_MODE)
+    if MARKET_DATA_MODE != "ws":
+        return None
+    # 只订阅最小周期的K线，大周期尽量由它聚合
+    from market_ws import MarketDataFeed
+    _market_feed = MarketDataFeed(
+        SYMBOLS,
+        get_base_bar(BAR_INTERVALS),
+        demo=IS_DEMO,
+        public_url=os.getenv("OKX_WS_PUBLIC_URL"),
+        business_url=os.getenv("OKX_WS_BUSINESS_URL"),
+        book_channel=ORDER_BOOK_CHANNEL or None,
+    )
+    _market_feed.start()
+    logging.info("WebSocket 行情订阅已启动")
+    return _market_feed
 
-            current_price = price_data[0]
-            price_change_percent = abs((current_price - last_price) / last_price * 100) if last_price > 0 else 0
-            last_price = current_price
-
-            current_ts = (int(time.time()) // interval_secs) * interval_secs
-            is_new_candle = (current_ts != last_candle_ts)
-            significant_price_change = price_change_percent > 0.5
-            fetch_full_data = is_new_candle or significant_price_change
-
-            if fetch_full_data:
-                data = get_latest_price_and_indicators(SYMBOL, fetch_candles=True)
-                if data is None:
-                    logging.error(f"无法获取 {SYMBOL} 的完整数据，API 调用失败")
-                    send_telegram_message(f"❌ 程序错误: 无法获取 {SYMBOL} 的完整数据")
-                    time.sleep(60)
-                    continue
-            else:
-                if current_position is not None:
-                    if (current_position == "long" and current_price <= stop_loss) or \
-                       (current_position == "short" and current_price >= stop_loss):
-                        logging.info("触发止损平仓")
-                        positions = get_positions()
-                        if any(p["pos"] != "0" for p in positions):
-                            result = close_position()
-                            if result:
-                                current_position = None
-                                last_signal = None
-                                last_trade_time = current_timestamp
-                    elif (current_position == "long" and current_price >= take_profit) or \
-                         (current_position == "short" and current_price <= take_profit):
-                        logging.info("触发止盈平仓")
-                        positions = get_positions()
-                        if any(p["pos"] != "0" for p in positions):
-                            result = close_position()
-                            if result:
-                                current_position = None
-                                last_signal = None
-                                last_trade_time = current_timestamp
-                time.sleep(CHECK_INTERVAL)
-                continue
+class StrategyState:
+    """单个 (产品, K线周期) 的策略状态，原 run_bot 的局部变量。只做决策，下单由执行任务完成"""
 
-            price, volume, upper_shadow, lower_shadow, amplitude_percent, rsi, ma, ema, position, close, prev_close, avg_volume, open_price, high, low, ma_concentration = data
-
-            beijing_tz = timezone(timedelta(hours=8))
-            last_candle_utc = datetime.fromtimestamp(last_candle_ts, tz=timezone.utc) if last_candle_ts > 0 else None
-            last_candle_time_str = last_candle_utc.astimezone(beijing_tz).strftime('%Y-%m-%d %H:%M:%S') if last_candle_utc else "N/A"
-            current_time_str = datetime.fromtimestamp(current_ts, tz=timezone.utc).astimezone(beijing_tz).strftime('%Y-%m-%d %H:%M:%S')
-
-            signal = None
-            if ONLY_TEST_CLOSE:
-                logging.info("进入只测试平仓模式")
-                result = close_position()
-                if result:
-                    current_position = None
-                    last_signal = None
-                    last_trade_time = current_timestamp
-            elif TEST_CLOSE_POSITION:
-                logging.info("进入平仓测试")
-                result = close_position()
-                if result:
-                    current_position = None
-                    last_signal = None
-                    last_trade_time = current_timestamp
-            elif TEST_MODE:
-                logging.info(f"进入测试模式, 当前信号: {test_mode_signal}")
-                signal = test_mode_signal
-                msg = f"⚠️ 测试模式信号: {signal.upper()}"
-                send_telegram_message(msg)
-                test_mode_signal = "sell" if test_mode_signal == "buy" else "buy"
-            else:
-                recorded_candle = {
-                    "open": open_price,
-                    "close": close,
-                    "high": high,
-                    "low": low,
-                    "volume": volume,
-                    "position": position
-                }
-                recorded_position = recorded_candle["position"]
-                params_msg = (
-                    f"下单参数检查: 当前位置: {position}, 上一位置: {recorded_position}, "
-                    f"上次位置: {last_ma_position}, 上一K线 - 开盘: {recorded_candle['open']:.2f}, 收盘: {recorded_candle['close']:.2f}"
-                )
-                logging.info(params_msg)
-
-                if recorded_position != last_ma_position and last_ma_position != "未知":
-                    ma_concentration = calculate_ma_concentration(ma, ema)
-                    concentration_threshold = close * 0.01
-                    if recorded_position == "在所有均线之上":
-                        buy_confirm_count += 1
-                        sell_confirm_count = 0
-                        if buy_confirm_count >= 2 and ma_concentration <= concentration_threshold and rsi < 50 and volume > avg_volume * 1.5:
-                            signal = "buy"
-                            msg = f"⚠️ 做多信号: 连续2根K线在所有均线之上，均线密集度: {ma_concentration:.2f}, RSI: {rsi:.2f}"
-                            logging.info(msg)
-                            send_telegram_message(msg)
-                            buy_confirm_count = 0
-                    elif recorded_position == "在所有均线之下":
-                        sell_confirm_count += 1
-                        buy_confirm_count = 0
-                        if sell_confirm_count >= 2 and rsi > 50 and volume > avg_volume * 1.5:
-                            signal = "sell"
-                            msg = f"⚠️ 做空信号: 连续2根K线在所有均线之下，RSI: {rsi:.2f}"
-                            logging.info(msg)
-                            send_telegram_message(msg)
-                            sell_confirm_count = 0
-                    else:
-                        buy_confirm_count = 0
-                        sell_confirm_count = 0
-                else:
-                    buy_confirm_count = 0
-                    sell_confirm_count = 0
-
-                if recorded_position == "在均线之间":
-                    logging.info("触发止盈平仓")
-                    positions = get_positions()
-                    if any(p["pos"] != "0" for p in positions):
-                        result = close_position()
-                        if result:
-                            current_position = None
-                            last_signal = None
-                            last_trade_time = current_timestamp
-
-                last_ma_position = recorded_position
-                last_candle_ts = current_ts
-
-            if AUTO_TRADE_ENABLED and signal and signal != last_signal and (current_timestamp - last_trade_time) >= COOLDOWN:
-                order_size = max(ORDER_SIZE, MIN_ORDER_SIZE)
-                positions = get_positions()
-                if any(p["pos"] != "0" for p in positions):
-                    result = close_position()
-                    if result:
-                        current_position = None
-                        last_trade_time = current_timestamp
-
-                if signal == "buy" and current_position is None:
-                    potential_profit = price * TAKE_PROFIT_PERCENT * order_size * 5
-                    if potential_profit < MIN_PROFIT:
-                        msg = f"⚠️ 跳过买入信号: 潜在盈利 {potential_profit:.2f} USDT < 最小盈利 {MIN_PROFIT} USDT"
+    def __init__(self, symbol: str, bar: str):
+        self.symbol = symbol
+        self.bar = bar
+        self.interval_secs = get_interval_seconds(bar)
+        self.current_position = None
+        self.entry_price = 0.0
+        self.stop_loss = 0.0
+        self.take_profit = 0.0
+        self.last_signal = None
+        self.last_candle_ts = 0
+        self.last_ma_position = "未知"
+        self.recorded_candle = None
+        self.test_mode_signal = "buy"
+        self.last_price = 0.0
+        self.last_trade_time = 0
+        self.buy_confirm_count = 0
+        self.sell_confirm_count = 0
+        self.paused_until = 0  # 数据获取失败后暂停到该时间
+        self.due = False  # 已排队等待重新计算K线指标
+        self.pending_exit = False  # 已提交平仓、尚未执行完
+        self.algo_cl_ord_id = None  # 开仓单附带的交易所止盈止损单 ID
+        self.position_seen = False  # 开仓后私有频道缓存中是否出现过该持仓
+
+    # 快照中保存的字段：持仓和冷却总是恢复；信号连续性字段只在重启未超过一根K线时恢复
+    POSITION_FIELDS = ("current_position", "entry_price", "stop_loss", "take_profit", "last_signal",
+                       "last_trade_time", "algo_cl_ord_id", "position_seen", "test_mode_signal")
+    SIGNAL_FIELDS = ("last_candle_ts", "last_ma_position", "recorded_candle", "last_price",
+                     "buy_confirm_count", "sell_confirm_count")
+
+    def snapshot(self) -> dict:
+        return {name: getattr(self, name) for name in self.POSITION_FIELDS + self.SIGNAL_FIELDS}
+
+    def restore(self, saved: dict, age: float):
+        fields = self.POSITION_FIELDS + (self.SIGNAL_FIELDS if age <= self.interval_secs else ())
+        for name in fields:
+            if name in saved:
+                setattr(self, name, saved[name])
+
+    @property
+    def name(self) -> str:
+        return f"{self.symbol} {self.bar}"
+
+    def on_tick(self, price: float, now: int) -> bool:
+        """处理最新价格，返回是否需要重新计算K线指标（新K线或价格大幅变动）"""
+        price_change_percent = abs((price - self.last_price) / self.last_price * 100) if self.last_price > 0 else 0
+        self.last_price = price
+        current_ts = (now // self.interval_secs) * self.interval_secs
+        return current_ts != self.last_candle_ts or price_change_percent > 0.5
+
+    def check_exit(self, price: float):
+        """持仓触发止损/止盈时返回 "止损"/"止盈"，否则返回 None"""
+        if self.current_position is None:
+            return None
+        if (self.current_position == "long" and price <= self.stop_loss) or \
+           (self.current_position == "short" and price >= self.stop_loss):
+            return "止损"
+        if (self.current_position == "long" and price >= self.take_profit) or \
+           (self.current_position == "short" and price <= self.take_profit):
+            return "止盈"
+        return None
+
+    def apply_close(self, now: int, reset_signal: bool = True):
+        self.current_position = None
+        self.algo_cl_ord_id = None
+        self.position_seen = False
+        if reset_signal:
+            self.last_signal = None
+        self.last_trade_time = now
+
+    def apply_open(self, side: str, price: float, stop_loss: float, take_profit: float, now: int, algo_cl_ord_id: str = None):
+        self.current_position = "long" if side == "buy" else "short"
+        self.algo_cl_ord_id = algo_cl_ord_id
+        self.position_seen = False
+        self.entry_price = price
+        self.stop_loss = stop_loss
+        self.take_profit = take_profit
+        self.last_signal = side
+        self.last_trade_time = now
+
+    def on_bar(self, data: tuple, now: int) -> list:
+        """根据最新K线指标生成信号，返回按顺序执行的下单意图：
+        ("close", 原因, 是否重置信号)、("force_close", 原因)、("open", 方向, 价格, 数量, 止损, 止盈)、
+        ("flip", 方向, 价格, 数量, 止损, 止盈)（平掉已有持仓并开新仓）
+        """
+        price, volume, upper_shadow, lower_shadow, amplitude_percent, rsi, ma, ema, position, close, prev_close, avg_volume, open_price, high, low, ma_concentration = data
+        current_ts = (now // self.interval_secs) * self.interval_secs
+        intents = []
+
+        signal = None
+        if ONLY_TEST_CLOSE:
+            logging.info("进入只测试平仓模式")
+            intents.append(("force_close", "只测试平仓"))
+        elif TEST_CLOSE_POSITION:
+            logging.info("进入平仓测试")
+            intents.append(("force_close", "平仓测试"))
+        elif TEST_MODE:
+            logging.info("进入测试模式, 当前信号: %s", self.test_mode_signal)
+            signal = self.test_mode_signal
+            msg = f"⚠️ 测试模式信号: {self.name} {signal.upper()}"
+            send_telegram_message(msg)
+            self.test_mode_signal = "sell" if self.test_mode_signal == "buy" else "buy"
+        else:
+            self.recorded_candle = {
+                "open": open_price,
+                "close": close,
+                "high": high,
+                "low": low,
+                "volume": volume,
+                "position": position
+            }
+            recorded_position = self.recorded_candle["position"]
+            params_msg = (
+                f"下单参数检查: {self.name}, 当前位置: {position}, 上一位置: {recorded_position}, "
+                f"上次位置: {self.last_ma_position}, 上一K线 - 开盘: {self.recorded_candle['open']:.2f}, 收盘: {self.recorded_candle['close']:.2f}"
+            )
+            logging.info(params_msg)
+
+            if recorded_position != self.last_ma_position and self.last_ma_position != "未知":
+                ma_concentration = calculate_ma_concentration(ma, ema)
+                concentration_threshold = close * 0.01
+                if recorded_position == "在所有均线之上":
+                    self.buy_confirm_count += 1
+                    self.sell_confirm_count = 0
+                    if self.buy_confirm_count >= 2 and ma_concentration <= concentration_threshold and rsi < 50 and volume > avg_volume * 1.5:
+                        signal = "buy"
+                        msg = f"⚠️ 做多信号: {self.name} 连续2根K线在所有均线之上，均线密集度: {ma_concentration:.2f}, RSI: {rsi:.2f}"
                         logging.info(msg)
                         send_telegram_message(msg)
-                    else:
-                        stop_loss = price * (1 - STOP_LOSS_PERCENT)
-                        take_profit = price * (1 + TAKE_PROFIT_PERCENT)
-                        order = place_order("buy", price, order_size, stop_loss, take_profit)
-                        if order:
-                            current_position = "long"
-                            entry_price = price
-                            last_signal = signal
-                            last_trade_time = current_timestamp
-                elif signal == "sell" and current_position is None:
-                    potential_profit = price * TAKE_PROFIT_PERCENT * order_size * 5
-                    if potential_profit < MIN_PROFIT:
-                        msg = f"⚠️ 跳过卖出信号: 潜在盈利 {potential_profit:.2f} USDT < 最小盈利 {MIN_PROFIT} USDT"
+                        self.buy_confirm_count = 0
+                elif recorded_position == "在所有均线之下":
+                    self.sell_confirm_count += 1
+                    self.buy_confirm_count = 0
+                    if self.sell_confirm_count >= 2 and rsi > 50 and volume > avg_volume * 1.5:
+                        signal = "sell"
+                        msg = f"⚠️ 做空信号: {self.name} 连续2根K线在所有均线之下，RSI: {rsi:.2f}"
                         logging.info(msg)
                         send_telegram_message(msg)
-                    else:
-                        stop_loss = price * (1 + STOP_LOSS_PERCENT)
-                        take_profit = price * (1 - TAKE_PROFIT_PERCENT)
-                        order = place_order("sell", price, order_size, stop_loss, take_profit)
-                        if order:
-                            current_position = "short"
-                            entry_price = price
-                            last_signal = signal
-                            last_trade_time = current_timestamp
+                        self.sell_confirm_count = 0
+                else:
+                    self.buy_confirm_count = 0
+                    self.sell_confirm_count = 0
+            else:
+                self.buy_confirm_count = 0
+                self.sell_confirm_count = 0
+
+            if recorded_position == "在均线之间":
+                logging.info("触发止盈平仓: %s", self.name)
+                intents.append(("close", "止盈", True))
+
+            self.last_ma_position = recorded_position
+            self.last_candle_ts = current_ts
+
+        if AUTO_TRADE_ENABLED and signal and signal != self.last_signal and (now - self.last_trade_time) >= COOLDOWN:
+            order_size = max(ORDER_SIZE, MIN_ORDER_SIZE)
+            potential_profit = price * TAKE_PROFIT_PERCENT * order_size * 5
+            if potential_profit < MIN_PROFIT:
+                msg = f"⚠️ 跳过{'买入' if signal == 'buy' else '卖出'}信号: {self.name} 潜在盈利 {potential_profit:.2f} USDT < 最小盈利 {MIN_PROFIT} USDT"
+                logging.info(msg)
+                send_telegram_message(msg)
+                intents.append(("close", "反向信号", False))
+            # 平掉已有持仓并开新仓，执行任务尽量合并为一次批量下单
+            elif signal == "buy":
+                intents.append(("flip", "buy", price, order_size, price * (1 - STOP_LOSS_PERCENT), price * (1 + TAKE_PROFIT_PERCENT)))
+            else:
+                intents.append(("flip", "sell", price, order_size, price * (1 + STOP_LOSS_PERCENT), price * (1 - TAKE_PROFIT_PERCENT)))
+        return intents
+
+def build_states() -> list:
+    """每个产品只建一个交易周期为 TRADE_BAR 的策略状态
+
+    同一产品的多个周期共用交易所的同一个持仓，各自开平会互相平掉对方的仓位；
+    BAR_INTERVALS 中的其余周期照常同步K线、更新指标引擎，但不产生下单意图。
+    """
+    return [StrategyState(symbol, TRADE_BAR) for symbol in SYMBOLS]
+
+def seconds_to_next_check(states, now: float) -> float:
+    """距下一次检查的秒数：CHECK_INTERVAL 与最近一根K线收盘中较早者"""
+    next_bar = min((int(now) // s.interval_secs + 1) * s.interval_secs for s in states)
+    return max(min(CHECK_INTERVAL, next_bar - now), 0)
 
+def load_symbol_data(symbol: str, price: float) -> dict:
+    """同步该产品全部周期的K线并计算指标，返回 {K线周期: 指标数据或 None}（在线程池中执行）"""
+    market = get_market_api("1" if IS_DEMO else "0")
+    with _candle_lock:
+        # 同步该产品全部周期，保证每个指标引擎都收到所有K线变化
+        synced = sync_symbol_candles(market, symbol, BAR_INTERVALS)
+        return {bar: build_indicator_data(symbol, bar, price, result) for bar, result in synced.items()}
+
+def snapshot_config() -> dict:
+    """影响K线缓存和指标引擎的配置，变化后快照中的指标引擎不再可用"""
+    return {"candle_limit": CANDLE_LIMIT, "rsi_period": RSI_PERIOD, "ma_periods": list(MA_PERIODS)}
+
+def save_state_snapshot(states: dict) -> int:
+    """保存策略状态、K线缓存和指标引擎到快照文件（在线程池中执行），返回字节数"""
+    with _candle_lock:
+        stores = {key: store.latest() for key, store in _candle_stores.items() if len(store)}
+        engines = {key: copy.deepcopy(engine) for key, engine in _indicator_engines.items()}
+    return write_snapshot(SNAPSHOT_FILE, {"config": snapshot_config(), "states": states, "stores": stores, "engines": engines})
+
+def restore_state_snapshot(states) -> bool:
+    """启动时从快照恢复，返回是否恢复。恢复的K线缓存在首次同步时用 REST 补齐重启期间的K线"""
+    snapshot = read_snapshot(SNAPSHOT_FILE)
+    if snapshot is None:
+        return False
+    age = time.time() - snapshot["saved_at"]
+    same_config = snapshot.get("config") == snapshot_config()
+    with _candle_lock:
+        for key, (ts, ohlcv) in snapshot.get("stores", {}).items():
+            if key[0] not in SYMBOLS or key[1] not in BAR_INTERVALS:
+                continue
+            get_candle_store(*key).load_arrays(ts, ohlcv)
+            _restored_stores.add(key)
+            engine = snapshot.get("engines", {}).get(key)
+            if same_config and engine is not None:
+                _indicator_engines[key] = engine
+    saved_states = snapshot.get("states", {})
+    for state in states:
+        saved = saved_states.get((state.symbol, state.bar))
+        if saved:
+            state.restore(saved, age)
+    logging.info("已从快照恢复状态: %s, 保存于 %.0f 秒前, K线缓存 %s 个, 指标引擎%s",
+                 SNAPSHOT_FILE, age, len(_restored_stores), "已恢复" if same_config else "配置变化需重建")
+    return True
+
+def reconcile_restored_states(states):
+    """用交易所持仓校对快照中的持仓：已不存在的（如重启期间被交易所止盈止损平掉）清除；查询失败时保留"""
+    held = [s for s in states if s.current_position is not None]
+    positions = fetch_all_positions()
+    if positions is None:
+        if held:
+            logging.warning("无法查询持仓，保留快照中的 %s 个持仓状态", len(held))
+        return
+    open_sides = {(p.get("instId"), p.get("posSide") or "net") for p in positions if p.get("pos") not in (None, "", "0")}
+    now = int(time.time())
+    for state in held:
+        if (state.symbol, state.current_position) not in open_sides and (state.symbol, "net") not in open_sides:
+            msg = f"⚠️ 快照中的持仓已不存在，清除: {state.name} {state.current_position}"
+            logging.info(msg)
+            send_telegram_message(msg)
+            state.apply_close(now)
+        elif state.algo_cl_ord_id:
+            # 重启期间的策略单推送已丢失，先用 REST 取一次状态
+            fetch_exit_algo(state.symbol, state.algo_cl_ord_id)
+    tracked = {s.symbol for s in states if s.current_position is not None}
+    untracked = sorted({inst_id for inst_id, _ in open_sides if inst_id in SYMBOLS and inst_id not in tracked})
+    if untracked:
+        logging.warning("交易所存在快照中没有记录的持仓: %s", ", ".join(untracked))
+
+def lower_os_priority(niceness: int = 10):
+    """调低当前线程的调度优先级（Linux 上 nice 值按线程生效，可作为线程池 initializer），不支持时忽略"""
+    try:
+        os.setpriority(os.PRIO_PROCESS, get_native_id(), niceness)
+    except (AttributeError, OSError) as e:
+        logging.debug("无法调低线程优先级: %s", e)
+
+class BotRuntime:
+    """asyncio 运行时：行情、风控、信号、下单四个任务通过队列连接。
+
+    阻塞的 OKX SDK 调用放到线程池并设置超时：价格刷新走单独的 price_pool，K线走 market_pool，持仓和下单走 trade_pool，
+    K线同步卡住不会影响价格刷新、止损止盈检查和平仓。状态快照在低优先级的 snapshot_pool 中保存，不占用行情线程。通知由 TelegramNotifier 的后台线程发送，本身不阻塞。
+    拆单执行的开仓单耗时较长，放到 algo_pool 中单独运行，同一产品的下单意图按顺序执行，不阻塞其他产品。
+    """
+
+    def __init__(self, states):
+        self.states = states
+        self.prices = {}
+        self.price_updates = asyncio.Queue(maxsize=1)  # 只保留最新一次价格，风控不处理过期行情
+        self.signal_queue = asyncio.Queue()
+        self.order_queue = asyncio.PriorityQueue()  # 平仓优先于开仓
+        self.price_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="okx-price")
+        self.market_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="okx-market")
+        self.snapshot_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot", initializer=lower_os_priority)
+        # 下单线程发出的请求（包括平仓前的持仓查询）优先拿到限速令牌
+        self.trade_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="okx-trade",
+                                             initializer=set_thread_priority, initargs=(PRIORITY_TRADE,))
+        self.algo_pool = ThreadPoolExecutor(max_workers=max(len({s.symbol for s in states}), 1), thread_name_prefix="okx-algo",
+                                            initializer=set_thread_priority, initargs=(PRIORITY_TRADE,))
+        self._symbol_locks = {}  # 产品 -> asyncio.Lock，同一产品的下单意图依次执行
+        self._order_tasks = set()
+        self._order_seq = itertools.count()
+        self._feed_event = None
+        self._snapshot_event = asyncio.Event()
+        self._price_failures = 0
+        self._algo_checks = {}  # algoClOrdId -> 上次 REST 确认的时间
+
+    async def call(self, pool, func, *args, timeout: float = CALL_TIMEOUT):
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(loop.run_in_executor(pool, functools.partial(func, *args)), timeout)
+
+    def beat(self, task: str):
+        """记录任务心跳，供 /health 和 /metrics 使用"""
+        _heartbeats[task] = time.time()
+        LOOP_ITERATIONS.inc(task=task)
+
+    def submit(self, state: StrategyState, intent: tuple):
+        if intent[0] in ("close", "force_close", "flip"):
+            # 反手带有开仓，已有平仓排队时仍然提交，执行时会发现持仓已平
+            if state.pending_exit and intent[0] != "flip":
+                return
+            state.pending_exit = True
+            priority = EXIT_PRIORITY
+        else:
+            priority = ENTRY_PRIORITY
+        self.order_queue.put_nowait((priority, next(self._order_seq), state, intent))
+
+    def publish_prices(self, prices: dict, now: int):
+        if self.price_updates.full():
+            self.price_updates.get_nowait()
+        self.price_updates.put_nowait((prices, now))
+
+    async def refresh_prices(self, now: int) -> dict:
+        """拉取最新价格，分发给风控任务，并把需要重新计算指标的产品交给信号任务；失败返回空字典"""
+        try:
+            prices = await self.call(self.price_pool, get_latest_prices, SYMBOLS, timeout=PRICE_TIMEOUT)
+        except asyncio.TimeoutError:
+            prices = {}
+        if not prices:
+            RETRIES.inc(operation="prices")
+            self._price_failures += 1
+            logging.error("无法获取 %s 的价格，API 调用失败 (连续 %s 次)", ', '.join(SYMBOLS), self._price_failures)
+            if self._price_failures == 1:
+                send_telegram_message(f"❌ 程序错误: 无法获取 {', '.join(SYMBOLS)} 的价格")
+            return {}
+        self._price_failures = 0
+        self.prices.update(prices)
+        self.publish_prices(prices, now)
+        _last_tick_times.update((symbol, time.time()) for symbol in prices)
+
+        for state in self.states:
+            price = prices.get(state.symbol)
+            if price is None or now < state.paused_until or state.due:
+                continue
+            if state.on_tick(price, now):
+                state.due = True
+                self.signal_queue.put_nowait(state.symbol)
+        return prices
+
+    async def market_data_task(self):
+        """按检查间隔（或收到推送时）刷新价格"""
+        errors = 0
+        while True:
+            self.beat("market_data")
+            try:
+                wait = seconds_to_next_check(self.states, time.time())
+                if self._feed_event is not None:
+                    # WebSocket 模式：有推送立即处理
+                    try:
+                        await asyncio.wait_for(self._feed_event.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._feed_event.clear()
+                elif wait > 0:
+                    await asyncio.sleep(wait)
+                await self.refresh_prices(int(time.time()))
+                errors = 0
+            except Exception as e:
+                errors += 1
+                logging.error("行情任务异常 (连续 %s 次): %s", errors, e)
+                if errors == 1:
+                    send_telegram_message(f"❌ 行情任务错误: {str(e)}")
+                await asyncio.sleep(backoff_delay(errors, base=1, cap=60))
+
+    def check_risk(self, prices: dict, now: int):
+        """检查所有持仓的止损止盈，不做任何网络调用。
+        附带交易所止盈止损的持仓由交易所平仓，这里只同步结果；状态无法确认时回退到本地检查
+        """
+        for state in self.states:
+            price = prices.get(state.symbol)
+            if price is None or state.pending_exit or state.current_position is None:
+                continue
+            if state.algo_cl_ord_id:
+                if cached_position_open(state.symbol, state.current_position):
+                    state.position_seen = True
+                status = get_exchange_exit_status(state.symbol, state.current_position, state.algo_cl_ord_id, state.position_seen)
+                if status == "protected":
+                    continue
+                if status == "closed":
+                    msg = f"✅ 交易所止盈止损已平仓: {state.name}, 当前价格: {price}"
+                    logging.info(msg)
+                    send_telegram_message(msg)
+                    state.apply_close(now)
+                    continue
+                if exit_algo_unknown(state.algo_cl_ord_id):
+                    self.request_algo_confirm(state, now)
+            reason = state.check_exit(price)
+            if reason:
+                logging.info("触发%s平仓: %s", reason, state.name)
+                self.submit(state, ("close", reason, True))
+
+    def request_algo_confirm(self, state: StrategyState, now: int):
+        """止盈止损单状态缺失时在后台用 REST 查询，同一张单至多每 ALGO_CONFIRM_INTERVAL 秒一次；确认前由本地检查兜底"""
+        if now - self._algo_checks.get(state.algo_cl_ord_id, 0) < ALGO_CONFIRM_INTERVAL:
+            return
+        self._algo_checks[state.algo_cl_ord_id] = now
+        task = asyncio.create_task(self.confirm_exit_algo(state.symbol, state.algo_cl_ord_id))
+        self._order_tasks.add(task)
+        task.add_done_callback(self._order_tasks.discard)
+
+    async def confirm_exit_algo(self, symbol: str, algo_cl_ord_id: str):
+        try:
+            await self.call(self.trade_pool, fetch_exit_algo, symbol, algo_cl_ord_id)
+        except asyncio.TimeoutError:
+            logging.warning("查询止盈止损单超时: %s %s", symbol, algo_cl_ord_id)
+
+    async def risk_task(self):
+        """每次价格更新都检查止损止盈"""
+        while True:
+            prices, now = await self.price_updates.get()
+            self.beat("risk")
+            self.check_risk(prices, now)
+
+    async def process_symbol(self, symbol: str):
+        """同步该产品的K线、计算指标并生成下单意图"""
+        due_states = [s for s in self.states if s.symbol == symbol and s.due]
+        if not due_states:
+            return
+        try:
+            bar_data = await self.call(self.market_pool, load_symbol_data, symbol, self.prices[symbol])
+        except Exception as e:
+            logging.error("K线同步异常: %s, %s %s", symbol, type(e).__name__, e)
+            bar_data = {}
+        now = int(time.time())
+        for state in due_states:
+            state.due = False
+            data = bar_data.get(state.bar)
+            if data is None:
+                logging.error("无法获取 %s 的完整数据，API 调用失败", state.name)
+                send_telegram_message(f"❌ 程序错误: 无法获取 {state.name} 的完整数据")
+                state.paused_until = now + 60
+                continue
+            try:
+                for intent in state.on_bar(data, now):
+                    self.submit(state, intent)
+            except Exception as e:
+                logging.error("信号计算异常: %s, %s", state.name, e)
+                send_telegram_message(f"❌ 信号计算错误: {state.name}, {str(e)}")
+                state.paused_until = now + 60
+
+    async def signal_task(self):
+        """依次处理排队的产品；同一产品排队多次只计算一次"""
+        while True:
+            symbol = await self.signal_queue.get()
+            self.beat("signal")
+            await self.process_symbol(symbol)
+
+    async def execute(self, state: StrategyState, intent: tuple):
+        action = intent[0]
+        if action == "close":
+            # 缓存可用时只发一次平仓请求
+            positions = await self.call(self.trade_pool, get_open_positions, state.symbol)
+            await self.close_state(state, positions, intent[2])
+        elif action == "force_close":
+            if await self.call(self.trade_pool, close_position, state.symbol):
+                state.apply_close(int(time.time()))
+        elif action == "open":
+            await self.open_position(state, *intent[1:])
+        elif action == "flip":
+            _, side, price, size, stop_loss, take_profit = intent
+            positions = await self.call(self.trade_pool, get_open_positions, state.symbol)
+            if positions and ORDER_TYPE == "market" and not is_scheduled(size):
+                # 批量平仓确认成功后市价开仓
+                closed, order = await self.call(self.trade_pool, flip_position, state.symbol, positions, side, size,
+                                                stop_loss, take_profit, state.algo_cl_ord_id)
+                if closed:
+                    state.apply_close(int(time.time()), reset_signal=False)
+                if order:
+                    state.apply_open(side, price, stop_loss, take_profit, int(time.time()), order.get("algo_cl_ord_id"))
+                return
+            # 限价和拆单开仓由 place_order 执行，用已查到的持仓先平后开
+            await self.close_state(state, positions, False)
+            await self.open_position(state, side, price, size, stop_loss, take_profit)
+
+    async def close_state(self, state: StrategyState, positions: list, reset_signal: bool):
+        """平掉 positions（调用方已查到的持仓）；没有持仓但挂过交易所止盈止损时视为已被交易所平仓"""
+        if positions:
+            if await self.call(self.trade_pool, close_position, state.symbol, positions, state.algo_cl_ord_id):
+                state.apply_close(int(time.time()), reset_signal=reset_signal)
+        elif state.algo_cl_ord_id:
+            # 持仓已被交易所止盈止损平掉
+            logging.info("交易所已平仓: %s", state.name)
+            state.apply_close(int(time.time()), reset_signal=reset_signal)
+
+    async def open_position(self, state: StrategyState, side: str, price: float, size: float, stop_loss: float, take_profit: float):
+        if state.current_position is not None:
+            return
+        if is_scheduled(size):
+            order = await self.call(self.algo_pool, place_order, side, price, size, stop_loss, take_profit, state.symbol,
+                                    timeout=CALL_TIMEOUT + EXECUTION_DURATION)
+        else:
+            order = await self.call(self.trade_pool, place_order, side, price, size, stop_loss, take_profit, state.symbol)
+        if order:
+            state.apply_open(side, price, stop_loss, take_profit, int(time.time()), order.get("algo_cl_ord_id"))
+
+    async def run_order(self, state: StrategyState, intent: tuple):
+        """执行一个下单意图并处理异常"""
+        try:
+            await self.execute(state, intent)
+        except asyncio.TimeoutError:
+            logging.error("下单调用超时: %s %s", state.name, intent[0])
+            send_telegram_message(f"❌ 下单调用超时: {state.name} {intent[0]}")
         except Exception as e:
-            logging.error(f"主循环异常: {str(e)}")
-            send_telegram_message(f"❌ 主循环错误: {str(e)}")
-            time.sleep(60)
+            logging.error("下单任务异常: %s %s, %s", state.name, intent[0], e)
+            send_telegram_message(f"❌ 下单任务错误: {state.name}, {str(e)}")
+        finally:
+            if intent[0] in ("close", "force_close", "flip"):
+                state.pending_exit = False
+            self._snapshot_event.set()  # 持仓可能已变化，尽快保存快照
+
+    async def run_order_serialized(self, state: StrategyState, intent: tuple):
+        """持有产品锁执行下单意图：同一产品的意图按提交顺序执行"""
+        async with self._symbol_locks.setdefault(state.symbol, asyncio.Lock()):
+            await self.run_order(state, intent)
+
+    async def execution_task(self):
+        """按优先级依次执行下单意图，状态只在事件循环线程中修改
+
+        拆单执行的开仓单，以及产品锁被它占用时同一产品后续的意图，在后台任务中执行，队列继续处理其他产品。
+        """
+        while True:
+            _, _, state, intent = await self.order_queue.get()
+            self.beat("execution")
+            lock = self._symbol_locks.get(state.symbol)
+            if (intent[0] in ("open", "flip") and is_scheduled(intent[3])) or (lock is not None and lock.locked()):
+                task = asyncio.create_task(self.run_order_serialized(state, intent))
+                self._order_tasks.add(task)
+                task.add_done_callback(self._order_tasks.discard)
+            else:
+                await self.run_order_serialized(state, intent)
+
+    async def snapshot_task(self):
+        """每 SNAPSHOT_INTERVAL 秒以及下单执行后保存状态快照"""
+        while True:
+            try:
+                await asyncio.wait_for(self._snapshot_event.wait(), SNAPSHOT_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._snapshot_event.clear()
+            states = {(s.symbol, s.bar): s.snapshot() for s in self.states}
+            try:
+                size = await self.call(self.snapshot_pool, save_state_snapshot, states)
+                logging.debug("状态快照已保存: %s 字节", size)
+            except Exception as e:
+                logging.warning("状态快照保存失败: %s, %s", type(e).__name__, e)
+
+    async def run(self):
+        if _market_feed is not None:
+            loop = asyncio.get_running_loop()
+            self._feed_event = asyncio.Event()
+            _market_feed.add_listener(lambda: loop.call_soon_threadsafe(self._feed_event.set))
+        tasks = [
+            asyncio.create_task(self.market_data_task(), name="market-data"),
+            asyncio.create_task(self.risk_task(), name="risk"),
+            asyncio.create_task(self.signal_task(), name="signal"),
+            asyncio.create_task(self.execution_task(), name="execution"),
+        ]
+        if SNAPSHOT_FILE:
+            tasks.append(asyncio.create_task(self.snapshot_task(), name="snapshot"))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks + list(self._order_tasks):
+                task.cancel()
+            self.price_pool.shutdown(wait=False, cancel_futures=True)
+            self.market_pool.shutdown(wait=False, cancel_futures=True)
+            self.snapshot_pool.shutdown(wait=False, cancel_futures=True)
+            self.trade_pool.shutdown(wait=False, cancel_futures=True)
+            self.algo_pool.shutdown(wait=False, cancel_futures=True)
+
+def run_bot():
+    logging.info("进入 run_bot, 配置: 产品=%s, K线周期=%s, 交易周期=%s, 测试模式=%s", SYMBOLS, BAR_INTERVALS, TRADE_BAR, TEST_MODE)
+    _notifier.start()
+    get_pos_mode()
+    start_account_cache()
+    start_market_feed()
+    send_telegram_message(f"🤖 交易机器人启动！产品: {', '.join(SYMBOLS)}, K线周期: {', '.join(BAR_INTERVALS)}, 交易周期: {TRADE_BAR}, 测试模式: {TEST_MODE}")
+
+    # 所有产品共用一个运行时：每轮批量取一次价格，同一产品的K线只同步一次
+    states = build_states()
+    if SNAPSHOT_FILE and restore_state_snapshot(states):
+        reconcile_restored_states(states)
+    asyncio.run(BotRuntime(states).run())
 
 if __name__ == "__main__":
     logging.info("启动 Flask 服务...")
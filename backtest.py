@@ -0,0 +1,599 @@
+import argparse
+import json
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, field, asdict
+
+import numpy as np
+import pandas as pd
+
+from candle_archive import CandleArchive, ARCHIVE_SUFFIX
+from indicators import rolling_mean, ema, rsi
+
+# 均线位置编码，对应 determine_position 的返回值
+POS_NONE = 0  # 无有效均线
+POS_ABOVE = 1  # 在所有均线之上
+POS_BELOW = -1  # 在所有均线之下
+POS_BETWEEN = 2  # 在均线之间
+
+INTRABAR_FRACTIONS = (0.0, 0.25, 0.5, 0.95)  # K线内合成成交价的时刻（占K线时长的比例）：开、高/低、低/高、收
+TICK_CHUNK = 1_000_000  # 逐笔数据每块的行数
+
+
+@dataclass
+class StrategyParams:
+    """run_bot 策略参数，默认值与 app.py 一致"""
+    ma_periods: tuple = (20, 60, 120)
+    rsi_period: int = 14
+    rsi_buy_below: float = 50.0
+    rsi_sell_above: float = 50.0
+    volume_period: int = 10
+    volume_multiplier: float = 1.5
+    concentration_pct: float = 0.01
+    confirm_bars: int = 2
+    stop_loss_pct: float = 0.02
+    take_profit_pct: float = 0.04
+    cooldown: int = 1800  # 秒
+    order_size: float = 0.1
+    min_profit: float = 0.1
+    ema_window: int = 140  # 实盘每次取 CANDLE_LIMIT 根K线计算 EMA
+    contract_value: float = 0.01  # BTC-USDT-SWAP 每张 0.01 BTC
+    fee_rate: float = 0.0005  # 吃单手续费
+    slippage_pct: float = 0.0
+
+
+@dataclass
+class ExecutionParams:
+    """逐笔回放的下单和结算设置，默认值与 app.py 一致"""
+    poll_interval: float = 5.0  # 本地止损止盈的轮询间隔（秒），对应 CHECK_INTERVAL
+    exchange_stops: bool = True  # 开仓附带交易所止盈止损（ATTACH_ALGO_ORDERS），逐笔触发；否则只在轮询时检查
+    latency_ms: int = 300  # 决策到订单到达交易所的耗时，按此后的第一笔成交价成交
+    funding_rate: float = 0.0001  # 每次结算的资金费率，提供资金费率序列时以序列为准
+    funding_interval_hours: int = 8  # BTC-USDT-SWAP 在 UTC 0/8/16 点结算
+
+
+@dataclass
+class BacktestResult:
+    trades: pd.DataFrame
+    equity: np.ndarray
+    stats: dict = field(default_factory=dict)
+
+
+def load_candles(path: str) -> dict:
+    """读取 CSV、Parquet 或本地K线归档（.ohlcv）文件，返回从旧到新排序的 NumPy 数组字典
+
+    需要 ts(毫秒)/open/high/low/close/volume 列，也接受 timestamp、vol 列名。
+    归档文件通过 memmap 读取，返回的各列是只读视图，不复制数据。
+    """
+    if path.endswith(ARCHIVE_SUFFIX):
+        return CandleArchive(path).columns()
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    df = df.rename(columns={"timestamp": "ts", "vol": "volume"})
+    df = df.sort_values("ts")
+    candles = {"ts": df["ts"].to_numpy(dtype=np.int64)}
+    for name in ("open", "high", "low", "close", "volume"):
+        candles[name] = df[name].to_numpy(dtype=np.float64)
+    return candles
+
+
+def compute_indicators(candles: dict, params: StrategyParams) -> dict:
+    """整段序列一次性计算策略所需指标"""
+    close = candles["close"]
+    lines = [rolling_mean(close, p) for p in params.ma_periods]
+    lines += [ema(close, p, params.ema_window) for p in params.ma_periods]
+    return {
+        "lines": lines,
+        "rsi": rsi(close, params.rsi_period),
+        "avg_volume": rolling_mean(candles["volume"], params.volume_period),
+    }
+
+
+def ma_positions(close: np.ndarray, lines) -> tuple:
+    """向量化的 determine_position 和 calculate_ma_concentration，lines 为均线数组序列（NaN 表示无效）"""
+    n = len(close)
+    above = np.ones(n, dtype=bool)
+    below = np.ones(n, dtype=bool)
+    n_valid = np.zeros(n, dtype=np.int32)
+    upper = np.full(n, -np.inf)
+    lower = np.full(n, np.inf)
+    for line in lines:
+        valid = ~np.isnan(line)
+        n_valid += valid
+        above &= ~valid | (close > line)
+        below &= ~valid | (close < line)
+        np.fmax(upper, line, out=upper)
+        np.fmin(lower, line, out=lower)
+    position = np.where(above, POS_ABOVE, np.where(below, POS_BELOW, POS_BETWEEN))
+    position[n_valid == 0] = POS_NONE
+    concentration = np.where(n_valid >= 2, upper - lower, np.inf)
+    return position, concentration
+
+
+def generate_signals(candles: dict, indicators: dict, params: StrategyParams) -> tuple:
+    """按 run_bot 的确认计数规则生成每根K线收盘时的信号，返回 (信号, 均线位置) 两个数组
+
+    信号 1=做多，-1=做空，0=无；均线位置为 POS_* 编码，供止盈平仓（回到均线之间）使用。
+    """
+    close = candles["close"]
+    if "position" in indicators:
+        # 同一组均线的多组参数共用预先算好的位置和密集度
+        position, concentration = indicators["position"], indicators["concentration"]
+    else:
+        position, concentration = ma_positions(close, indicators["lines"])
+    prev = np.concatenate(([POS_NONE - 10], position[:-1]))  # 首根K线之前位置未知
+    changed = (position != prev) & (np.arange(len(close)) > 0)
+    with np.errstate(invalid="ignore"):
+        volume_ok = candles["volume"] > indicators["avg_volume"] * params.volume_multiplier
+        buy_ok = (concentration <= close * params.concentration_pct) & (indicators["rsi"] < params.rsi_buy_below) & volume_ok
+        sell_ok = (indicators["rsi"] > params.rsi_sell_above) & volume_ok
+    signals = np.zeros(len(close), dtype=np.int8)
+    # 确认计数只在位置变为“之上/之下”时累加，其余情况清零；只需遍历这些K线
+    steps = np.flatnonzero(changed & ((position == POS_ABOVE) | (position == POS_BELOW)))
+    buy_count = sell_count = 0
+    last = -2
+    for i, pos, can_buy, can_sell in zip(steps.tolist(), position[steps].tolist(), buy_ok[steps].tolist(), sell_ok[steps].tolist()):
+        if i != last + 1:
+            buy_count = sell_count = 0
+        last = i
+        if pos == POS_ABOVE:
+            buy_count += 1
+            sell_count = 0
+            if buy_count >= params.confirm_bars and can_buy:
+                signals[i] = 1
+                buy_count = 0
+        else:
+            sell_count += 1
+            buy_count = 0
+            if sell_count >= params.confirm_bars and can_sell:
+                signals[i] = -1
+                sell_count = 0
+    return signals, position
+
+
+def _first_stop_hit(candles: dict, start: int, end: int, direction: int, stop_loss: float, take_profit: float):
+    """在 [start, end) 内查找第一根触发止损/止盈的K线，返回 (下标, 成交价)；同一根都触发时按先止损处理"""
+    if start >= end:
+        return None
+    high = candles["high"][start:end]
+    low = candles["low"][start:end]
+    if direction > 0:
+        hits = (low <= stop_loss) | (high >= take_profit)
+    else:
+        hits = (high >= stop_loss) | (low <= take_profit)
+    if not hits.any():
+        return None
+    k = int(np.argmax(hits))
+    i = start + k
+    open_price = candles["open"][i]
+    if direction > 0:
+        if low[k] <= stop_loss:
+            return i, min(open_price, stop_loss)
+        return i, max(open_price, take_profit)
+    if high[k] >= stop_loss:
+        return i, max(open_price, stop_loss)
+    return i, min(open_price, take_profit)
+
+
+def run_backtest(candles: dict, params: StrategyParams = None, indicators: dict = None) -> BacktestResult:
+    """回放 run_bot 策略：K线收盘时处理信号/均线之间平仓，持仓期间用最高/最低价检查止损止盈"""
+    params = params or StrategyParams()
+    if indicators is None:
+        indicators = compute_indicators(candles, params)
+    signals, position = generate_signals(candles, indicators, params)
+    close = candles["close"]
+    ts_sec = candles["ts"] // 1000
+    n = len(close)
+    qty = params.order_size * params.contract_value
+    trades = []
+
+    direction = 0
+    entry_idx = 0
+    entry_price = stop_loss = take_profit = 0.0
+    checked = 0  # 已检查止损止盈的K线位置（不含）
+    last_signal = 0
+    last_trade_time = -10 ** 12
+
+    def exit_trade(i, price, reason):
+        fill = price * (1 - direction * params.slippage_pct)
+        pnl = direction * (fill - entry_price) * qty - params.fee_rate * (entry_price + fill) * qty
+        trades.append((entry_idx, i, direction, entry_price, fill, pnl, reason))
+
+    signal_idx = np.flatnonzero(signals != 0).tolist()
+    between_idx = np.flatnonzero(position == POS_BETWEEN).tolist()
+    cursor = 0
+    while True:
+        # 空仓时只有信号K线有意义；持仓时还要处理均线之间平仓
+        k = bisect_left(signal_idx, cursor)
+        t = signal_idx[k] if k < len(signal_idx) else n
+        if direction != 0:
+            k = bisect_left(between_idx, cursor)
+            t = min(t, between_idx[k] if k < len(between_idx) else n)
+        cursor = t + 1
+        if direction != 0:
+            hit = _first_stop_hit(candles, max(checked, entry_idx + 1), min(t + 1, n), direction, stop_loss, take_profit)
+            if hit is not None:
+                i, price = hit
+                exit_trade(i, price, "stop_loss" if (price - entry_price) * direction < 0 else "take_profit")
+                direction = 0
+                last_signal = 0
+                last_trade_time = ts_sec[i]
+        checked = t + 1
+        if t >= n:
+            break
+        now = int(ts_sec[t])
+        if position[t] == POS_BETWEEN:
+            if direction != 0:
+                exit_trade(t, close[t], "between_ma")
+                direction = 0
+                last_signal = 0
+                last_trade_time = now
+            continue
+        signal = int(signals[t])
+        if signal == last_signal or now - last_trade_time < params.cooldown:
+            continue
+        if direction != 0:
+            exit_trade(t, close[t], "reverse")
+            direction = 0
+            last_trade_time = now
+        price = close[t]
+        if price * params.take_profit_pct * params.order_size * 5 < params.min_profit:
+            continue
+        direction = int(signal)
+        entry_idx = t
+        entry_price = price * (1 + direction * params.slippage_pct)
+        stop_loss = price * (1 - direction * params.stop_loss_pct)
+        take_profit = price * (1 + direction * params.take_profit_pct)
+        last_signal = signal
+        last_trade_time = now
+        checked = t + 1
+
+    if direction != 0:
+        exit_trade(n - 1, close[n - 1], "end")
+
+    trades_df = pd.DataFrame(trades, columns=["entry_idx", "exit_idx", "direction", "entry_price", "exit_price", "pnl", "reason"])
+    equity = _equity_curve(close, trades_df, qty)
+    return BacktestResult(trades_df, equity, summarize(trades_df, equity, ts_sec))
+
+
+def intrabar_ticks(ts, open_, high, low, close, interval_ms: int) -> tuple:
+    """把K线展开成 4 笔成交 (ts, 价格)：阳线按 开→低→高→收，阴线按 开→高→低→收，触发顺序因此确定"""
+    up = close >= open_
+    path = np.stack([open_, np.where(up, low, high), np.where(up, high, low), close], axis=1)
+    offsets = (np.array(INTRABAR_FRACTIONS) * interval_ms).astype(np.int64)
+    return (np.asarray(ts, dtype=np.int64)[:, None] + offsets).ravel(), path.ravel()
+
+
+def _bar_interval_ms(ts: np.ndarray) -> int:
+    return int(np.median(np.diff(ts[:1000]))) if len(ts) > 1 else 60_000
+
+
+def _frame_ticks(df: pd.DataFrame, state: dict) -> tuple:
+    """一块逐笔成交（ts/price 列，也接受 timestamp、px）或秒级K线（open/high/low/close 列）转成 (ts, 价格)"""
+    df = df.rename(columns={"timestamp": "ts", "px": "price"})
+    ts = df["ts"].to_numpy(dtype=np.int64)
+    if "price" in df:
+        return ts, df["price"].to_numpy(dtype=np.float64)
+    if "interval_ms" not in state:
+        state["interval_ms"] = _bar_interval_ms(ts)
+    columns = [df[name].to_numpy(dtype=np.float64) for name in ("open", "high", "low", "close")]
+    return intrabar_ticks(ts, *columns, state["interval_ms"])
+
+
+def iter_tick_chunks(path: str, chunk_size: int = TICK_CHUNK):
+    """流式读取逐笔成交或秒级K线文件（CSV、Parquet、.ohlcv），逐块产出按时间排序的 (ts 毫秒, 价格)
+
+    文件需已按时间排序。每次只持有一块数据，内存占用与文件大小无关（Parquet 需要 pyarrow，否则整体读取）。
+    """
+    state = {}
+    if path.endswith(ARCHIVE_SUFFIX):
+        records = CandleArchive(path).read()
+        interval_ms = _bar_interval_ms(np.asarray(records["ts"][:1000]))
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start:start + chunk_size]
+            yield intrabar_ticks(chunk["ts"], chunk["open"], chunk["high"], chunk["low"], chunk["close"], interval_ms)
+        return
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            frames = [pd.read_parquet(path)]
+        else:
+            frames = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size))
+    else:
+        frames = pd.read_csv(path, chunksize=chunk_size)
+    for df in frames:
+        if len(df):
+            yield _frame_ticks(df, state)
+
+
+def candle_tick_chunks(candles: dict, chunk_size: int = TICK_CHUNK):
+    """没有逐笔数据时，用K线本身按 intrabar_ticks 的顺序合成成交"""
+    interval_ms = _bar_interval_ms(candles["ts"])
+    bars = max(chunk_size // len(INTRABAR_FRACTIONS), 1)
+    for start in range(0, len(candles["ts"]), bars):
+        end = start + bars
+        yield intrabar_ticks(candles["ts"][start:end], candles["open"][start:end], candles["high"][start:end],
+                             candles["low"][start:end], candles["close"][start:end], interval_ms)
+
+
+def load_funding(path: str) -> tuple:
+    """读取资金费率历史（OKX funding-rate-history 格式：fundingTime/fundingRate，也接受 ts/rate），返回按时间排序的 (ts, 费率)"""
+    df = pd.read_csv(path).rename(columns={"fundingTime": "ts", "fundingRate": "rate"}).sort_values("ts")
+    return df["ts"].to_numpy(dtype=np.int64), df["rate"].to_numpy(dtype=np.float64)
+
+
+class _TickSimulator:
+    """逐块消费成交流的撮合状态机：决策在K线收盘后的轮询时刻做出，订单按延迟后的第一笔成交价成交"""
+
+    def __init__(self, candles: dict, signals: np.ndarray, position: np.ndarray, params: StrategyParams,
+                 execution: ExecutionParams, funding: tuple = None):
+        self.params = params
+        self.execution = execution
+        self.funding = funding
+        self.qty = params.order_size * params.contract_value
+        self.signals = signals
+        self.position = position
+        events = np.flatnonzero((signals != 0) | (position == POS_BETWEEN))
+        self.decision_bars = events.tolist()
+        self.decision_ts = (candles["ts"][events] + _bar_interval_ms(candles["ts"])).tolist()  # K线收盘时刻
+        self.next_decision = 0
+        self.funding_ms = execution.funding_interval_hours * 3600 * 1000
+        self.poll_ms = int(execution.poll_interval * 1000)
+        self.next_funding = self.next_poll = 0
+        self.direction = 0
+        self.entry_price = self.stop_loss = self.take_profit = 0.0
+        self.entry_ts = 0
+        self.funding_paid = 0.0
+        self.funding_total = 0.0
+        self.last_signal = 0
+        self.last_trade_time = -10 ** 12
+        self.pending = None  # (订单到达交易所的时刻, [动作...])
+        self.last_price = None
+        self.last_ts = 0
+        self.ticks = 0
+        self.trades = []
+
+    def _next_event(self) -> float:
+        k = self.next_decision
+        decision = self.decision_ts[k] if k < len(self.decision_ts) else np.inf
+        return min(decision, self.next_funding) if self.direction else decision
+
+    def process(self, ts: np.ndarray, px: np.ndarray):
+        n = len(ts)
+        self.ticks += n
+        i = 0
+        while i < n:
+            if self.pending is not None:
+                j = i + int(np.searchsorted(ts[i:], self.pending[0]))
+                if j >= n:
+                    break
+                self._fill(int(ts[j]), float(px[j]))
+                self.last_price = float(px[j])
+                i = j + 1
+                continue
+            event = self._next_event()
+            end = i + int(np.searchsorted(ts[i:], event)) if event != np.inf else n
+            if self.direction and end > i:
+                resume = self._check_stops(ts, px, i, end, int(ts[-1]) + 1 if end >= n else event)
+                if resume is not None:
+                    i = resume
+                    continue
+            if end > i:
+                self.last_price = float(px[end - 1])
+            if end >= n:
+                break
+            i = end
+            if self.direction and self.next_funding <= event:
+                self._settle_funding()
+            else:
+                self._decide()
+        if n:
+            self.last_ts = int(ts[-1])
+
+    def _check_stops(self, ts, px, i: int, end: int, until: int):
+        """在 [i, end) 内检查止损止盈（轮询检查到 until 之前），触发时返回继续处理的位置"""
+        direction = self.direction
+        if self.execution.exchange_stops:
+            seg = px[i:end]
+            if direction > 0:
+                hits = (seg <= self.stop_loss) | (seg >= self.take_profit)
+            else:
+                hits = (seg >= self.stop_loss) | (seg <= self.take_profit)
+            if not hits.any():
+                return None
+            j = i + int(np.argmax(hits))
+            price = float(px[j])
+            self.last_price = price
+            self._exit(int(ts[j]), price, "stop_loss" if (price - self.stop_loss) * direction <= 0 else "take_profit")
+            self._after_stop(int(ts[j]))
+            return j + 1
+        # 本地止损止盈：只在轮询时刻看到最新价，触发后按延迟市价平仓
+        polls = np.arange(self.next_poll, until, self.poll_ms, dtype=np.int64)
+        if not len(polls):
+            return None
+        idx = np.searchsorted(ts, polls, "right") - 1
+        prices = np.where(idx >= 0, px[np.maximum(idx, 0)], self.last_price)
+        if direction > 0:
+            hits = (prices <= self.stop_loss) | (prices >= self.take_profit)
+        else:
+            hits = (prices >= self.stop_loss) | (prices <= self.take_profit)
+        if not hits.any():
+            self.next_poll = int(polls[-1]) + self.poll_ms
+            return None
+        q = int(np.argmax(hits))
+        reason = "stop_loss" if (prices[q] - self.stop_loss) * direction <= 0 else "take_profit"
+        self.pending = (int(polls[q]) + self.execution.latency_ms, [("exit", reason, True)])
+        self.next_poll = int(polls[q]) + self.poll_ms
+        return int(np.searchsorted(ts, polls[q], "right"))
+
+    def _after_stop(self, ts: int):
+        self.last_signal = 0
+        self.last_trade_time = ts // 1000
+
+    def _decide(self):
+        """K线收盘后的决策，规则与 run_backtest 相同"""
+        k = self.next_decision
+        self.next_decision += 1
+        t, now = self.decision_bars[k], self.decision_ts[k]
+        price = self.last_price
+        if price is None:
+            return
+        arrive = now + self.execution.latency_ms
+        if self.position[t] == POS_BETWEEN:
+            if self.direction:
+                self.pending = (arrive, [("exit", "between_ma", True)])
+            return
+        signal = int(self.signals[t])
+        if signal == self.last_signal or now // 1000 - self.last_trade_time < self.params.cooldown:
+            return
+        actions = [("exit", "reverse", False)] if self.direction else []
+        if price * self.params.take_profit_pct * self.params.order_size * 5 >= self.params.min_profit:
+            actions.append(("enter", signal, price))
+        if actions:
+            self.pending = (arrive, actions)
+
+    def _fill(self, ts: int, price: float):
+        params = self.params
+        for action in self.pending[1]:
+            if action[0] == "exit":
+                if self.direction:
+                    self._exit(ts, price, action[1])
+                    self.last_trade_time = ts // 1000
+                    if action[2]:
+                        self.last_signal = 0
+            else:
+                _, direction, decision_price = action
+                self.direction = direction
+                self.entry_price = price * (1 + direction * params.slippage_pct)
+                self.entry_ts = ts
+                # 止损止盈按决策时看到的价格计算，与 app.StrategyState.on_bar 一致
+                self.stop_loss = decision_price * (1 - direction * params.stop_loss_pct)
+                self.take_profit = decision_price * (1 + direction * params.take_profit_pct)
+                self.last_signal = direction
+                self.last_trade_time = ts // 1000
+                self.funding_paid = 0.0
+                self.next_funding = (ts // self.funding_ms + 1) * self.funding_ms
+                self.next_poll = (ts // self.poll_ms + 1) * self.poll_ms
+        self.pending = None
+
+    def _settle_funding(self):
+        """资金费：费率为正时多头付给空头，按结算时的最新价计算名义价值"""
+        rate = self.execution.funding_rate
+        if self.funding is not None and len(self.funding[0]):
+            k = int(np.searchsorted(self.funding[0], self.next_funding, "right")) - 1
+            if k >= 0:
+                rate = float(self.funding[1][k])
+        payment = -self.direction * rate * self.qty * self.last_price
+        self.funding_paid += payment
+        self.funding_total += payment
+        self.next_funding += self.funding_ms
+
+    def _exit(self, ts: int, price: float, reason: str):
+        params = self.params
+        fill = price * (1 - self.direction * params.slippage_pct)
+        pnl = self.direction * (fill - self.entry_price) * self.qty - params.fee_rate * (self.entry_price + fill) * self.qty
+        self.trades.append((self.entry_ts, ts, self.direction, self.entry_price, fill, pnl + self.funding_paid, reason, self.funding_paid))
+        self.direction = 0
+
+    def finish(self):
+        if self.direction and self.last_price is not None:
+            self._exit(self.last_ts, self.last_price, "end")
+
+
+def run_tick_backtest(candles: dict, ticks=None, params: StrategyParams = None, execution: ExecutionParams = None,
+                      indicators: dict = None, funding: tuple = None) -> BacktestResult:
+    """逐笔回放 run_bot 策略：信号仍按K线收盘计算，止损止盈、下单成交和资金费按成交流逐笔模拟
+
+    ticks 为按时间排序的 (ts 毫秒, 价格) 数组块的可迭代对象（如 iter_tick_chunks），逐块消费、不整体载入；
+    为 None 时用K线合成成交（candle_tick_chunks）。成交明细中的 pnl 已扣除手续费并计入资金费。
+    """
+    params = params or StrategyParams()
+    execution = execution or ExecutionParams()
+    if indicators is None:
+        indicators = compute_indicators(candles, params)
+    signals, position = generate_signals(candles, indicators, params)
+    simulator = _TickSimulator(candles, signals, position, params, execution, funding)
+    for ts, px in candle_tick_chunks(candles) if ticks is None else ticks:
+        simulator.process(ts, px)
+    simulator.finish()
+
+    bar_ts = candles["ts"]
+    rows = simulator.trades
+    trades_df = pd.DataFrame(rows, columns=["entry_ts", "exit_ts", "direction", "entry_price", "exit_price", "pnl", "reason", "funding"])
+    # 成交时刻所在的K线，供权益曲线和统计使用
+    trades_df.insert(0, "exit_idx", np.clip(np.searchsorted(bar_ts, trades_df["exit_ts"].to_numpy(dtype=np.int64), "right") - 1, 0, len(bar_ts) - 1))
+    trades_df.insert(0, "entry_idx", np.clip(np.searchsorted(bar_ts, trades_df["entry_ts"].to_numpy(dtype=np.int64), "right") - 1, 0, len(bar_ts) - 1))
+    equity = _equity_curve(candles["close"], trades_df, simulator.qty)
+    stats = summarize(trades_df, equity, bar_ts // 1000)
+    stats.update(ticks=simulator.ticks, funding=simulator.funding_total)
+    return BacktestResult(trades_df, equity, stats)
+
+
+def _equity_curve(close: np.ndarray, trades: pd.DataFrame, qty: float) -> np.ndarray:
+    """逐K线权益（已实现盈亏 + 持仓浮动盈亏，单位为计价币）"""
+    realized = np.zeros(len(close))
+    unrealized = np.zeros(len(close))
+    if len(trades):
+        np.add.at(realized, trades["exit_idx"].to_numpy(), trades["pnl"].to_numpy())
+        for entry_idx, exit_idx, direction, entry_price in trades[["entry_idx", "exit_idx", "direction", "entry_price"]].itertuples(index=False):
+            unrealized[entry_idx:exit_idx] = direction * (close[entry_idx:exit_idx] - entry_price) * qty
+    return np.cumsum(realized) + unrealized
+
+
+def summarize(trades: pd.DataFrame, equity: np.ndarray, ts_sec: np.ndarray) -> dict:
+    pnl = trades["pnl"].to_numpy() if len(trades) else np.zeros(0)
+    wins = pnl[pnl > 0]
+    losses = pnl[pnl < 0]
+    drawdown = np.maximum.accumulate(equity) - equity if len(equity) else np.zeros(1)
+    returns = np.diff(equity)
+    return {
+        "bars": int(len(equity)),
+        "days": float((ts_sec[-1] - ts_sec[0]) / 86400) if len(ts_sec) else 0.0,
+        "trades": int(len(pnl)),
+        "win_rate": float(len(wins) / len(pnl)) if len(pnl) else 0.0,
+        "total_pnl": float(pnl.sum()),
+        "avg_pnl": float(pnl.mean()) if len(pnl) else 0.0,
+        "profit_factor": float(wins.sum() / -losses.sum()) if len(losses) else float("inf") if len(wins) else 0.0,
+        "max_drawdown": float(drawdown.max()),
+        "sharpe_per_bar": float(returns.mean() / returns.std()) if len(returns) and returns.std() > 0 else 0.0,
+        "avg_bars_held": float((trades["exit_idx"] - trades["entry_idx"]).mean()) if len(pnl) else 0.0,
+        "exits": trades["reason"].value_counts().to_dict() if len(pnl) else {},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run_bot 策略历史回测")
+    parser.add_argument("path", help="K线文件（CSV 或 Parquet）")
+    parser.add_argument("--trades", help="成交明细输出 CSV 路径")
+    parser.add_argument("--equity", help="权益曲线输出 .npy 路径")
+    parser.add_argument("--params", help="覆盖默认参数的 JSON，例如 '{\"confirm_bars\": 1}'")
+    parser.add_argument("--ticks", help="逐笔成交或秒级K线文件，按成交流模拟止损止盈和成交")
+    parser.add_argument("--intrabar", action="store_true", help="没有逐笔数据时，用K线合成成交做逐笔模拟")
+    parser.add_argument("--execution", help="覆盖 ExecutionParams 的 JSON，例如 '{\"exchange_stops\": false}'")
+    parser.add_argument("--funding", help="资金费率历史 CSV（fundingTime, fundingRate）")
+    args = parser.parse_args()
+
+    params = StrategyParams(**json.loads(args.params)) if args.params else StrategyParams()
+    execution = ExecutionParams(**json.loads(args.execution)) if args.execution else ExecutionParams()
+    start = time.perf_counter()
+    candles = load_candles(args.path)
+    loaded = time.perf_counter()
+    if args.ticks or args.intrabar:
+        ticks = iter_tick_chunks(args.ticks) if args.ticks else None
+        funding = load_funding(args.funding) if args.funding else None
+        result = run_tick_backtest(candles, ticks, params, execution, funding=funding)
+    else:
+        result = run_backtest(candles, params)
+    finished = time.perf_counter()
+    output = {"params": asdict(params), "stats": result.stats}
+    if args.ticks or args.intrabar:
+        output["execution"] = asdict(execution)
+    print(json.dumps(output, ensure_ascii=False, indent=2, default=str))
+    print(f"读取 {loaded - start:.2f} 秒, 回测 {finished - loaded:.2f} 秒, 共 {len(candles['close'])} 根K线")
+    if args.trades:
+        result.trades.to_csv(args.trades, index=False)
+    if args.equity:
+        np.save(args.equity, result.equity)
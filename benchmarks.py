@@ -0,0 +1,412 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from okx import MarketData, Trade, Account
+
+import okx_clients
+from fake_okx import FakeOkxRestServer
+from order_book import OrderBook
+from pine_converter import PineScriptConverter, compile_pine
+
+RESULTS_FILE = os.path.join("bench_results", "benchmark_results.json")  # 本次结果（目录已加入 .gitignore）
+BASELINE_FILE = "benchmark_baseline.json"  # 仓库中提交的基线
+
+# suite 中 pine_generate_signal 用例计时的用户脚本（经 compile_pine 编译），覆盖常见的指标和开平仓语句
+BENCH_PINE_SCRIPT = """//@version=5
+strategy("EMA RSI", overlay=true)
+fastLen = input.int(12, "Fast")
+slowLen = input.int(26, "Slow")
+rsiLen = input.int(14, "RSI")
+fast = ta.ema(close, fastLen)
+slow = ta.ema(close, slowLen)
+r = ta.rsi(close, rsiLen)
+atr = ta.atr(14)
+if ta.crossover(fast, slow) and r < 70
+    strategy.entry("Long", strategy.long)
+if ta.crossunder(fast, slow) and r > 30
+    strategy.entry("Short", strategy.short)
+if close < slow - 2 * atr
+    strategy.close("Long")
+plot(fast)
+"""
+
+
+def _cycle_fresh(domain: str):
+    """旧写法：每次调用都新建客户端（新连接）"""
+    MarketData.MarketAPI(flag="1", domain=domain).get_ticker(instId="BTC-USDT-SWAP")
+    MarketData.MarketAPI(flag="1", domain=domain).get_history_candlesticks(instId="BTC-USDT-SWAP", bar="1m", limit="2")
+    Account.AccountAPI("k", "s", "p", flag="1", domain=domain).get_positions(instId="BTC-USDT-SWAP")
+    Account.AccountAPI("k", "s", "p", flag="1", domain=domain).get_account_config()
+    Trade.TradeAPI("k", "s", "p", flag="1", domain=domain).place_order(
+        instId="BTC-USDT-SWAP", tdMode="cross", side="buy", ordType="market", sz="0.1")
+
+
+def _cycle_shared(domain: str):
+    """新写法：复用 okx_clients 中的共享客户端"""
+    okx_clients.get_market_api("1", domain).get_ticker(instId="BTC-USDT-SWAP")
+    okx_clients.get_market_api("1", domain).get_history_candlesticks(instId="BTC-USDT-SWAP", bar="1m", limit="2")
+    okx_clients.get_account_api("k", "s", "p", "1", domain).get_positions(instId="BTC-USDT-SWAP")
+    okx_clients.get_account_api("k", "s", "p", "1", domain).get_account_config()
+    okx_clients.get_trade_api("k", "s", "p", "1", domain).place_order(
+        instId="BTC-USDT-SWAP", tdMode="cross", side="buy", ordType="market", sz="0.1")
+
+
+def bench_client_reuse(cycles: int = 50, connect_delay: float = 0.02) -> dict:
+    """对比每次新建客户端与复用共享客户端的单周期耗时（本地假 OKX 服务）"""
+    server = FakeOkxRestServer(connect_delay=connect_delay).start()
+    scheduler = okx_clients.get_scheduler()
+    enabled = scheduler.enabled
+    scheduler.enabled = False  # 假服务不限速，只比较建连开销
+    try:
+        results = {}
+        for name, cycle in (("fresh", _cycle_fresh), ("shared", _cycle_shared)):
+            cycle(server.url)  # 预热
+            connections_before = server.connections
+            start = time.perf_counter()
+            for _ in range(cycles):
+                cycle(server.url)
+            elapsed = time.perf_counter() - start
+            results[name] = {
+                "ms_per_cycle": elapsed / cycles * 1000,
+                "connections": server.connections - connections_before,
+            }
+        results["saved_ms_per_cycle"] = results["fresh"]["ms_per_cycle"] - results["shared"]["ms_per_cycle"]
+        return results
+    finally:
+        scheduler.enabled = enabled
+        okx_clients.close_all()
+        server.stop()
+
+
+def _synthetic_candles(bars: int, seed: int = 0) -> list:
+    """随机游走的 OKX 格式K线（从旧到新）"""
+    rng = np.random.default_rng(seed)
+    close = 50000 * np.exp(np.cumsum(rng.normal(0, 0.002, bars)))
+    open_ = np.concatenate(([close[0]], close[:-1]))
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.002, bars))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.002, bars))
+    ts = 1_700_000_000_000 + np.arange(bars) * 60_000
+    return [[str(t), str(o), str(h), str(l), str(c), "1", "0", "0", "1"]
+            for t, o, h, l, c in zip(ts, open_, high, low, close)]
+
+
+def _supertrend_iloc(candles: list, periods: int = 10, multiplier: float = 3.0) -> pd.Series:
+    """旧写法：DataFrame + 逐行 iloc 读写（与生成代码同一公式），作为对照"""
+    df = pd.DataFrame(candles, columns=["ts", "open", "high", "low", "close", "volume", "volCcy", "volCcyQuote", "confirm"]).astype(float)
+    close, high, low = df["close"], df["high"], df["low"]
+    src = (high + low) / 2
+    tr = pd.concat([
+        (high - low).abs(),
+        (high - close.shift(1).fillna(high)).abs(),
+        (low - close.shift(1).fillna(low)).abs()
+    ], axis=1).max(axis=1)
+    atr = tr.rolling(periods).mean()
+    up_final = src - multiplier * atr
+    dn_final = src + multiplier * atr
+    trend = pd.Series(1, index=df.index)
+    for i in range(1, len(df)):
+        up1 = up_final.iloc[i - 1] if not pd.isna(up_final.iloc[i - 1]) else up_final.iloc[i]
+        dn1 = dn_final.iloc[i - 1] if not pd.isna(dn_final.iloc[i - 1]) else dn_final.iloc[i]
+        if close.iloc[i - 1] > up1:
+            up_final.iloc[i] = max(up_final.iloc[i], up1)
+        if close.iloc[i - 1] < dn1:
+            dn_final.iloc[i] = min(dn_final.iloc[i], dn1)
+        prev_trend = trend.iloc[i - 1]
+        if prev_trend == -1 and close.iloc[i] > dn1:
+            trend.iloc[i] = 1
+        elif prev_trend == 1 and close.iloc[i] < up1:
+            trend.iloc[i] = -1
+        else:
+            trend.iloc[i] = prev_trend
+    return trend
+
+
+def bench_pine_supertrend(bars: int = 100_000, reference: bool = True) -> dict:
+    """对比逐行 iloc 循环、生成的向量化 SuperTrend 与增量版本在 bars 根K线上的耗时"""
+    ok, code, error = PineScriptConverter().convert("")
+    if not ok:
+        raise RuntimeError(error)
+    namespace = {}
+    exec(code, namespace)
+    candles = _synthetic_candles(bars)
+    results = {"bars": bars}
+
+    start = time.perf_counter()
+    namespace["generate_signal"]({"candles": candles})
+    results["vectorized_ms"] = (time.perf_counter() - start) * 1000
+    high, low, close = namespace["_ohlc"]({"candles": candles})
+    start = time.perf_counter()
+    trend = namespace["supertrend"](high, low, close)[2]
+    results["kernel_ms"] = (time.perf_counter() - start) * 1000  # 不含K线字符串解析
+
+    state = namespace["SuperTrendState"]()
+    start = time.perf_counter()
+    incremental = [state.update(h, l, c) for h, l, c in zip(high.tolist(), low.tolist(), close.tolist())]
+    elapsed = time.perf_counter() - start
+    results["incremental_us_per_bar"] = elapsed / bars * 1e6
+    flips = [i for i in range(1, bars) if trend[i] != trend[i - 1]]
+    results["signals"] = len(flips)
+    results["incremental_matches"] = flips == [i for i, signal in enumerate(incremental) if signal]
+
+    if reference:
+        start = time.perf_counter()
+        expected = _supertrend_iloc(candles)
+        results["iloc_ms"] = (time.perf_counter() - start) * 1000
+        results["speedup"] = results["iloc_ms"] / results["vectorized_ms"]
+        results["matches_iloc"] = bool((expected.to_numpy() == trend).all())
+    return results
+
+
+def measure(func, iterations: int = 200, warmup: int = 5, memory_iterations: int = 20) -> dict:
+    """多次调用 func，返回 p50/p99/平均延迟（微秒）、吞吐量（次/秒）和峰值内存（KiB）
+
+    计时与内存分开测：tracemalloc 会拖慢分配，只在最后 memory_iterations 次调用中开启。
+    """
+    for _ in range(warmup):
+        func()
+    samples = np.empty(iterations)
+    for i in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples[i] = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        for _ in range(memory_iterations):
+            func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "iterations": iterations,
+        "p50_us": float(np.percentile(samples, 50) * 1e6),
+        "p99_us": float(np.percentile(samples, 99) * 1e6),
+        "mean_us": float(samples.mean() * 1e6),
+        "throughput_per_s": float(iterations / samples.sum()),
+        "peak_kib": peak / 1024,
+    }
+
+
+def _import_app(server_url: str):
+    """在假 OKX 服务上导入 app：补齐必需的环境变量，并把共享客户端指向假服务"""
+    for key in ("BOT_TOKEN", "CHAT_ID", "API_KEY", "SECRET_KEY", "PASS_PHRASE"):
+        os.environ.setdefault(key, "bench")
+    os.environ.setdefault("TELEGRAM_API_URL", server_url)
+    os.environ["ACCOUNT_DATA_MODE"] = "rest"
+    os.environ["CANDLE_ARCHIVE_DIR"] = ""  # 不读写本地K线归档，避免上次运行留下的数据影响结果
+    okx_clients.OKX_DOMAIN = server_url
+    okx_clients.get_scheduler().enabled = False  # 假服务不限速，只测本地开销
+    import app
+    return app
+
+
+def _suite_cases(app, server: FakeOkxRestServer, signal_bars: int) -> dict:
+    """基准用例：名称 -> 无参函数"""
+    candles = _synthetic_candles(app.CANDLE_LIMIT)[::-1]  # OKX 返回最新在前
+    ma, ema = app.calculate_ma_ema(candles, app.MA_PERIODS)
+    close = float(candles[0][4])
+
+    strategy = compile_pine(BENCH_PINE_SCRIPT)
+    signal_data = {"candles": _synthetic_candles(signal_bars)}
+
+    symbol = app.SYMBOL
+    state = app.StrategyState(symbol, app.BAR_INTERVAL)
+    runtime = app.BotRuntime([state])
+    loop = asyncio.new_event_loop()
+
+    def run_bot_iteration():
+        # 与 BotRuntime 一轮相同：批量取价 -> 同步K线和指标 -> 生成信号；重置K线时间戳使每轮都走完整路径
+        now = int(time.time())
+        prices = app.get_latest_prices([symbol])
+        state.last_candle_ts = 0
+        if state.on_tick(prices[symbol], now):
+            data = app.load_symbol_data(symbol, prices[symbol])[state.bar]
+            for intent in state.on_bar(data, now):
+                loop.run_until_complete(runtime.execute(state, intent))
+
+    def order_path():
+        # 开仓（附带止盈止损）再平仓，持仓走 REST 查询
+        price = server.last_price
+        loop.run_until_complete(runtime.execute(state, ("open", "buy", price, app.ORDER_SIZE, price * 0.98, price * 1.04)))
+        server.positions = [{"instId": symbol, "posSide": "long", "pos": str(app.ORDER_SIZE), "mgnMode": "cross"}]
+        loop.run_until_complete(runtime.execute(state, ("close", "止损", True)))
+        server.positions = []
+
+    # 400 档订单簿：每轮一次单档增量更新，以及一次吃掉多档的滑点估算
+    book = OrderBook(symbol)
+    book.apply("snapshot", {
+        "bids": [[f"{close - i * 0.1:.1f}", "1.5"] for i in range(1, 401)],
+        "asks": [[f"{close + i * 0.1:.1f}", "1.5"] for i in range(1, 401)],
+    })
+    book_updates = itertools.cycle([{"asks": [[f"{close + 0.3:.1f}", sz]]} for sz in ("2", "1.5")])
+
+    return {
+        "order_book_update": lambda: book.apply("update", next(book_updates)),
+        "order_book_estimate_fill": lambda: book.estimate_fill("buy", 20),
+        "calculate_rsi": lambda: app.calculate_rsi(candles),
+        "calculate_ma_ema": lambda: app.calculate_ma_ema(candles, app.MA_PERIODS),
+        "calculate_avg_volume": lambda: app.calculate_avg_volume(candles),
+        "calculate_ma_concentration": lambda: app.calculate_ma_concentration(ma, ema),
+        "determine_position": lambda: app.determine_position(close, ma, ema),
+        "pine_generate_signal": lambda: strategy.generate_signal(signal_data),
+        "run_bot_iteration": run_bot_iteration,
+        "order_path": order_path,
+    }
+
+
+def bench_suite(iterations: int = 200, cases: list = None, signal_bars: int = 1000) -> dict:
+    """指标、信号和下单路径的延迟基准（本地假 OKX 服务），返回可直接保存为 JSON 的结果"""
+    server = FakeOkxRestServer().start()
+    root = logging.getLogger()
+    level = root.level
+    try:
+        app = _import_app(server.url)
+        root.setLevel(logging.CRITICAL)  # 低于 CRITICAL 的日志在级别检查处返回，不格式化、不进入日志队列
+        all_cases = _suite_cases(app, server, signal_bars)
+        results = {}
+        for name in cases or all_cases:
+            # 网络用例单次耗时远大于纯计算，减少次数
+            n = max(iterations // 10, 10) if name in ("run_bot_iteration", "order_path") else iterations
+            results[name] = measure(all_cases[name], n)
+        return {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": sys.version.split()[0],
+                "numpy": np.__version__,
+                "pandas": pd.__version__,
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "signal_bars": signal_bars,
+            },
+            "results": results,
+        }
+    finally:
+        root.setLevel(level)
+        okx_clients.close_all()
+        server.stop()
+
+
+# 启动预算：导入入口模块（含 /health 首次响应）的耗时和常驻内存上限，超出时 startup 退出码为 1
+STARTUP_BUDGET = {
+    "app": {"ready_ms": 800, "rss_mib": 120},
+    "main": {"ready_ms": 600, "rss_mib": 100},
+}
+
+_STARTUP_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+module = __import__(sys.argv[1])
+import_ms = (time.perf_counter() - start) * 1000
+flask_app = getattr(module, "app", None)
+if hasattr(flask_app, "test_client"):
+    flask_app.test_client().get("/health")
+ready_ms = (time.perf_counter() - start) * 1000
+heavy = [name for name in ("pandas", "okx", "requests", "websockets", "flask") if name in sys.modules]
+print(json.dumps({"import_ms": import_ms, "ready_ms": ready_ms, "rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "modules": len(sys.modules), "heavy_modules": heavy}))
+"""
+
+
+def bench_startup(entry: str, runs: int = 5) -> dict:
+    """在全新的子进程中导入入口模块 runs 次，返回导入耗时、就绪耗时（app 为 /health 首次响应）和峰值 RSS 的中位数"""
+    env = dict(os.environ)
+    for key in ("BOT_TOKEN", "CHAT_ID", "API_KEY", "SECRET_KEY", "PASS_PHRASE"):
+        env.setdefault(key, "bench")
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", _STARTUP_SCRIPT, entry], env=env, capture_output=True,
+                                text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        samples.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    result = {key: float(np.median([s[key] for s in samples])) for key in ("import_ms", "ready_ms", "rss_mib")}
+    result["modules"] = samples[-1]["modules"]
+    result["heavy_modules"] = samples[-1]["heavy_modules"]
+    budget = STARTUP_BUDGET.get(entry, {})
+    result["over_budget"] = [key for key, limit in budget.items() if result[key] > limit]
+    return result
+
+
+def compare_baseline(current: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    """与基线比较 p50/p99，返回 [(用例, 指标, 基线, 当前, 比值, 是否退化)]；基线中没有的用例跳过"""
+    rows = []
+    for name, result in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        for metric in ("p50_us", "p99_us"):
+            ratio = result[metric] / base[metric] if base[metric] else float("inf")
+            rows.append((name, metric, base[metric], result[metric], ratio, ratio > 1 + tolerance))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="交易机器人基准测试")
+    parser.add_argument("bench", nargs="?", choices=["clients", "pine", "suite", "startup"], default="clients")
+    parser.add_argument("--cycles", type=int, default=50)
+    parser.add_argument("--connect-delay", type=float, default=0.02, help="模拟每个新连接的握手耗时（秒）")
+    parser.add_argument("--bars", type=int, default=100_000, help="pine: K线数量")
+    parser.add_argument("--skip-reference", action="store_true", help="pine: 不运行逐行 iloc 对照")
+    parser.add_argument("--iterations", type=int, default=200, help="suite: 每个用例的计时次数")
+    parser.add_argument("--cases", help="suite: 只运行这些用例（逗号分隔）")
+    parser.add_argument("--signal-bars", type=int, default=1000, help="suite: generate_signal 的K线数量")
+    parser.add_argument("--output", default=RESULTS_FILE, help="suite: 结果 JSON 路径")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="suite: 基线 JSON 路径，p50/p99 超出容差时退出码为 1；空字符串不比较")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="suite: 允许的变慢比例")
+    parser.add_argument("--update-baseline", action="store_true", help="suite: 把本次结果写入 --baseline")
+    parser.add_argument("--entries", default="app,main", help="startup: 要测量的入口模块（逗号分隔）")
+    parser.add_argument("--runs", type=int, default=5, help="startup: 每个入口启动的次数")
+    args = parser.parse_args()
+    if args.bench == "clients":
+        result = bench_client_reuse(args.cycles, args.connect_delay)
+        for name in ("fresh", "shared"):
+            print(f"{name:>6}: {result[name]['ms_per_cycle']:.2f} ms/周期, 新建连接 {result[name]['connections']} 个")
+        print(f"每周期节省: {result['saved_ms_per_cycle']:.2f} ms")
+    elif args.bench == "startup":
+        print(f"{'入口':<8}{'导入(ms)':>10}{'就绪(ms)':>10}{'RSS(MiB)':>10}{'模块数':>8}  已加载的重依赖")
+        over = []
+        for entry in args.entries.split(","):
+            r = bench_startup(entry, args.runs)
+            print(f"{entry:<8}{r['import_ms']:>10.0f}{r['ready_ms']:>10.0f}{r['rss_mib']:>10.1f}{r['modules']:>8}  {', '.join(r['heavy_modules']) or '-'}")
+            over += [f"{entry} {key} 超出预算 {STARTUP_BUDGET[entry][key]}" for key in r["over_budget"]]
+        for line in over:
+            print(line)
+        if over:
+            sys.exit(1)
+    elif args.bench == "suite":
+        result = bench_suite(args.iterations, args.cases.split(",") if args.cases else None, args.signal_bars)
+        print(f"{'用例':<28}{'p50(us)':>12}{'p99(us)':>12}{'次/秒':>12}{'峰值(KiB)':>12}")
+        for name, r in result["results"].items():
+            print(f"{name:<28}{r['p50_us']:>12.1f}{r['p99_us']:>12.1f}{r['throughput_per_s']:>12.0f}{r['peak_kib']:>12.1f}")
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存: {args.output}")
+        if args.baseline and args.update_baseline:
+            with open(args.baseline, "w") as f:
+                json.dump(result, f, indent=2, ensure_ascii=False)
+            print(f"基线已更新: {args.baseline}")
+        elif args.baseline:
+            with open(args.baseline) as f:
+                rows = compare_baseline(result, json.load(f), args.tolerance)
+            regressions = [row for row in rows if row[5]]
+            for name, metric, base, current, ratio, regressed in rows:
+                print(f"{name:<28}{metric:<8}{base:>12.1f} -> {current:>12.1f}  x{ratio:.2f}{'  退化' if regressed else ''}")
+            if regressions:
+                print(f"{len(regressions)} 项超出容差 {args.tolerance:.0%}")
+                sys.exit(1)
+            print("未发现退化")
+    else:
+        result = bench_pine_supertrend(args.bars, not args.skip_reference)
+        print(f"{result['bars']} 根K线, 趋势反转 {result['signals']} 次")
+        print(f"向量化: {result['vectorized_ms']:.1f} ms（其中计算 {result['kernel_ms']:.1f} ms）, 增量: {result['incremental_us_per_bar']:.2f} us/根, 增量结果一致: {result['incremental_matches']}")
+        if "iloc_ms" in result:
+            print(f"逐行 iloc: {result['iloc_ms']:.1f} ms, 加速 {result['speedup']:.0f} 倍, 结果一致: {result['matches_iloc']}")
@@ -0,0 +1,212 @@
+import argparse
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from candle_store import OKX_HISTORY_PAGE_LIMIT
+
+ARCHIVE_SUFFIX = ".ohlcv"
+RECORD_DTYPE = np.dtype([("ts", "<i8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"), ("close", "<f8"), ("volume", "<f8")])
+PAGE_INTERVAL = 0.1  # history-candles 限速 20 次/2 秒，分页之间稍作等待
+BAR_SECONDS = {
+    "1m": 60, "3m": 180, "5m": 300, "15m": 900, "30m": 1800,
+    "1H": 3600, "2H": 7200, "4H": 14400, "6H": 21600, "12H": 43200,
+    "1D": 86400
+}
+
+
+class CandleArchive:
+    """单个 (产品, K线周期) 的本地K线归档：定长二进制记录（RECORD_DTYPE，48 字节/根），按时间从旧到新
+
+    只保存已收盘的K线。新K线直接追加到文件末尾；回补历史或补缺时合并后写入临时文件再原子替换，
+    已打开的 memmap 仍指向旧文件，不受影响。read 返回 numpy.memmap 视图，不复制数据。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._last_ts = None
+
+    @classmethod
+    def for_symbol(cls, root: str, symbol: str, bar: str):
+        return cls(os.path.join(root, symbol, bar + ARCHIVE_SUFFIX))
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self.path) // RECORD_DTYPE.itemsize
+        except FileNotFoundError:
+            return 0
+
+    def read(self, start_ts: int = None, end_ts: int = None) -> np.ndarray:
+        """读取 [start_ts, end_ts) 区间的记录（结构化数组，字段同 RECORD_DTYPE）"""
+        n = len(self)
+        if n == 0:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        records = np.memmap(self.path, dtype=RECORD_DTYPE, mode="r", shape=(n,))
+        if start_ts is None and end_ts is None:
+            return records
+        ts = records["ts"]
+        lo = 0 if start_ts is None else int(np.searchsorted(ts, start_ts))
+        hi = n if end_ts is None else int(np.searchsorted(ts, end_ts))
+        return records[lo:hi]
+
+    def columns(self, start_ts: int = None, end_ts: int = None) -> dict:
+        """按列返回，格式与 backtest.load_candles 相同（各列是 memmap 的跨步视图）"""
+        records = self.read(start_ts, end_ts)
+        return {name: records[name] for name in RECORD_DTYPE.names}
+
+    @property
+    def last_ts(self):
+        if self._last_ts is None:
+            n = len(self)
+            if n:
+                with open(self.path, "rb") as f:
+                    f.seek((n - 1) * RECORD_DTYPE.itemsize)
+                    self._last_ts = int(np.frombuffer(f.read(RECORD_DTYPE.itemsize), dtype=RECORD_DTYPE)["ts"][0])
+        return self._last_ts
+
+    @property
+    def first_ts(self):
+        records = self.read()
+        return int(records["ts"][0]) if len(records) else None
+
+    def append(self, rows) -> int:
+        """追加 (ts, open, high, low, close, volume) 行，只写入比已有最新一根更新的行，返回写入条数"""
+        records = _to_records(rows)
+        with self._lock:
+            last_ts = self.last_ts
+            if last_ts is not None:
+                records = records[records["ts"] > last_ts]
+            return self._append(records)
+
+    def merge(self, rows) -> int:
+        """合并任意时间的行（回补/补缺），相同时间戳以新数据为准，返回新增条数"""
+        records = _to_records(rows)
+        if not len(records):
+            return 0
+        with self._lock:
+            last_ts = self.last_ts
+            if last_ts is None or int(records["ts"][0]) > last_ts:
+                return self._append(records)
+            existing = self.read()
+            merged = _dedupe(np.concatenate([np.asarray(existing), records]))
+            tmp = f"{self.path}.tmp{os.getpid()}"
+            with open(tmp, "wb") as f:
+                f.write(merged.tobytes())
+            os.replace(tmp, self.path)
+            self._last_ts = int(merged["ts"][-1])
+            return len(merged) - len(existing)
+
+    def _append(self, records: np.ndarray) -> int:
+        if not len(records):
+            return 0
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(records.tobytes())
+        self._last_ts = int(records["ts"][-1])
+        return len(records)
+
+    def gaps(self, interval_ms: int, start_ts: int = None, end_ts: int = None) -> list:
+        """[start_ts, end_ts) 内缺失的区间 [(起, 止), ...]，端点均为应有K线的时间戳边界"""
+        ts = self.read()["ts"]
+        missing = []
+        if not len(ts):
+            if start_ts is not None and end_ts is not None and start_ts < end_ts:
+                missing.append((start_ts, end_ts))
+            return missing
+        if start_ts is not None and start_ts < ts[0]:
+            missing.append((start_ts, int(ts[0])))
+        jumps = np.flatnonzero(np.diff(ts) > interval_ms)
+        missing.extend((int(ts[i]) + interval_ms, int(ts[i + 1])) for i in jumps)
+        if end_ts is not None and int(ts[-1]) + interval_ms < end_ts:
+            missing.append((int(ts[-1]) + interval_ms, end_ts))
+        return missing
+
+
+def _to_records(rows) -> np.ndarray:
+    return _dedupe(np.array([tuple(row) for row in rows], dtype=RECORD_DTYPE))
+
+
+def _dedupe(records: np.ndarray) -> np.ndarray:
+    """按时间排序并去重，同一时间戳保留后出现的记录"""
+    order = np.argsort(records["ts"], kind="stable")
+    records = records[order]
+    keep = np.ones(len(records), dtype=bool)
+    keep[:-1] = records["ts"][1:] != records["ts"][:-1]
+    return records[keep]
+
+
+def closed_rows(candles, interval_ms: int, now_ms: int = None) -> list:
+    """OKX 格式K线中已收盘的行（从旧到新）；有 confirm 字段时以它为准"""
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    rows = []
+    for candle in reversed(candles):
+        ts = int(candle[0])
+        confirmed = candle[8] == "1" if len(candle) > 8 else ts + interval_ms <= now_ms
+        if confirmed:
+            rows.append((ts, float(candle[1]), float(candle[2]), float(candle[3]), float(candle[4]), float(candle[5])))
+    return rows
+
+
+def fetch_history(market, symbol: str, bar: str, start_ts: int, end_ts: int, interval_ms: int) -> list:
+    """从 end_ts 往前分页拉取 history-candles，直到覆盖 start_ts 或没有更早的数据，返回 [start_ts, end_ts) 内已收盘的行"""
+    rows = []
+    after = str(end_ts)
+    while True:
+        result = market.get_history_candlesticks(instId=symbol, bar=bar, after=after, limit=str(OKX_HISTORY_PAGE_LIMIT))
+        if result.get("code") != "0":
+            logging.warning("历史K线拉取失败: %s %s, %s", symbol, bar, result.get("msg"))
+            break
+        data = result.get("data") or []
+        if not data:
+            break
+        rows.extend(row for row in closed_rows(data, interval_ms) if start_ts <= row[0] < end_ts)
+        oldest = int(data[-1][0])
+        if oldest <= start_ts or len(data) < OKX_HISTORY_PAGE_LIMIT:
+            break
+        after = str(oldest)
+        time.sleep(PAGE_INTERVAL)
+    return rows
+
+
+def backfill_archive(market, archive: CandleArchive, symbol: str, bar: str, interval_secs: int,
+                     start_ts: int, end_ts: int = None) -> int:
+    """补齐 [start_ts, end_ts) 内归档缺失的K线（开头、中间断档和结尾），返回新增条数"""
+    interval_ms = interval_secs * 1000
+    end_ts = end_ts or int(time.time() * 1000) // interval_ms * interval_ms
+    added = 0
+    for gap_start, gap_end in archive.gaps(interval_ms, start_ts, end_ts):
+        rows = fetch_history(market, symbol, bar, gap_start, gap_end, interval_ms)
+        if rows:
+            added += archive.merge(rows)
+        logging.info("归档补缺: %s %s [%s, %s) 新增 %s 根", symbol, bar, gap_start, gap_end, len(rows))
+    return added
+
+
+if __name__ == "__main__":
+    from okx_clients import get_market_api
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="本地K线归档：回补历史、补缺、查看概况")
+    parser.add_argument("command", choices=["backfill", "info"])
+    parser.add_argument("symbol")
+    parser.add_argument("bar", choices=list(BAR_SECONDS))
+    parser.add_argument("--dir", default=os.getenv("CANDLE_ARCHIVE_DIR", "/tmp/candle_archive"))
+    parser.add_argument("--days", type=float, default=30, help="backfill: 回补最近多少天")
+    parser.add_argument("--demo", action="store_true", help="使用模拟盘行情")
+    args = parser.parse_args()
+
+    interval_secs = BAR_SECONDS[args.bar]
+    archive = CandleArchive.for_symbol(args.dir, args.symbol, args.bar)
+    if args.command == "backfill":
+        start_ts = int((time.time() - args.days * 86400) * 1000) // (interval_secs * 1000) * interval_secs * 1000
+        added = backfill_archive(get_market_api("1" if args.demo else "0"), archive, args.symbol, args.bar, interval_secs, start_ts)
+        print(f"新增 {added} 根K线")
+    records = archive.read()
+    gaps = archive.gaps(interval_secs * 1000)
+    print(f"{archive.path}: {len(records)} 根K线, 断档 {len(gaps)} 处")
+    if len(records):
+        print(f"时间范围: {int(records['ts'][0])} - {int(records['ts'][-1])}")
@@ -0,0 +1,170 @@
+import logging
+
+import numpy as np
+
+OKX_HISTORY_PAGE_LIMIT = 100  # history-candles 单次最多返回 100 根
+
+
+class CandleStore:
+    """定长环形K线缓存（按时间从旧到新），ts/open/high/low/close/volume 存在 NumPy 数组中"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.ts = np.zeros(capacity, dtype=np.int64)
+        self.ohlcv = np.zeros((capacity, 5), dtype=np.float64)
+        self.size = 0
+        self._next = 0  # 下一个写入位置
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def last_ts(self):
+        if self.size == 0:
+            return None
+        return int(self.ts[(self._next - 1) % self.capacity])
+
+    @property
+    def first_ts(self):
+        if self.size == 0:
+            return None
+        return int(self.ts[(self._next - self.size) % self.capacity])
+
+    def clear(self):
+        self.size = 0
+        self._next = 0
+
+    def load_arrays(self, ts, ohlcv):
+        """用从旧到新的数组整体替换缓存内容（如快照恢复），超出容量时保留最新的部分"""
+        n = min(len(ts), self.capacity)
+        self.ts[:n] = ts[len(ts) - n:]
+        self.ohlcv[:n] = ohlcv[len(ts) - n:]
+        self.size = n
+        self._next = n % self.capacity
+
+    def upsert(self, ts: int, open_price: float, high: float, low: float, close: float, volume: float) -> str:
+        """写入一根K线：时间戳相同则修正最后一根，更新则追加，更旧的忽略"""
+        last_ts = self.last_ts
+        if last_ts is not None and ts < last_ts:
+            return "stale"
+        if ts == last_ts:
+            idx = (self._next - 1) % self.capacity
+            self.ohlcv[idx] = (open_price, high, low, close, volume)
+            return "update"
+        idx = self._next
+        self.ts[idx] = ts
+        self.ohlcv[idx] = (open_price, high, low, close, volume)
+        self._next = (idx + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return "append"
+
+    def upsert_okx(self, candles) -> list:
+        """写入 OKX 格式K线（最新在前的字符串数组），返回实际变化的行（从旧到新）"""
+        changed = []
+        for candle in reversed(candles):
+            row = (int(candle[0]), float(candle[1]), float(candle[2]), float(candle[3]), float(candle[4]), float(candle[5]))
+            if self.upsert(*row) != "stale":
+                changed.append(row)
+        return changed
+
+    def _indices(self, n: int = None):
+        n = self.size if n is None else min(n, self.size)
+        return (self._next - n + np.arange(n)) % self.capacity
+
+    def latest(self, n: int = None):
+        """返回最近 n 根K线 (ts, ohlcv)，从旧到新"""
+        idx = self._indices(n)
+        return self.ts[idx], self.ohlcv[idx]
+
+    def closes(self, n: int = None):
+        return self.ohlcv[self._indices(n), 3]
+
+    def volumes(self, n: int = None):
+        return self.ohlcv[self._indices(n), 4]
+
+    def row(self, i: int = -1):
+        """按负下标取一根K线，-1 为最新"""
+        if not -self.size <= i < 0:
+            raise IndexError("K线下标越界")
+        idx = (self._next + i) % self.capacity
+        return (int(self.ts[idx]),) + tuple(float(x) for x in self.ohlcv[idx])
+
+
+def backfill_candles(market, store: CandleStore, symbol: str, bar: str) -> bool:
+    """从 history-candles 分页回补，填满缓存"""
+    pages = []
+    after = ""
+    remaining = store.capacity
+    while remaining > 0:
+        limit = min(remaining, OKX_HISTORY_PAGE_LIMIT)
+        result = market.get_history_candlesticks(instId=symbol, bar=bar, after=after, limit=str(limit))
+        if result.get("code") != "0":
+            logging.warning("K线回补失败: %s", result.get('msg'))
+            return False
+        data = result.get("data") or []
+        if not data:
+            break
+        pages.append(data)
+        remaining -= len(data)
+        after = data[-1][0]
+        if len(data) < limit:
+            break
+    if not pages:
+        return False
+    store.clear()
+    for data in reversed(pages):
+        store.upsert_okx(data)
+    logging.info("K线回补完成: %s %s, 共 %s 根", symbol, bar, len(store))
+    return True
+
+
+def sync_candles(market, store: CandleStore, symbol: str, bar: str, interval_secs: int):
+    """同步K线缓存：首次或断档时回补，之后只拉取最新的几根K线
+
+    返回 (是否重新回补, 变化的行)，请求失败时返回 None。
+    """
+    if store.size == 0:
+        return (True, []) if backfill_candles(market, store, symbol, bar) else None
+    # 最新一根可能已收盘，需同时拉取它和新开的一根
+    result = market.get_history_candlesticks(instId=symbol, bar=bar, limit="2")
+    if result.get("code") != "0" or not result.get("data"):
+        logging.warning("K线增量同步失败: %s", result.get('msg'))
+        return None
+    data = result["data"]
+    if int(data[-1][0]) > store.last_ts:
+        # 断档：从缓存最后一根到最新一根全部重新拉取
+        needed = (int(data[0][0]) - store.last_ts) // (interval_secs * 1000) + 1
+        if needed > OKX_HISTORY_PAGE_LIMIT or needed > store.capacity:
+            logging.info("K线缓存断档 %s 根，重新回补", needed)
+            return (True, []) if backfill_candles(market, store, symbol, bar) else None
+        result = market.get_history_candlesticks(instId=symbol, bar=bar, limit=str(needed))
+        if result.get("code") != "0" or not result.get("data"):
+            logging.warning("K线补缺失败: %s", result.get('msg'))
+            return None
+        data = result["data"]
+    return False, store.upsert_okx(data)
+
+
+def aggregate_candles(base: CandleStore, target: CandleStore, target_secs: int, changed_rows) -> list:
+    """用小周期K线的变化更新大周期缓存（如 1m -> 5m），无需再请求大周期K线
+
+    只重算 changed_rows 涉及的大周期K线，且要求该K线的全部小周期数据都在 base 缓存内；
+    返回大周期实际变化的行（从旧到新）。
+    """
+    if not changed_rows or len(target) == 0:
+        return []
+    bucket_ms = target_secs * 1000
+    buckets = sorted({row[0] // bucket_ms * bucket_ms for row in changed_rows})
+    ts, ohlcv = base.latest()
+    changed = []
+    for start in buckets:
+        if start < base.first_ts or start < target.last_ts:
+            continue
+        lo, hi = np.searchsorted(ts, [start, start + bucket_ms])
+        if lo == hi:
+            continue
+        block = ohlcv[lo:hi]
+        row = (int(start), float(block[0, 0]), float(block[:, 1].max()), float(block[:, 2].min()), float(block[-1, 3]), float(block[:, 4].sum()))
+        if target.upsert(*row) != "stale":
+            changed.append(row)
+    return changed
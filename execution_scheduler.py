@@ -0,0 +1,229 @@
+import logging
+import math
+import time
+import uuid
+
+from order_batch import submit_batch
+
+ALGOS = ("twap", "pov", "iceberg")
+FINAL_STATES = ("filled", "canceled", "mmp_canceled")
+FINISH_POLLS = 10  # 到期撤单、市价补齐后最多查询几轮订单状态
+
+
+class ChildOrder:
+    """一笔子单的跟踪状态：limit 以 price 挂只挂单，market 直接市价成交"""
+
+    def __init__(self, cl_ord_id: str, size: float, price: str = None):
+        self.cl_ord_id = cl_ord_id
+        self.ord_id = None
+        self.size = size
+        self.price = price
+        self.state = "live"
+        self.filled = 0.0
+        self.avg_px = 0.0
+
+    @property
+    def ord_type(self) -> str:
+        return "market" if self.price is None else "post_only"
+
+    @property
+    def done(self) -> bool:
+        return self.state in FINAL_STATES
+
+    @property
+    def working(self) -> float:
+        """尚未确认结束的数量（撤单中的子单在确认前仍然计入，避免重复下单）"""
+        return 0.0 if self.done else max(self.size - self.filled, 0.0)
+
+
+class ParentOrder:
+    """母单：拆出的子单、累计成交和执行质量"""
+
+    def __init__(self, symbol: str, side: str, size: float, algo: str, arrival_price: float, started: float):
+        self.symbol = symbol
+        self.side = side
+        self.size = size
+        self.algo = algo
+        self.arrival_price = arrival_price
+        self.started = started
+        self.finished = started
+        self.children = []
+        self.replaced = 0  # 改价次数（含撤单重下）
+        self.rejected = 0  # 被拒绝的子单数
+
+    @property
+    def filled(self) -> float:
+        return sum(c.filled for c in self.children)
+
+    @property
+    def avg_price(self) -> float:
+        filled = self.filled
+        return sum(c.filled * c.avg_px for c in self.children) / filled if filled > 0 else 0.0
+
+    @property
+    def working(self) -> float:
+        return sum(c.working for c in self.children)
+
+    def report(self) -> dict:
+        """执行质量：成交均价相对到达价的滑点（bps，正数表示成本，买入高于/卖出低于到达价）"""
+        avg = self.avg_price
+        slippage = 0.0
+        if avg and self.arrival_price:
+            slippage = (avg - self.arrival_price) / self.arrival_price * 10000 * (1 if self.side == "buy" else -1)
+        return {
+            "algo": self.algo,
+            "symbol": self.symbol,
+            "side": self.side,
+            "size": self.size,
+            "filled": self.filled,
+            "avg_price": avg,
+            "arrival_price": self.arrival_price,
+            "slippage_bps": slippage,
+            "children": len(self.children),
+            "replaced": self.replaced,
+            "rejected": self.rejected,
+            "duration": self.finished - self.started,
+        }
+
+
+class ExecutionScheduler:
+    """把大单拆成子单执行：TWAP 按时间分片释放，POV 按市场成交量的固定比例释放，冰山单只露出固定数量
+
+    已释放但未成交的数量以子单挂在己方最优价（quote 返回 None 时直接市价成交），每轮轮询更新所有子单的成交，
+    盘口移动后批量改价，改价失败则批量撤单，剩余数量下一轮重新释放。到期后撤掉所有子单，未成交部分以市价补齐。
+    同一母单的多个子单可以同时挂在盘口上；调用会阻塞到母单结束，应放在线程池中执行。
+    """
+
+    def __init__(self, trade, symbol: str, pos_params: dict = None, quote=None, market_volume=None,
+                 format_price=str, lot_size: float = 0.001, poll_interval: float = 1.0,
+                 clock=time.time, sleep=time.sleep):
+        """quote(side) 返回己方最优价或 None；market_volume(since) 返回 since（秒）以来的市场成交量或 None"""
+        self.trade = trade
+        self.symbol = symbol
+        self.pos_params = pos_params or {}
+        self.quote = quote or (lambda side: None)
+        self.market_volume = market_volume
+        self.format_price = format_price
+        self.lot_size = lot_size
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self.sleep = sleep
+        self._prefix = uuid.uuid4().hex[:12]
+
+    def run(self, side: str, size: float, algo: str, duration: float, arrival_price: float,
+            slices: int = 6, rate: float = 0.1, display_size: float = None) -> ParentOrder:
+        """执行一笔母单直到全部成交或到期，返回 ParentOrder（含全部子单和执行报告）"""
+        if algo not in ALGOS:
+            raise ValueError(f"未知的拆单算法: {algo}")
+        start = self.clock()
+        parent = ParentOrder(self.symbol, side, size, algo, arrival_price, start)
+        deadline = start + duration
+        volume_start = self.market_volume(start) if algo == "pov" and self.market_volume else None
+        logging.info("开始拆单执行: %s %s %s, 算法: %s, 时长: %ss", self.symbol, side.upper(), size, algo, duration)
+        while True:
+            self._refresh(parent)
+            now = self.clock()
+            if parent.filled >= size - self.lot_size / 2 or now >= deadline:
+                break
+            self._reprice(parent)
+            if algo == "twap":
+                released = size * min(math.floor((now - start) / duration * slices) + 1, slices) / slices
+            elif algo == "pov":
+                traded = self.market_volume(start) if volume_start is not None else None
+                # 拿不到成交量时按时间均匀释放
+                released = rate * (traded - volume_start) if traded is not None else size * (now - start) / duration
+            else:
+                released = parent.filled + (display_size or size)
+            child_size = self._round_lot(min(released, size) - parent.filled - parent.working)
+            if child_size >= self.lot_size:
+                self._send(parent, side, child_size, self.quote(side))
+            self.sleep(self.poll_interval)
+        self._finish(parent)
+        parent.finished = self.clock()
+        return parent
+
+    def _round_lot(self, size: float) -> float:
+        lots = math.floor(size / self.lot_size + 1e-9)
+        return round(lots * self.lot_size, 10)
+
+    def _send(self, parent: ParentOrder, side: str, size: float, price: float = None):
+        child = ChildOrder(f"{self._prefix}c{len(parent.children) + parent.rejected}", size,
+                           self.format_price(price) if price is not None else None)
+        params = {"px": child.price} if child.price is not None else {}
+        result = self.trade.place_order(instId=self.symbol, tdMode="cross", side=side, ordType=child.ord_type,
+                                        sz=f"{size:.10g}", clOrdId=child.cl_ord_id, **params, **self.pos_params)
+        data = (result.get("data") or [{}])[0]
+        if result.get("code") != "0" or data.get("sCode") != "0":
+            parent.rejected += 1
+            logging.warning("子单被拒绝: %s %s %s @ %s, %s", self.symbol, side.upper(), size, child.price or "市价",
+                            data.get("sMsg") or result.get("msg"))
+            return None
+        child.ord_id = data.get("ordId")
+        parent.children.append(child)
+        logging.debug("子单已提交: %s %s %s @ %s, ordId=%s", self.symbol, side.upper(), size, child.price or "市价", child.ord_id)
+        return child
+
+    def _refresh(self, parent: ParentOrder):
+        """查询所有未结束子单的成交状态"""
+        for child in parent.children:
+            if child.done:
+                continue
+            result = self.trade.get_order(instId=self.symbol, ordId=child.ord_id)
+            if result.get("code") != "0" or not result.get("data"):
+                continue
+            data = result["data"][0]
+            state = data.get("state") or child.state
+            if state in FINAL_STATES or child.state != "canceling":
+                child.state = state
+            child.filled = float(data.get("accFillSz") or 0)
+            child.avg_px = float(data.get("avgPx") or 0)
+
+    def _reprice(self, parent: ParentOrder):
+        """把偏离己方最优价的挂单一次批量改到最新价，改价失败的子单批量撤单"""
+        live = [c for c in parent.children if not c.done and c.price is not None and c.state != "canceling"]
+        if not live:
+            return
+        price = self.quote(parent.side)
+        if price is None:
+            return
+        new_px = self.format_price(price)
+        stale = [c for c in live if c.price != new_px]
+        if not stale:
+            return
+        results = submit_batch(self.trade.amend_multiple_orders,
+                               [{"instId": self.symbol, "ordId": c.ord_id, "newPx": new_px} for c in stale], "改单")
+        parent.replaced += len(stale)
+        failed = []
+        for child, item in zip(stale, results):
+            if item.get("sCode") == "0":
+                child.price = new_px
+            else:
+                failed.append(child)
+        self._cancel(failed)
+
+    def _cancel(self, children: list):
+        """批量撤单，只把撤单成功的子单标记为撤单中；失败的子单（可能已成交或请求被拒）保持原状态，由下一轮查询或重试处理"""
+        if not children:
+            return
+        results = submit_batch(self.trade.cancel_multiple_orders, [{"instId": self.symbol, "ordId": c.ord_id} for c in children], "撤单")
+        for child, item in zip(children, results):
+            if item.get("sCode") == "0":
+                child.state = "canceling"
+
+    def _finish(self, parent: ParentOrder):
+        """撤掉所有挂单，确认全部子单结束后以市价补齐剩余数量；撤单失败的挂单每轮查询后重试"""
+        sent_market = False
+        for _ in range(FINISH_POLLS):
+            self._cancel([c for c in parent.children if not c.done and c.state != "canceling" and c.price is not None])
+            self._refresh(parent)
+            if parent.working > 0:
+                self.sleep(self.poll_interval)
+                continue
+            remaining = self._round_lot(parent.size - parent.filled)
+            if sent_market or remaining < self.lot_size:
+                return
+            logging.info("拆单到期，剩余数量市价补齐: %s %s %s", self.symbol, parent.side.upper(), remaining)
+            sent_market = self._send(parent, parent.side, remaining) is not None
+            if not sent_market:
+                return
+        logging.warning("拆单结束时仍有子单未确认: %s, 未确认数量 %s", self.symbol, parent.working)
@@ -0,0 +1,332 @@
+import asyncio
+import functools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from websockets.asyncio.server import serve
+
+from order_book import okx_checksum
+
+
+class FakeOkxWebSocketServer:
+    """本地假 OKX WebSocket 服务，用于离线测试行情订阅
+
+    接受 subscribe/ping，按订阅推送 push_ticker / push_candle 的数据，
+    drop_connections 可模拟断线以测试重连与重新订阅。
+    私有频道：login 总是成功，订阅 positions 时先推送 positions 全量快照，之后由 push_positions / push_orders 推送。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.subscriptions = []  # 收到的全部订阅参数，重连后会重复出现
+        self.logins = 0
+        self.positions = []  # 订阅 positions 时推送的快照
+        self._clients = {}  # 连接 -> 已订阅的 (channel, instId)
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="fake-okx-ws", daemon=True)
+        self._thread.start()
+        self._ready.wait(5)
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def push_ticker(self, inst_id: str, last: float, ts: int = 0):
+        data = [{"instId": inst_id, "last": str(last), "ts": str(ts)}]
+        self._publish("tickers", inst_id, data)
+
+    def push_candle(self, inst_id: str, bar: str, candle: list):
+        """candle 为 OKX 格式 [ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm]"""
+        self._publish(f"candle{bar}", inst_id, [[str(x) for x in candle]])
+
+    def push_book(self, inst_id: str, bids: list, asks: list, action: str = "snapshot", channel: str = "books",
+                  seq_id: int = None, prev_seq_id: int = None, checksum: int = None, book_state: dict = None):
+        """推送订单簿，bids / asks 为 [[价格, 数量], ...] 字符串列表（数量 "0" 表示删除该档）
+
+        未指定 checksum 时按 book_state（推送后的完整订单簿 {"bids": [...], "asks": [...]}，默认即本次推送）计算。
+        """
+        book_state = book_state or {"bids": bids, "asks": asks}
+        if checksum is None:
+            checksum = okx_checksum(book_state["bids"], book_state["asks"])
+        book = {"bids": [[px, sz, "0", "1"] for px, sz in bids], "asks": [[px, sz, "0", "1"] for px, sz in asks],
+                "ts": str(int(time.time() * 1000)), "checksum": checksum}
+        if seq_id is not None:
+            book.update(seqId=seq_id, prevSeqId=-1 if prev_seq_id is None else prev_seq_id)
+        message = {"arg": {"channel": channel, "instId": inst_id}, "action": action, "data": [book]}
+        for ws, subs in list(self._clients.items()):
+            if (channel, inst_id) in subs:
+                asyncio.run_coroutine_threadsafe(ws.send(json.dumps(message)), self._loop)
+
+    def push_positions(self, data: list):
+        self._publish("positions", None, data)
+
+    def push_orders(self, data: list):
+        self._publish("orders", None, data)
+
+    def push_algo_orders(self, data: list):
+        self._publish("orders-algo", None, data)
+
+    def drop_connections(self):
+        for ws in list(self._clients):
+            asyncio.run_coroutine_threadsafe(ws.close(), self._loop)
+
+    def subscriber_count(self, channel: str) -> int:
+        return sum(1 for subs in self._clients.values() if any(c == channel for c, _ in subs))
+
+    def _publish(self, channel: str, inst_id: str, data: list):
+        arg = {"channel": channel, "instId": inst_id} if inst_id else {"channel": channel, "instType": "ANY"}
+        message = json.dumps({"arg": arg, "data": data})
+        for ws, subs in list(self._clients.items()):
+            if (channel, inst_id) in subs:
+                asyncio.run_coroutine_threadsafe(ws.send(message), self._loop)
+
+    async def _handler(self, ws):
+        self._clients[ws] = set()
+        try:
+            async for raw in ws:
+                if raw == "ping":
+                    await ws.send("pong")
+                    continue
+                request = json.loads(raw)
+                if request.get("op") == "login":
+                    self.logins += 1
+                    await ws.send(json.dumps({"event": "login", "code": "0", "msg": ""}))
+                elif request.get("op") == "subscribe":
+                    for arg in request.get("args", []):
+                        self.subscriptions.append(arg)
+                        self._clients[ws].add((arg["channel"], arg.get("instId")))
+                        await ws.send(json.dumps({"event": "subscribe", "arg": arg}))
+                        if arg["channel"] == "positions":
+                            await ws.send(json.dumps({"arg": arg, "data": self.positions}))
+                elif request.get("op") == "unsubscribe":
+                    for arg in request.get("args", []):
+                        self._clients[ws].discard((arg["channel"], arg.get("instId")))
+                        await ws.send(json.dumps({"event": "unsubscribe", "arg": arg}))
+        except Exception:
+            pass
+        finally:
+            self._clients.pop(ws, None)
+
+    async def _main(self):
+        async with serve(self._handler, self.host, self.port) as server:
+            self._server = server
+            self.port = server.sockets[0].getsockname()[1]
+            self._ready.set()
+            await server.wait_closed()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+
+class _RestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive
+    disable_nagle_algorithm = True
+    wbufsize = -1  # 响应头和响应体合并写出，避免本地回环上的延迟确认
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+        if self.server.connect_delay:
+            # 模拟新连接的 TCP/TLS 握手耗时
+            time.sleep(self.server.connect_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method: str):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"null") if length else None
+        self.server.requests += 1
+        handler = self.server.routes.get((method, url.path))
+        if handler is None and url.path.endswith("/sendMessage"):
+            handler = self.server.routes.get((method, "/sendMessage"))
+        if handler is None:
+            self._reply({"code": "50000", "msg": f"unknown path {url.path}", "data": []})
+            return
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self._reply(handler(params, body))
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+class FakeOkxRestServer:
+    """本地假 OKX REST 服务（同时接受 Telegram sendMessage），用于离线测试和基准测试
+
+    connect_delay 模拟每个新连接的握手耗时，可用来衡量连接复用带来的收益。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, connect_delay: float = 0.0):
+        self._httpd = ThreadingHTTPServer((host, port), _RestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.connect_delay = connect_delay
+        self._httpd.connections = 0
+        self._httpd.requests = 0
+        self._httpd.routes = {
+            ("GET", "/api/v5/market/ticker"): self._ticker,
+            ("GET", "/api/v5/market/tickers"): self._tickers,
+            ("GET", "/api/v5/market/history-candles"): self._candles,
+            ("GET", "/api/v5/market/candles"): self._candles,
+            ("GET", "/api/v5/account/positions"): self._positions,
+            ("GET", "/api/v5/account/config"): self._account_config,
+            ("GET", "/api/v5/public/instruments"): self._instruments,
+            ("POST", "/api/v5/trade/order"): self._place_order,
+            ("POST", "/api/v5/trade/close-position"): self._close_position,
+            ("GET", "/api/v5/trade/order"): self._get_order,
+            ("POST", "/api/v5/trade/cancel-order"): self._cancel_order,
+            ("POST", "/api/v5/trade/amend-order"): self._amend_order,
+            ("POST", "/api/v5/trade/order-algo"): self._place_algo_order,
+            ("POST", "/api/v5/trade/cancel-algos"): self._cancel_algo_orders,
+            ("GET", "/api/v5/trade/order-algo"): self._get_algo_order,
+            ("POST", "/api/v5/trade/batch-orders"): functools.partial(self._batch, self._place_order),
+            ("POST", "/api/v5/trade/cancel-batch-orders"): functools.partial(self._batch, self._cancel_order),
+            ("POST", "/api/v5/trade/amend-batch-orders"): functools.partial(self._batch, self._amend_order),
+            ("POST", "/sendMessage"): lambda params, body: {"ok": True, "result": {}},
+        }
+        self.last_price = 50000.0
+        self.positions = []  # /account/positions 返回的持仓
+        self.orders = []  # 收到的下单请求体
+        self.order_fills = {}  # ordId -> 成交数量（字符串），/trade/order 查询时返回；未设置的订单视为全部成交
+        self.canceled = []  # 收到的撤单请求体
+        self.amended = []  # 收到的改单请求体
+        self.algo_orders = []  # 收到的策略单请求体
+        self.algo_states = {}  # algoClOrdId -> /trade/order-algo 查询返回的状态
+        self.canceled_algos = []  # 收到的撤销策略单请求项
+        self.batches = []  # 批量接口每次请求的笔数
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def connections(self) -> int:
+        return self._httpd.connections
+
+    @property
+    def requests(self) -> int:
+        return self._httpd.requests
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-okx-rest", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _ticker(self, params, body):
+        return {"code": "0", "msg": "", "data": [{"instId": params.get("instId"), "last": str(self.last_price),
+                                                  "bidPx": str(self.last_price - 0.1), "askPx": str(self.last_price + 0.1)}]}
+
+    def _tickers(self, params, body):
+        inst_type = params.get("instType", "SWAP")
+        suffix = "-SWAP" if inst_type == "SWAP" else ""
+        data = [{"instId": f"{coin}-USDT{suffix}", "instType": inst_type, "last": str(self.last_price)}
+                for coin in ("BTC", "ETH", "SOL")]
+        return {"code": "0", "msg": "", "data": data}
+
+    def _candles(self, params, body):
+        limit = int(params.get("limit") or 100)
+        bar = params.get("bar") or "1m"
+        step = int(bar[:-1]) * {"m": 60, "H": 3600, "D": 86400}[bar[-1]]
+        now = int(time.time()) // step * step * 1000
+        if params.get("after"):
+            now = min(now, int(params["after"]) - step * 1000)
+        price = str(self.last_price)
+        data = [[str(now - i * step * 1000), price, price, price, price, "1", "0", "0", "1"] for i in range(limit)]
+        return {"code": "0", "msg": "", "data": data}
+
+    def _positions(self, params, body):
+        inst_id = params.get("instId")
+        return {"code": "0", "msg": "", "data": [p for p in self.positions if inst_id is None or p["instId"] == inst_id]}
+
+    def _account_config(self, params, body):
+        return {"code": "0", "msg": "", "data": [{"posMode": "long_short_mode"}]}
+
+    def _instruments(self, params, body):
+        return {"code": "0", "msg": "", "data": [{"instId": params.get("instId"), "instType": params.get("instType"), "tickSz": "0.1"}]}
+
+    def _place_order(self, params, body):
+        self.orders.append(body)
+        return {"code": "0", "msg": "", "data": [{"ordId": str(len(self.orders)), "sCode": "0", "sMsg": ""}]}
+
+    def _get_order(self, params, body):
+        ord_id = params.get("ordId")
+        body = self.orders[int(ord_id) - 1] if ord_id and ord_id.isdigit() and int(ord_id) <= len(self.orders) else {}
+        filled = self.order_fills.get(ord_id, body.get("sz", "0"))
+        canceled = any(c.get("ordId") == ord_id for c in self.canceled)
+        state = "filled" if filled == body.get("sz") else "canceled" if canceled else "partially_filled" if float(filled) else "live"
+        avg_px = body.get("px") or str(self.last_price)
+        return {"code": "0", "msg": "", "data": [{"ordId": ord_id, "instId": params.get("instId"), "state": state,
+                                                  "accFillSz": filled, "avgPx": avg_px if float(filled) else "", "sz": body.get("sz")}]}
+
+    def _cancel_order(self, params, body):
+        self.canceled.append(body)
+        return {"code": "0", "msg": "", "data": [{"ordId": body.get("ordId"), "sCode": "0", "sMsg": ""}]}
+
+    def _amend_order(self, params, body):
+        self.amended.append(body)
+        return {"code": "0", "msg": "", "data": [{"ordId": body.get("ordId"), "sCode": "0", "sMsg": ""}]}
+
+    def _place_algo_order(self, params, body):
+        self.algo_orders.append(body)
+        return {"code": "0", "msg": "", "data": [{"algoId": str(len(self.algo_orders)), "algoClOrdId": body.get("algoClOrdId"),
+                                                  "sCode": "0", "sMsg": ""}]}
+
+    def _get_algo_order(self, params, body):
+        """按 algoClOrdId 查询收到的策略单，状态取 algo_states（默认 "live"）"""
+        cl_id = params.get("algoClOrdId")
+        for i, algo in enumerate(self.algo_orders):
+            if algo.get("algoClOrdId") == cl_id:
+                return {"code": "0", "msg": "", "data": [{**algo, "algoId": str(i + 1), "state": self.algo_states.get(cl_id, "live")}]}
+        return {"code": "51603", "msg": "Order does not exist", "data": []}
+
+    def _cancel_algo_orders(self, params, body):
+        self.canceled_algos.extend(body)
+        return {"code": "0", "msg": "", "data": [{"algoId": b.get("algoId", ""), "algoClOrdId": b.get("algoClOrdId", ""),
+                                                  "sCode": "0", "sMsg": ""} for b in body]}
+
+    def _batch(self, handler, params, body):
+        """批量接口：逐笔交给单笔处理函数，code 为 "0" 全部成功、"2" 部分成功、"1" 全部失败"""
+        self.batches.append(len(body))
+        data = [handler(params, leg)["data"][0] for leg in body]
+        ok = sum(item.get("sCode") == "0" for item in data)
+        return {"code": "0" if ok == len(data) else "2" if ok else "1", "msg": "", "data": data}
+
+    def _close_position(self, params, body):
+        return {"code": "0", "msg": "", "data": [{"instId": body.get("instId"), "posSide": body.get("posSide")}]}
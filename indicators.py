@@ -0,0 +1,273 @@
+import math
+from collections import deque
+
+import numpy as np
+
+
+class _RollingMean:
+    """固定窗口滚动均值，O(1) 追加/修正最后一个值"""
+
+    def __init__(self, period: int):
+        self.period = period
+        self.values = deque(maxlen=period)
+        self.total = 0.0
+        self._updates = 0
+
+    def append(self, value: float):
+        if len(self.values) == self.period:
+            self.total -= self.values[0]
+        self.values.append(value)
+        self.total += value
+        self._updates += 1
+        # 定期重算，防止浮点累计误差
+        if self._updates >= self.period:
+            self.total = math.fsum(self.values)
+            self._updates = 0
+
+    def replace_last(self, value: float):
+        if not self.values:
+            self.append(value)
+            return
+        self.total += value - self.values[-1]
+        self.values[-1] = value
+
+    @property
+    def value(self) -> float:
+        if len(self.values) < self.period:
+            return float("nan")
+        return self.total / self.period
+
+
+class _WindowEMA:
+    """与 pandas ewm(span, adjust=False) 在最近 window 根数据上的结果一致的 EMA
+
+    window 为 None 时为普通流式 EMA。窗口 EMA 拆成首元素项和其余加权和两部分：
+    ema = (1-a)^(n-1) * x0 + sum(a * (1-a)^(n-1-j) * xj)，滑动时两部分都可 O(1) 更新。
+    """
+
+    def __init__(self, span: int, window: int = None):
+        self.alpha = 2.0 / (span + 1)
+        self.decay = 1.0 - self.alpha
+        self.window = window
+        self.values = deque(maxlen=window) if window else None
+        self.tail = 0.0  # 除首元素外的加权和
+        self.head_weight = 1.0  # (1-a)^(n-1)
+        self.ema = float("nan")
+        self.prev_ema = float("nan")
+        self.count = 0
+        self._updates = 0
+
+    def append(self, value: float):
+        self.count += 1
+        if self.window is None:
+            self.prev_ema = self.ema
+            self.ema = value if self.count == 1 else self.alpha * value + self.decay * self.ema
+            return
+        if not self.values:
+            self.values.append(value)
+            self.tail = 0.0
+            self.head_weight = 1.0
+        elif len(self.values) < self.window:
+            self.values.append(value)
+            self.tail = self.decay * self.tail + self.alpha * value
+            self.head_weight *= self.decay
+        else:
+            new_head = self.values[1] if self.window > 1 else value
+            self.tail = self.decay * self.tail + self.alpha * value - self.alpha * self.head_weight * new_head
+            self.values.append(value)
+            self._updates += 1
+            if self._updates >= self.window:
+                self._resync()
+        self.ema = self.head_weight * self.values[0] + self.tail
+
+    def replace_last(self, value: float):
+        if self.count == 0:
+            self.append(value)
+            return
+        if self.window is None:
+            self.ema = value if self.count == 1 else self.alpha * value + self.decay * self.prev_ema
+            return
+        if len(self.values) == 1:
+            self.values[0] = value
+        else:
+            self.tail += self.alpha * (value - self.values[-1])
+            self.values[-1] = value
+        self.ema = self.head_weight * self.values[0] + self.tail
+
+    def _resync(self):
+        n = len(self.values)
+        tail = 0.0
+        for j in range(1, n):
+            tail = self.decay * tail + self.alpha * self.values[j]
+        self.tail = tail
+        self.head_weight = self.decay ** (n - 1)
+        self._updates = 0
+
+
+class IndicatorEngine:
+    """增量指标引擎：用历史K线初始化一次，之后每根K线 O(1) 更新
+
+    数值与 app.py 中基于 pandas 的 calculate_rsi / calculate_ma_ema / calculate_avg_volume
+    在最近 window 根K线上的计算结果一致。
+    """
+
+    def __init__(self, rsi_period=14, ma_periods=(20, 60, 120), volume_period=10, window=None):
+        self.rsi_period = rsi_period
+        self.ma_periods = list(ma_periods)
+        self.volume_period = volume_period
+        self.window = window
+        self.last_ts = None
+        self.count = 0
+        self._closes = deque(maxlen=2)
+        self._mas = {p: _RollingMean(p) for p in self.ma_periods}
+        self._emas = {p: _WindowEMA(p, window) for p in self.ma_periods}
+        self._gains = _RollingMean(rsi_period)
+        self._losses = _RollingMean(rsi_period)
+        self._volumes = _RollingMean(volume_period)
+
+    def seed(self, candles):
+        """用 OKX 格式K线（最新在前）初始化"""
+        for candle in reversed(candles):
+            self.on_candle(int(candle[0]), float(candle[4]), float(candle[5]))
+
+    def seed_arrays(self, ts, closes, volumes):
+        """用从旧到新排列的数组初始化（如 CandleStore.latest 的结果）"""
+        for t, close, volume in zip(ts, closes, volumes):
+            self.on_candle(int(t), float(close), float(volume))
+
+    def on_candle(self, ts: int, close: float, volume: float) -> bool:
+        """推送一根K线：同一时间戳视为修正最后一根，更晚的时间戳视为新K线"""
+        if self.last_ts is not None and ts < self.last_ts:
+            return False
+        if ts == self.last_ts:
+            self.replace_last(close, volume)
+        else:
+            self.update(close, volume)
+            self.last_ts = ts
+        return True
+
+    def update(self, close: float, volume: float):
+        if self._closes:
+            delta = close - self._closes[-1]
+            self._gains.append(max(delta, 0.0))
+            self._losses.append(max(-delta, 0.0))
+        self._closes.append(close)
+        for p in self.ma_periods:
+            self._mas[p].append(close)
+            self._emas[p].append(close)
+        self._volumes.append(volume)
+        self.count += 1
+
+    def replace_last(self, close: float, volume: float):
+        if not self._closes:
+            self.update(close, volume)
+            return
+        if len(self._closes) == 2:
+            delta = close - self._closes[0]
+            self._gains.replace_last(max(delta, 0.0))
+            self._losses.replace_last(max(-delta, 0.0))
+        self._closes[-1] = close
+        for p in self.ma_periods:
+            self._mas[p].replace_last(close)
+            self._emas[p].replace_last(close)
+        self._volumes.replace_last(volume)
+
+    @property
+    def rsi(self):
+        up = self._gains.value
+        down = self._losses.value
+        if math.isnan(up) or math.isnan(down):
+            return None
+        if down == 0:
+            return None if up == 0 else 100
+        return 100 - 100 / (1 + up / down)
+
+    @property
+    def ma(self) -> dict:
+        return {f"MA{p}": self._mas[p].value for p in self.ma_periods}
+
+    @property
+    def ema(self) -> dict:
+        return {f"EMA{p}": self._emas[p].ema for p in self.ma_periods}
+
+    @property
+    def avg_volume(self) -> float:
+        return self._volumes.value
+
+    @property
+    def ma_concentration(self) -> float:
+        lines = [v for v in list(self.ma.values()) + list(self.ema.values()) if not math.isnan(v)]
+        if len(lines) < 2:
+            return float("inf")
+        return max(lines) - min(lines)
+
+
+# ============ 向量化版本（整段序列一次计算，供回测和参数优化使用） ============
+
+def rolling_mean(values: np.ndarray, period: int) -> np.ndarray:
+    """与 pandas rolling(period).mean() 一致，前 period-1 个为 NaN"""
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    if len(values) < period:
+        return out
+    csum = np.cumsum(values)
+    out[period - 1] = csum[period - 1]
+    out[period:] = csum[period:] - csum[:-period]
+    return out / period
+
+
+def _decay_filter(values: np.ndarray, decay: float) -> np.ndarray:
+    """计算 s[t] = x[t] + decay * s[t-1]，按块用累加和求解，避免逐元素 Python 循环"""
+    n = len(values)
+    # 块内放大倍数控制在 e^10 以内，保证精度
+    chunk = max(16, int(10 / -math.log(decay))) if 0 < decay < 1 else 16
+    out = np.empty(n)
+    powers = decay ** np.arange(chunk)
+    inv_powers = 1.0 / powers
+    carry = 0.0
+    for start in range(0, n, chunk):
+        block = values[start:start + chunk]
+        m = len(block)
+        acc = np.cumsum(block * inv_powers[:m]) * powers[:m]
+        out[start:start + m] = acc + carry * decay * powers[:m]
+        carry = out[start + m - 1]
+    return out
+
+
+def ema(values: np.ndarray, span: int, window: int = None) -> np.ndarray:
+    """与 pandas ewm(span, adjust=False).mean() 一致的 EMA
+
+    window 不为 None 时，每个点只用最近 window 个数据计算（与实盘每次取 CANDLE_LIMIT 根K线的结果一致），
+    前 window-1 个点按已有数据计算。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n == 0:
+        return values.copy()
+    alpha = 2.0 / (span + 1)
+    decay = 1.0 - alpha
+    # s[t] = sum(decay^(t-k) * x[k])，k 从 1 开始；首个值单独作为初值
+    tail = _decay_filter(np.concatenate(([0.0], values[1:])), decay)
+    full = decay ** np.arange(n) * values[0] + alpha * tail
+    if window is None or window >= n:
+        return full
+    out = full.copy()
+    t = np.arange(window, n)
+    head = t - window + 1
+    head_weight = decay ** (window - 1)
+    out[window:] = head_weight * values[head] + alpha * (tail[t] - head_weight * tail[head])
+    return out
+
+
+def rsi(closes: np.ndarray, period: int = 14) -> np.ndarray:
+    """与 calculate_rsi 一致：涨跌幅简单滚动均值；无波动时为 NaN，只涨不跌时为 100"""
+    closes = np.asarray(closes, dtype=np.float64)
+    delta = np.diff(closes, prepend=np.nan)
+    gains = rolling_mean(np.clip(np.nan_to_num(delta), 0, None), period)
+    losses = rolling_mean(np.clip(-np.nan_to_num(delta), 0, None), period)
+    gains[:period] = np.nan
+    losses[:period] = np.nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = 100 - 100 / (1 + gains / losses)
+    out[(losses == 0) & (gains > 0)] = 100
+    return out
@@ -0,0 +1,113 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(funcName)s - %(message)s"
+LOG_MAX_BYTES = 10 * 1024 * 1024  # 单个日志文件上限
+LOG_BACKUP_COUNT = 3
+RATE_LIMIT_PER_MINUTE = 60  # 同一行代码每分钟最多输出的日志条数
+DEDUP_WINDOW = 60  # 相同的警告/错误在此秒数内只输出一次
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """只把 LogRecord 放入队列，消息拼接和格式化都在 QueueListener 线程中完成
+
+    标准 QueueHandler.prepare 会在调用线程中格式化，这里保留 msg/args 原样入队。
+    日志参数因此会在稍后才被格式化，不要传入之后会被修改的可变对象。
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """按调用位置限流，并合并重复的警告/错误
+
+    每个 (文件, 行号) 是一个令牌桶：容量和每分钟补充量都是 per_minute，超出的记录被丢弃。
+    WARNING 及以上级别的同一条消息在 dedup_window 秒内只放行一次；窗口过后再次出现时，
+    在消息末尾附上期间被抑制的次数。
+    """
+
+    def __init__(self, per_minute: int = RATE_LIMIT_PER_MINUTE, dedup_window: float = DEDUP_WINDOW):
+        super().__init__()
+        self.per_minute = per_minute
+        self.dedup_window = dedup_window
+        self._buckets = {}  # (文件, 行号) -> [令牌数, 上次补充时间, 被抑制条数]
+        self._recent = {}  # (文件, 行号, 消息) -> [首次放行时间, 被抑制条数]
+        self._lock = threading.Lock()
+
+    def filter(self, record) -> bool:
+        now = time.monotonic()
+        site = (record.pathname, record.lineno)
+        with self._lock:
+            suppressed = 0
+            if record.levelno >= logging.WARNING:
+                key = site + (record.getMessage(),)
+                recent = self._recent.get(key)
+                if recent is not None and now - recent[0] < self.dedup_window:
+                    recent[1] += 1
+                    return False
+                if recent is not None:
+                    suppressed = recent[1]
+                self._recent[key] = [now, 0]
+                if len(self._recent) > 10000:
+                    self._recent = {k: v for k, v in self._recent.items() if now - v[0] < self.dedup_window}
+
+            bucket = self._buckets.get(site)
+            if bucket is None:
+                bucket = self._buckets[site] = [float(self.per_minute), now, 0]
+            bucket[0] = min(self.per_minute, bucket[0] + (now - bucket[1]) * self.per_minute / 60)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed += bucket[2]
+            bucket[2] = 0
+
+        if suppressed:
+            record.msg = f"{record.getMessage()}（期间抑制 {suppressed} 条）"
+            record.args = None
+        return True
+
+
+def setup_logging(log_file: str = None, level: int = logging.INFO, max_bytes: int = LOG_MAX_BYTES,
+                  backup_count: int = LOG_BACKUP_COUNT, console: bool = True, rate_limit: bool = True):
+    """把根日志器换成 队列 -> 后台线程 -> 轮转文件/控制台，返回已启动的 QueueListener（退出时自动停止）
+
+    日志文件无法写入时只输出到控制台。
+    """
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+    if log_file:
+        try:
+            handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"))
+        except OSError as e:
+            print(f"无法写入日志文件 {log_file}: {str(e)}")
+    if console or not handlers:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    if rate_limit:
+        queue_handler.addFilter(RateLimitFilter())
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)  # 退出前写完队列中的日志
+    return listener
+
+
+def _stop_listener(listener):
+    if listener._thread is not None:  # 允许调用方提前 stop
+        listener.stop()
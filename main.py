@@ -1,10 +1,15 @@
+import atexit
 import time
-import requests
 import logging
-import pandas as pd
-from okx import MarketData, Trade
+import math
 import uuid
 from datetime import datetime, timezone, timedelta
+import numpy as np
+from indicators import IndicatorEngine, rolling_mean, ema as ema_series, rsi as rsi_series
+from okx_clients import get_market_api, get_trade_api
+from rate_limiter import backoff_delay
+from notifier import TelegramNotifier
+from log_setup import setup_logging
 
 # ============ 配置区域 ============
 
@@ -22,6 +27,7 @@ AUTO_TRADE_ENABLED = True  # True=自动下单，False=仅发送提醒
 TEST_MODE = False      # True=测试模式，不需要满足其他条件就可以下单
 SYMBOL = "BTC-USDT-SWAP"  # 永续合约
 CHECK_INTERVAL = 5  # 正常检查间隔（秒）
+USE_WEBSOCKET = False  # True=WebSocket 推送行情，False=REST 轮询
 COOLDOWN = 50  # 触发后的冷却时间（秒）
 ORDER_SIZE = 0.1  # 下单数量
 MIN_ORDER_SIZE = 0.001  # 最小下单数量
@@ -33,74 +39,63 @@ RSI_OVERBOUGHT = 80  # RSI 超买阈值
 RSI_OVERSOLD = 20    # RSI 超卖阈值
 STOP_LOSS_PERCENT = 0.02  # 止损百分比 (2%)
 TAKE_PROFIT_PERCENT = 0.04  # 止盈百分比 (4%)
+ATTACH_ALGO_ORDERS = True  # True=开仓时附带交易所止盈止损单，False=本地轮询止损
+TICK_SIZE = 0.1  # SYMBOL 的价格精度，止盈止损触发价按此取整
 MIN_AMPLITUDE_PERCENT = 2.0  # 最小振幅百分比
 MIN_SHADOW_RATIO = 1.0  # 影线长度与实体长度的最小比例
 
-# 配置日志
-logging.basicConfig(
-    filename="combined_trading_bot.log",
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+indicator_engine = None  # 增量指标引擎，首次获取K线时初始化
+market_feed = None  # WebSocket 行情订阅（USE_WEBSOCKET=True 时启动）
+notifier = TelegramNotifier(BOT_TOKEN, CHAT_ID).start()  # 后台 Telegram 推送
+atexit.register(notifier.stop)  # 退出前发送完队列中的消息
+
+# 配置日志：后台线程写文件，按大小轮转，重复错误合并
+setup_logging("combined_trading_bot.log", console=False)
 
 # ============ 功能函数 ============
 
 def send_telegram_message(message: str):
-    """发送 Telegram 消息"""
-    try:
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        payload = {"chat_id": CHAT_ID, "text": message}
-        response = requests.post(url, json=payload, timeout=5)
-        if response.status_code != 200:
-            logging.error(f"Telegram 消息发送失败: {response.text}")
-    except Exception as e:
-        logging.error(f"Telegram 消息发送错误: {e}")
+    """发送 Telegram 消息（入队后由后台线程发送，不阻塞交易）"""
+    notifier.notify(message)
+
+def candle_column(data, index: int) -> np.ndarray:
+    """OKX 格式K线（最新在前）的一列，按时间从旧到新"""
+    return np.array([float(candle[index]) for candle in reversed(data)])
+
+def is_missing(value) -> bool:
+    return value is None or math.isnan(value)
 
 def calculate_rsi(data, periods=RSI_PERIOD):
     """计算 RSI"""
     try:
-        reversed_data = data[::-1]
-        closes = pd.Series([float(candle[4]) for candle in reversed_data])
-        delta = closes.diff()
-        up = delta.clip(lower=0).rolling(window=periods).mean()
-        down = -delta.clip(upper=0).rolling(window=periods).mean()
-        rs = up / down
-        rsi = pd.Series(100 - (100 / (1 + rs)), index=closes.index)
-        latest_rsi = rsi.iloc[-1]
-        if pd.isna(latest_rsi):
-            return None
-        if down.iloc[-1] == 0:
-            latest_rsi = 100
-        return latest_rsi
+        latest_rsi = float(rsi_series(candle_column(data, 4), periods)[-1])
+        return None if math.isnan(latest_rsi) else latest_rsi
     except Exception as e:
-        logging.error(f"RSI 计算失败: {e}")
+        logging.error("RSI 计算失败: %s", e)
         return None
 
 def calculate_ma_ema(data, periods):
     """计算 MA 和 EMA"""
     try:
-        reversed_data = data[::-1]
-        closes = pd.Series([float(candle[4]) for candle in reversed_data])
-        ma = {f"MA{p}": closes.rolling(window=p).mean().iloc[-1] for p in periods}
-        ema = {f"EMA{p}": closes.ewm(span=p, adjust=False).mean().iloc[-1] for p in periods}
+        closes = candle_column(data, 4)
+        ma = {f"MA{p}": float(rolling_mean(closes, p)[-1]) for p in periods}
+        ema = {f"EMA{p}": float(ema_series(closes, p)[-1]) for p in periods}
         return ma, ema
     except Exception as e:
-        logging.error(f"MA/EMA 计算失败: {e}")
+        logging.error("MA/EMA 计算失败: %s", e)
         return {}, {}
 
 def calculate_avg_volume(data, periods=10):
     """计算近期平均成交量"""
     try:
-        reversed_data = data[::-1]
-        volumes = pd.Series([float(candle[5]) for candle in reversed_data])
-        return volumes.rolling(window=periods).mean().iloc[-1]
+        return float(rolling_mean(candle_column(data, 5), periods)[-1])
     except Exception as e:
-        logging.error(f"平均成交量计算失败: {e}")
+        logging.error("平均成交量计算失败: %s", e)
         return None
 
 def determine_position(close, ma, ema):
     """判断当前 K 线收盘价相对于均线的位置"""
-    all_lines = [line for line in list(ma.values()) + list(ema.values()) if not pd.isna(line)]
+    all_lines = [line for line in list(ma.values()) + list(ema.values()) if not is_missing(line)]
     if not all_lines:
         return "无有效均线"
     if all(close > line for line in all_lines):
@@ -110,6 +105,23 @@ def determine_position(close, ma, ema):
     else:
         return "在均线之间"
 
+def update_indicator_engine(candles):
+    """用最新K线（最新在前）增量更新指标引擎，数据断档时重新初始化"""
+    global indicator_engine
+    oldest_ts = int(candles[-1][0])
+    if indicator_engine is None or indicator_engine.last_ts is None or indicator_engine.last_ts < oldest_ts:
+        indicator_engine = IndicatorEngine(RSI_PERIOD, MA_PERIODS, window=CANDLE_LIMIT)
+        indicator_engine.seed(candles)
+        return indicator_engine
+    new_candles = []
+    for candle in candles:
+        if int(candle[0]) < indicator_engine.last_ts:
+            break
+        new_candles.append(candle)
+    for candle in reversed(new_candles):
+        indicator_engine.on_candle(int(candle[0]), float(candle[4]), float(candle[5]))
+    return indicator_engine
+
 def get_interval_seconds(interval: str) -> int:
     """根据K线周期字符串返回秒数"""
     interval_map = {
@@ -120,69 +132,67 @@ def get_interval_seconds(interval: str) -> int:
     return interval_map.get(interval, 60)  # 默认1m
 
 def get_latest_price_and_indicators(symbol: str) -> tuple:
-    """获取最新价格、交易量、上下影线、振幅百分比、RSI、MA、EMA 和均线位置，失败时持续重试"""
-    attempt = 0
-    while True:
-        try:
-            attempt += 1
-            flag = "1" if IS_DEMO else "0"
-            market = MarketData.MarketAPI(flag=flag)
+    """获取最新价格、交易量、上下影线、振幅百分比、RSI、MA、EMA 和均线位置，失败时返回 None
+
+    网络错误和限流的退避重试由 okx_clients 的请求调度器统一处理。
+    """
+    try:
+        flag = "1" if IS_DEMO else "0"
+        market = get_market_api(flag)
+        if market_feed is not None and market_feed.last_price is not None:
+            price = market_feed.last_price
+        else:
             ticker_data = market.get_ticker(instId=symbol)
             if ticker_data.get("code") != "0":
-                logging.warning(f"Ticker API 失败 (尝试 {attempt}): {ticker_data.get('msg')}")
-                time.sleep(2)
-                continue
+                logging.warning("Ticker API 失败: %s", ticker_data.get('msg'))
+                return None
             price = float(ticker_data["data"][0]["last"])
-            
-            url = f"https://www.okx.com/api/v5/market/history-candles?instId={symbol}&bar={BAR_INTERVAL}&limit={CANDLE_LIMIT}"
-            response = requests.get(url, timeout=5)
-            candles_data = response.json()
-            if candles_data.get("code") == "0" and candles_data.get("data"):
-                candle = candles_data["data"][0]
-                prev_candle = candles_data["data"][1] if len(candles_data["data"]) > 1 else candle
-                open_price = float(candle[1])
-                high = float(candle[2])
-                low = float(candle[3])
-                close = float(candle[4])
-                volume = float(candle[5])
-                prev_close = float(prev_candle[4])
-                
-                upper_shadow = high - max(open_price, close)
-                lower_shadow = min(open_price, close) - low
-                amplitude_percent = (high - low) / low * 100 if low != 0 else 0.0
-                rsi = calculate_rsi(candles_data["data"])
-                ma, ema = calculate_ma_ema(candles_data["data"], MA_PERIODS)
-                position = determine_position(close, ma, ema)
-                avg_volume = calculate_avg_volume(candles_data["data"])
-                
-                ma20_str = f"{ma['MA20']:.2f}" if not pd.isna(ma['MA20']) else "N/A"
-                rsi_str = f"{rsi:.2f}" if rsi is not None else "N/A"
-                
-                log_msg = (
-                    f"成功获取价格: {price}, 交易量: {volume}, 上影线: {upper_shadow}, "
-                    f"下影线: {lower_shadow}, 振幅: {amplitude_percent:.2f}%, "
-                    f"RSI: {rsi_str}, MA20: {ma20_str}, 位置: {position}, 平均成交量: {avg_volume}, K线周期: {BAR_INTERVAL}"
-                )
-                
-                logging.info(log_msg)
-                return price, volume, upper_shadow, lower_shadow, amplitude_percent, rsi, ma, ema, position, close, prev_close, avg_volume, open_price, high, low
-            else:
-                logging.warning(f"K线 API 失败 (尝试 {attempt}): {candles_data.get('msg')}")
-                time.sleep(2)
-                continue
-        except Exception as e:
-            logging.warning(f"获取数据失败 (尝试 {attempt}): {e}")
-            time.sleep(2)
-            continue
+
+        candles_data = market.get_history_candlesticks(instId=symbol, bar=BAR_INTERVAL, limit=str(CANDLE_LIMIT))
+        if candles_data.get("code") != "0" or not candles_data.get("data"):
+            logging.warning("K线 API 失败: %s", candles_data.get('msg'))
+            return None
+        candle = candles_data["data"][0]
+        prev_candle = candles_data["data"][1] if len(candles_data["data"]) > 1 else candle
+        open_price = float(candle[1])
+        high = float(candle[2])
+        low = float(candle[3])
+        close = float(candle[4])
+        volume = float(candle[5])
+        prev_close = float(prev_candle[4])
+
+        upper_shadow = high - max(open_price, close)
+        lower_shadow = min(open_price, close) - low
+        amplitude_percent = (high - low) / low * 100 if low != 0 else 0.0
+        engine = update_indicator_engine(candles_data["data"])
+        rsi = engine.rsi
+        ma, ema = engine.ma, engine.ema
+        position = determine_position(close, ma, ema)
+        avg_volume = engine.avg_volume
+
+        ma20_str = f"{ma['MA20']:.2f}" if not is_missing(ma['MA20']) else "N/A"
+        rsi_str = f"{rsi:.2f}" if rsi is not None else "N/A"
+
+        log_msg = (
+            f"成功获取价格: {price}, 交易量: {volume}, 上影线: {upper_shadow}, "
+            f"下影线: {lower_shadow}, 振幅: {amplitude_percent:.2f}%, "
+            f"RSI: {rsi_str}, MA20: {ma20_str}, 位置: {position}, 平均成交量: {avg_volume}, K线周期: {BAR_INTERVAL}"
+        )
+
+        logging.info(log_msg)
+        return price, volume, upper_shadow, lower_shadow, amplitude_percent, rsi, ma, ema, position, close, prev_close, avg_volume, open_price, high, low
+    except Exception as e:
+        logging.warning("获取数据失败: %s", e)
+        return None
 
 def place_order(side: str, price: float, size: float, stop_loss: float = None, take_profit: float = None):
     """下单，仅在成功后推送Telegram消息"""
     try:
         flag = "1" if IS_DEMO else "0"
-        trade = Trade.TradeAPI(api_key=API_KEY, api_secret_key=SECRET_KEY, passphrase=PASS_PHRASE, flag=flag)
+        trade = get_trade_api(API_KEY, SECRET_KEY, PASS_PHRASE, flag)
         pos_side = "long" if side == "buy" else "short"
         order_id = str(int(time.time() * 1000)) + str(uuid.uuid4())[:8]
-        logging.info(f"尝试下单: {side.upper()}, 价格: {price}, 数量: {size}, 订单ID: {order_id}")
+        logging.info("尝试下单: %s, 价格: %s, 数量: %s, 订单ID: %s", side.upper(), price, size, order_id)
         
         sz = str(size)
         if float(sz) <= 0:
@@ -190,6 +200,19 @@ def place_order(side: str, price: float, size: float, stop_loss: float = None, t
             logging.error(error_msg)
             return None
             
+        attach_algo_ords = None
+        if ATTACH_ALGO_ORDERS and stop_loss and take_profit:
+            # 交易所按最新价触发、市价平仓，不依赖本程序的循环
+            attach_algo_ords = [{
+                "attachAlgoClOrdId": "a" + order_id,
+                "tpTriggerPx": f"{round(take_profit / TICK_SIZE) * TICK_SIZE:.8g}",
+                "tpOrdPx": "-1",
+                "tpTriggerPxType": "last",
+                "slTriggerPx": f"{round(stop_loss / TICK_SIZE) * TICK_SIZE:.8g}",
+                "slOrdPx": "-1",
+                "slTriggerPxType": "last",
+            }]
+
         order = trade.place_order(
             instId=SYMBOL,
             tdMode="cross",
@@ -197,12 +220,17 @@ def place_order(side: str, price: float, size: float, stop_loss: float = None, t
             posSide=pos_side,
             ordType="market",
             sz=sz,
+            attachAlgoOrds=attach_algo_ords,
         )
-        logging.info(f"API返回原始订单数据: {order}")
+        logging.info("API返回原始订单数据: %s", order)
         if order.get("code") == "0" and order.get("data") and order["data"][0].get("sCode") == "0":
             msg = f"✅ 下单成功: {side.upper()} | 价格: {price} | 数量: {size} | 订单ID: {order_id}"
             if stop_loss and take_profit:
                 msg += f" | 止损: {stop_loss:.2f} | 止盈: {take_profit:.2f}"
+            if attach_algo_ords:
+                # 调用方据此向交易所确认止盈止损单的状态
+                order["algo_cl_ord_id"] = attach_algo_ords[0]["attachAlgoClOrdId"]
+                msg += " | 交易所止盈止损已挂单"
             logging.info(msg)
             send_telegram_message(msg)
             return order
@@ -222,22 +250,88 @@ def place_order(side: str, price: float, size: float, stop_loss: float = None, t
         send_telegram_message(f"❌ {error_msg}")
         return None
 
+def close_on_stop_loss(position: str, price: float, stop_loss: float) -> bool:
+    """价格触及止损时市价平仓，平仓成功返回 True"""
+    order_size = max(ORDER_SIZE, MIN_ORDER_SIZE)
+    if position == "long" and price <= stop_loss:
+        order = place_order("sell", price, order_size)
+        if order:
+            send_telegram_message(f"🛑 止损卖出: 价格={price}")
+            return True
+    elif position == "short" and price >= stop_loss:
+        order = place_order("buy", price, order_size)
+        if order:
+            send_telegram_message(f"🛑 止损买入: 价格={price}")
+            return True
+    return False
+
+def get_exchange_exit_status(algo_cl_ord_id: str):
+    """查询附带的止盈止损单："closed" 已触发平仓，"protected" 仍在生效，None 已失效或查询失败"""
+    try:
+        trade = get_trade_api(API_KEY, SECRET_KEY, PASS_PHRASE, "1" if IS_DEMO else "0")
+        result = trade.get_algo_order_details(algoClOrdId=algo_cl_ord_id)
+        if result.get("code") != "0" or not result.get("data"):
+            logging.warning("查询止盈止损单失败: %s, %s", algo_cl_ord_id, result.get("msg"))
+            return None
+        state = result["data"][0].get("state")
+    except Exception as e:
+        logging.warning("查询止盈止损单异常: %s, %s", algo_cl_ord_id, e)
+        return None
+    if state == "effective":
+        return "closed"
+    if state in ("live", "pause", "partially_effective"):
+        return "protected"
+    return None
+
+def price_crossed(position: str, price: float, stop_loss: float, take_profit: float) -> bool:
+    if position == "long":
+        return price <= stop_loss or price >= take_profit
+    return price >= stop_loss or price <= take_profit
+
+def check_exit(position: str, price: float, stop_loss: float, take_profit: float, algo_cl_ord_id: str = None,
+               verify: bool = False) -> bool:
+    """持仓已退出时返回 True
+
+    有交易所止盈止损单时，价格越过触发价或 verify 为 True（每根K线一次，发现K线内影线触发的平仓）时向交易所查询：
+    已触发则只同步状态，仍生效则继续持有，失效或查询失败时回退到本地市价止损。
+    """
+    if position is None:
+        return False
+    if algo_cl_ord_id:
+        if not verify and not price_crossed(position, price, stop_loss, take_profit):
+            return False
+        status = get_exchange_exit_status(algo_cl_ord_id)
+        if status == "closed":
+            send_telegram_message(f"🛑 交易所止盈止损已触发: {'多单' if position == 'long' else '空单'}, 价格={price}")
+            return True
+        if status == "protected":
+            return False
+    return close_on_stop_loss(position, price, stop_loss)
+
 # ============ 主程序 ============
 
-if __name__ == "__main__":
+def run():
+    """主循环：每根K线结束时获取数据、判断信号并下单"""
+    global market_feed
     interval_secs = get_interval_seconds(BAR_INTERVAL)
-    logging.info(f"🚀 启动 OKX 自动交易机器人... K线周期: {BAR_INTERVAL} ({interval_secs}秒)")
+    logging.info("🚀 启动 OKX 自动交易机器人... K线周期: %s (%s秒)", BAR_INTERVAL, interval_secs)
     print(f"启动交易机器人... K线周期: {BAR_INTERVAL} ({interval_secs}秒)")
     send_telegram_message(f"🤖 交易机器人已启动！K线周期: {BAR_INTERVAL}，开始监控 BTC/USDT-SWAP 并执行交易。")
+    if USE_WEBSOCKET:
+        from market_ws import MarketDataFeed  # 只在 WebSocket 模式下导入 websockets
+        market_feed = MarketDataFeed(SYMBOL, BAR_INTERVAL, demo=IS_DEMO)
+        market_feed.start()
 
     current_position = None  # 当前持仓状态: None, "long", "short"
     entry_price = 0.0  # 入场价格
     stop_loss = 0.0  # 止损价格
     take_profit = 0.0  # 止盈价格
+    algo_cl_ord_id = None  # 当前持仓附带的交易所止盈止损单 ID
     last_signal = None  # 上一次交易信号
     last_candle_ts = 0  # 上一次K线时间戳
     last_ma_position = None  # 上次均线位置，用于检测初次
     recorded_candle = None  # 记录的上一个K线数据
+    failures = 0  # 连续失败次数，用于退避等待
 
     while True:
         try:
@@ -249,16 +343,28 @@ if __name__ == "__main__":
             seconds_to_next_cycle = (cycle_start + interval_secs) - current_timestamp
             if seconds_to_next_cycle > 0:
                 print(f"等待 {seconds_to_next_cycle} 秒到下一个 {BAR_INTERVAL} K线结束...")
-                time.sleep(seconds_to_next_cycle)  # 等待到K线周期结束
+                if market_feed is not None:
+                    # WebSocket 模式：等待期间每次价格推送都检查止损
+                    deadline = time.time() + seconds_to_next_cycle
+                    while time.time() < deadline:
+                        if market_feed.wait_for_update(deadline - time.time()) and current_position is not None:
+                            if check_exit(current_position, market_feed.last_price, stop_loss, take_profit, algo_cl_ord_id):
+                                current_position = None
+                                last_signal = None
+                else:
+                    time.sleep(seconds_to_next_cycle)  # 等待到K线周期结束
 
             # 获取最新数据
             data = get_latest_price_and_indicators(SYMBOL)
             if data is None:
-                logging.error(f"无法获取 {SYMBOL} 的价格、交易量或指标，API 调用失败")
+                logging.error("无法获取 %s 的价格、交易量或指标，API 调用失败", SYMBOL)
                 print(f"错误: 无法获取 {SYMBOL} 的价格、交易量或指标，API 调用失败")
-                send_telegram_message(f"❌ 程序错误: 无法获取 {SYMBOL} 的数据，API 调用失败")
-                time.sleep(60)
+                failures += 1
+                if failures == 1:
+                    send_telegram_message(f"❌ 程序错误: 无法获取 {SYMBOL} 的数据，API 调用失败")
+                time.sleep(backoff_delay(failures, base=1, cap=60))
                 continue
+            failures = 0
 
             price, volume, upper_shadow, lower_shadow, amplitude_percent, rsi, ma, ema, position, close, prev_close, avg_volume, open_price, high, low = data
 
@@ -358,6 +464,7 @@ if __name__ == "__main__":
                     order = place_order("buy", price, order_size, stop_loss, take_profit)
                     if order:
                         current_position = "long"
+                        algo_cl_ord_id = order.get("algo_cl_ord_id")
                         entry_price = price
                         last_signal = signal
                 elif signal == "sell" and current_position is None:
@@ -366,27 +473,22 @@ if __name__ == "__main__":
                     order = place_order("sell", price, order_size, stop_loss, take_profit)
                     if order:
                         current_position = "short"
+                        algo_cl_ord_id = order.get("algo_cl_ord_id")
                         entry_price = price
                         last_signal = signal
 
-            # 止损检查
-            if current_position == "long" and price <= stop_loss:
-                order_size = max(ORDER_SIZE, MIN_ORDER_SIZE)
-                order = place_order("sell", price, order_size)
-                if order:
-                    send_telegram_message(f"🛑 止损卖出: 价格={price}")
-                    current_position = None
-                    last_signal = None
-            elif current_position == "short" and price >= stop_loss:
-                order_size = max(ORDER_SIZE, MIN_ORDER_SIZE)
-                order = place_order("buy", price, order_size)
-                if order:
-                    send_telegram_message(f"🛑 止损买入: 价格={price}")
-                    current_position = None
-                    last_signal = None
+            # 止损检查（有交易所止盈止损时向交易所确认状态）
+            if check_exit(current_position, price, stop_loss, take_profit, algo_cl_ord_id, verify=True):
+                current_position = None
+                last_signal = None
 
         except Exception as e:
-            logging.error(f"程序错误: {e}")
+            logging.error("程序错误: %s", e)
             print(f"错误: {e}")
             send_telegram_message(f"❌ 程序错误: {e}")
-            time.sleep(60)
\ No newline at end of file
+            failures += 1
+            time.sleep(backoff_delay(failures, base=1, cap=60))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import ssl
+import threading
+import time
+
+import certifi
+import websockets
+
+from metrics import RETRIES
+from order_book import OrderBook
+
+OKX_WS_URLS = {
+    # (公共频道, 业务频道)，K线频道在业务频道上
+    "live": ("wss://ws.okx.com:8443/ws/v5/public", "wss://ws.okx.com:8443/ws/v5/business"),
+    "demo": ("wss://wspap.okx.com:8443/ws/v5/public", "wss://wspap.okx.com:8443/ws/v5/business"),
+}
+PING_INTERVAL = 25  # OKX 30 秒无消息会断开连接
+MAX_RECONNECT_DELAY = 30
+
+
+class MarketDataFeed:
+    """OKX 公共 WebSocket 行情：订阅 tickers 和 candle{bar}，在后台线程中运行并自动重连
+
+    symbols / bars 可以是单个字符串或列表。最新价格通过 prices（或单产品时的 last_price）读取，
+    K线推送通过 drain_candles 按 OKX 原始格式（最新在前）取出，
+    断线重连后 take_resync 对每个 (产品, K线周期) 返回一次 True，调用方应通过 REST 补齐断线期间的K线。
+    book_channel 为 "books" / "books5" 时同时维护本地订单簿（get_book），序号或校验和出错时自动重新订阅该产品。
+    """
+
+    def __init__(self, symbols, bars, demo: bool = True, public_url: str = None, business_url: str = None,
+                 book_channel: str = None):
+        default_public, default_business = OKX_WS_URLS["demo" if demo else "live"]
+        self.symbols = [symbols] if isinstance(symbols, str) else list(symbols)
+        self.bars = [bars] if isinstance(bars, str) else list(bars)
+        self.symbol = self.symbols[0]
+        self.bar = self.bars[0]
+        self.public_url = public_url or default_public
+        self.business_url = business_url or default_business
+        self.prices = {}
+        self.book_channel = book_channel
+        self.books = {s: OrderBook(s) for s in self.symbols} if book_channel else {}
+        self.book_resyncs = 0
+        self._stale_books = set()  # 订单簿校验失败、等待重新订阅的产品
+        self.last_tick_time = 0.0
+        self.reconnects = 0
+        self._candles = {}
+        self._resync = set()  # 断线重连后需要通过 REST 补齐的 (产品, K线周期)
+        self._updated = False
+        self._listeners = []  # 有推送时在订阅线程中调用，必须快速返回
+        self._cond = threading.Condition()
+        self._loop = None
+        self._thread = None
+        self._stopping = False
+
+    @property
+    def last_price(self):
+        return self.prices.get(self.symbol)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="market-ws", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stopping = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(lambda: [t.cancel() for t in asyncio.all_tasks(self._loop)])
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._cond:
+            self._cond.notify_all()
+
+    def wait_for_update(self, timeout: float) -> bool:
+        """等待下一次价格或K线推送，超时返回 False"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._updated or self._stopping, timeout=max(timeout, 0))
+            updated, self._updated = self._updated, False
+            return updated
+
+    def add_listener(self, callback):
+        """注册推送回调（例如 loop.call_soon_threadsafe 唤醒 asyncio 任务）"""
+        self._listeners.append(callback)
+
+    def drain_candles(self, symbol: str = None, bar: str = None) -> list:
+        key = (symbol or self.symbol, bar or self.bar)
+        with self._cond:
+            candles = self._candles.pop(key, [])
+        return candles[::-1]
+
+    def take_resync(self, symbol: str = None, bar: str = None) -> bool:
+        key = (symbol or self.symbol, bar or self.bar)
+        with self._cond:
+            if key not in self._resync:
+                return False
+            self._resync.discard(key)
+        return True
+
+    def get_book(self, symbol: str = None):
+        """可用的本地订单簿，未订阅、尚未收到快照或校验失败时返回 None"""
+        book = self.books.get(symbol or self.symbol)
+        return book if book is not None and book.ready else None
+
+    def _notify(self):
+        self._updated = True
+        self._cond.notify_all()
+        for callback in self._listeners:
+            callback()
+
+    def _on_message(self, raw: str):
+        if raw == "pong":
+            return
+        message = json.loads(raw)
+        if "event" in message:
+            if message["event"] == "error":
+                logging.error("WebSocket 订阅错误: %s %s", message.get('code'), message.get('msg'))
+            else:
+                logging.info("WebSocket 事件: %s %s", message['event'], message.get('arg', ''))
+            return
+        arg = message.get("arg", {})
+        channel = arg.get("channel", "")
+        data = message.get("data") or []
+        if channel == self.book_channel and data:
+            # 订单簿推送频率高，不唤醒等待价格的任务
+            book = self.books.get(arg.get("instId"))
+            if book is not None and not all(book.apply(message.get("action"), d) for d in data):
+                logging.warning("订单簿校验失败，重新订阅: %s %s", arg.get("instId"), channel)
+                self._stale_books.add(arg.get("instId"))
+            return
+        with self._cond:
+            if channel == "tickers" and data:
+                for ticker in data:
+                    self.prices[ticker.get("instId", arg.get("instId"))] = float(ticker["last"])
+                self.last_tick_time = time.time()
+                self._notify()
+            elif channel.startswith("candle") and data:
+                key = (arg.get("instId"), channel[len("candle"):])
+                self._candles.setdefault(key, []).extend(sorted(data, key=lambda c: int(c[0])))
+                self._notify()
+
+    async def _consume(self, url: str, args: list):
+        delay = 1
+        connected_before = False
+        ssl_context = None
+        if url.startswith("wss://"):
+            ssl_context = ssl.create_default_context(cafile=certifi.where())
+        while not self._stopping:
+            try:
+                async with websockets.connect(url, ssl=ssl_context, ping_interval=None) as ws:
+                    await ws.send(json.dumps({"op": "subscribe", "args": args}))
+                    logging.info("WebSocket 已连接并订阅: %s %s", url, args)
+                    if connected_before:
+                        with self._cond:
+                            self._resync.update((s, b) for s in self.symbols for b in self.bars)
+                            self.reconnects += 1
+                            RETRIES.inc(operation="market_ws_reconnect")
+                    connected_before = True
+                    delay = 1
+                    while True:
+                        try:
+                            raw = await asyncio.wait_for(ws.recv(), timeout=PING_INTERVAL)
+                        except asyncio.TimeoutError:
+                            await ws.send("ping")
+                            continue
+                        self._on_message(raw)
+                        if self._stale_books and url == self.public_url:
+                            await self._resubscribe_books(ws)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                if self._stopping:
+                    break
+                if url == self.public_url:
+                    for book in self.books.values():
+                        book.reset()  # 断线期间的订单簿不可用，重新订阅后等待新快照
+                logging.warning("WebSocket 断开: %s, %s，%s 秒后重连", url, e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    async def _resubscribe_books(self, ws):
+        """退订再订阅校验失败的订单簿，OKX 会重新推送全量快照"""
+        args = [{"channel": self.book_channel, "instId": s} for s in sorted(self._stale_books)]
+        self._stale_books.clear()
+        self.book_resyncs += len(args)
+        RETRIES.inc(operation="order_book_resync")
+        await ws.send(json.dumps({"op": "unsubscribe", "args": args}))
+        await ws.send(json.dumps({"op": "subscribe", "args": args}))
+
+    async def _main(self):
+        public_args = [{"channel": "tickers", "instId": s} for s in self.symbols]
+        if self.book_channel:
+            public_args += [{"channel": self.book_channel, "instId": s} for s in self.symbols]
+        await asyncio.gather(
+            self._consume(self.public_url, public_args),
+            self._consume(self.business_url, [{"channel": f"candle{b}", "instId": s} for s in self.symbols for b in self.bars]),
+            return_exceptions=True,
+        )
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._main())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
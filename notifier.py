@@ -0,0 +1,153 @@
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from okx_clients import get_http_session, HTTP_TIMEOUT
+from metrics import RETRIES, RATE_LIMIT_HITS, TELEGRAM_DROPPED
+
+TELEGRAM_API_URL = "https://api.telegram.org"
+TELEGRAM_MAX_CHARS = 4096  # Telegram 单条消息长度上限
+MAX_SEND_ATTEMPTS = 3
+DEFAULT_RETRY_AFTER = 30  # 429 响应中取不到等待时间时的默认秒数
+
+
+def retry_after_seconds(response) -> float:
+    """429 响应要求的等待秒数：优先取 JSON 中的 parameters.retry_after，其次取 Retry-After 头"""
+    try:
+        retry_after = response.json().get("parameters", {}).get("retry_after")
+    except (ValueError, AttributeError):
+        retry_after = None  # 网关返回的 429 可能不是 JSON
+    if retry_after is None:
+        retry_after = response.headers.get("Retry-After")
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class TelegramNotifier:
+    """后台 Telegram 推送：有界队列 + 单工作线程，不阻塞交易逻辑
+
+    batch_window 内到达的多条消息合并为一条发送；两次发送间隔不小于 min_interval，
+    遇到 429 按 retry_after 在工作线程中等待；daily_limit 为每日（UTC）发送条数上限，None 表示不限。
+    """
+
+    def __init__(self, bot_token: str, chat_id: str, daily_limit: int = None, max_queue: int = 1000,
+                 min_interval: float = 1.0, batch_window: float = 0.5, api_url: str = TELEGRAM_API_URL):
+        self.url = f"{api_url}/bot{bot_token}/sendMessage"
+        self.chat_id = chat_id
+        self.daily_limit = daily_limit
+        self.min_interval = min_interval
+        self.batch_window = batch_window
+        self.sent_today = 0
+        self.sent = 0
+        self.dropped = 0
+        self.rate_limited = 0
+        self._day = None
+        self._next_send = 0.0
+        self._carry = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="telegram-notifier", daemon=True)
+            self._thread.start()
+        return self
+
+    def notify(self, message: str) -> bool:
+        """放入发送队列，立即返回；队列已满时丢弃并返回 False"""
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            TELEGRAM_DROPPED.inc(reason="queue_full")
+            logging.warning("Telegram 队列已满，丢弃消息")
+            return False
+
+    def stop(self, timeout: float = 5.0):
+        """停止并尽量发送完队列中的消息"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _take_batch(self):
+        if self._carry is not None:
+            first, self._carry = self._carry, None
+        else:
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                return None
+        parts = [first]
+        size = len(first)
+        deadline = time.monotonic() + (0 if self._stopping.is_set() else self.batch_window)
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                message = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if size + len(message) + 1 > TELEGRAM_MAX_CHARS:
+                self._carry = message
+                break
+            parts.append(message)
+            size += len(message) + 1
+        return "\n".join(parts)[:TELEGRAM_MAX_CHARS]
+
+    def _consume_budget(self) -> bool:
+        today = datetime.now(timezone.utc).date()
+        if today != self._day:
+            self._day = today
+            self.sent_today = 0
+        if self.daily_limit is not None and self.sent_today >= self.daily_limit:
+            return False
+        self.sent_today += 1
+        return True
+
+    def _send(self, text: str) -> bool:
+        for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+            if attempt > 1:
+                RETRIES.inc(operation="telegram")
+            wait = self._next_send - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._next_send = time.monotonic() + self.min_interval
+            try:
+                response = get_http_session().post(self.url, json={"chat_id": self.chat_id, "text": text}, timeout=HTTP_TIMEOUT)
+            except Exception as e:
+                logging.error("Telegram 发送异常 (尝试 %s): %s", attempt, e)
+                self._next_send = time.monotonic() + 2 ** attempt
+                continue
+            if response.status_code == 429:
+                self.rate_limited += 1
+                RATE_LIMIT_HITS.inc(source="telegram")
+                retry_after = retry_after_seconds(response)
+                logging.warning("Telegram 限流: %s 秒后重试", retry_after)
+                self._next_send = time.monotonic() + retry_after
+                continue
+            if response.status_code != 200:
+                logging.error("Telegram 发送失败: 状态码 %s, 响应: %s", response.status_code, response.text)
+                return False
+            self.sent += 1
+            return True
+        return False
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty() and self._carry is None):
+            text = self._take_batch()
+            if text is None:
+                continue
+            if not self._consume_budget():
+                self.dropped += 1
+                TELEGRAM_DROPPED.inc(reason="daily_limit")
+                logging.warning("今日 Telegram 消息数已达上限 %s，跳过发送", self.daily_limit)
+                continue
+            if not self._send(text):
+                self.dropped += 1
+                TELEGRAM_DROPPED.inc(reason="send_failed")
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+
+import httpx
+
+from metrics import OKX_REQUEST_SECONDS
+from rate_limiter import RequestScheduler, ScheduledTransport
+
+OKX_DOMAIN = os.getenv("OKX_API_DOMAIN", "https://www.okx.com")
+OKX_TIMEOUT = httpx.Timeout(10.0, connect=5.0)  # 读超时 10 秒，建连超时 5 秒
+HTTP_TIMEOUT = (5, 10)  # requests 的 (建连, 读取) 超时
+
+ENDPOINT_NAMES = {
+    "/api/v5/market/ticker": "ticker",
+    "/api/v5/market/tickers": "tickers",
+    "/api/v5/market/candles": "candles",
+    "/api/v5/market/history-candles": "candles",
+    "/api/v5/account/positions": "positions",
+    "/api/v5/account/config": "account_config",
+    "/api/v5/public/instruments": "instruments",
+    "/api/v5/trade/order": "place_order",
+    "/api/v5/trade/close-position": "close_positions",
+}
+
+_clients = {}
+_scheduler = RequestScheduler()  # 所有共享客户端共用，多个产品/策略使用同一个 API Key 时共同遵守限速
+_session = None
+_lock = threading.Lock()
+
+
+def _on_request(request):
+    request.extensions["started"] = time.perf_counter()
+
+
+def _on_response(response):
+    started = response.request.extensions.get("started")
+    path = response.request.url.path
+    if started is not None:
+        # 响应头到达时计时（含限速排队和重试），OKX 响应体很小，读取耗时可忽略；429 次数由调度器统计
+        OKX_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=ENDPOINT_NAMES.get(path, path))
+
+
+def _get_client(cls, api_key="-1", secret_key="-1", passphrase="-1", flag="1", domain=None):
+    domain = domain or OKX_DOMAIN
+    key = (cls, api_key, flag, domain)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = cls(api_key=api_key, api_secret_key=secret_key, passphrase=passphrase, flag=flag, domain=domain)
+            # SDK 客户端本身是 httpx.Client，复用同一实例即可复用连接池和 keep-alive 连接
+            client.timeout = OKX_TIMEOUT
+            client.event_hooks = {"request": [_on_request], "response": [_on_response]}
+            # SDK 不接受自定义 transport，只能替换已创建的传输层，让请求经过限速调度
+            client._transport = ScheduledTransport(client._transport, _scheduler, secret_key if api_key != "-1" else None)
+            _clients[key] = client
+    return client
+
+
+def get_scheduler() -> RequestScheduler:
+    """共享客户端使用的请求调度器"""
+    return _scheduler
+
+
+# OKX SDK 和 requests 在首次使用时才导入，缩短 app.py / main.py 的启动时间
+
+def get_market_api(flag: str, domain: str = None) -> "MarketData.MarketAPI":
+    """获取共享的行情客户端（无需鉴权）"""
+    from okx import MarketData
+    return _get_client(MarketData.MarketAPI, flag=flag, domain=domain)
+
+
+def get_public_api(flag: str, domain: str = None) -> "PublicData.PublicAPI":
+    """获取共享的公共数据客户端（产品信息等，无需鉴权）"""
+    from okx import PublicData
+    return _get_client(PublicData.PublicAPI, flag=flag, domain=domain)
+
+
+def get_trade_api(api_key: str, secret_key: str, passphrase: str, flag: str, domain: str = None) -> "Trade.TradeAPI":
+    """获取共享的交易客户端"""
+    from okx import Trade
+    return _get_client(Trade.TradeAPI, api_key, secret_key, passphrase, flag, domain)
+
+
+def get_account_api(api_key: str, secret_key: str, passphrase: str, flag: str, domain: str = None) -> "Account.AccountAPI":
+    """获取共享的账户客户端"""
+    from okx import Account
+    return _get_client(Account.AccountAPI, api_key, secret_key, passphrase, flag, domain)
+
+
+def get_http_session() -> "requests.Session":
+    """获取共享的 requests 会话（Telegram 等普通 HTTP 请求使用），复用 keep-alive 连接"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def close_all():
+    """关闭所有共享连接，退出时调用"""
+    global _session
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        if _session is not None:
+            _session.close()
+            _session = None
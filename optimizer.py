@@ -0,0 +1,164 @@
+import argparse
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from backtest import StrategyParams, load_candles, ma_positions, run_backtest
+from indicators import rolling_mean, ema, rsi
+
+# 默认搜索空间，字段名与 StrategyParams 一致
+SEARCH_SPACE = {
+    "ma_periods": [(20, 60, 120), (10, 30, 90), (20, 50, 100), (30, 90, 180)],
+    "rsi_buy_below": [40.0, 50.0, 60.0],
+    "rsi_sell_above": [40.0, 50.0, 60.0],
+    "stop_loss_pct": [0.01, 0.02, 0.03],
+    "take_profit_pct": [0.02, 0.04, 0.06],
+    "cooldown": [600, 1800, 3600],
+    "volume_multiplier": [1.0, 1.5, 2.0],
+}
+CANDLE_FIELDS = ("ts", "open", "high", "low", "close", "volume")
+
+_shm = None
+_arrays = {}
+
+
+def grid(space: dict) -> list:
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def random_sample(space: dict, n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    combos = {tuple(rng.choice(space[k]) for k in space) for _ in range(n * 3)}
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in list(combos)[:n]]
+
+
+def _indicator_keys(combos: list, base: StrategyParams) -> set:
+    """所有组合共用的指标数组：每个周期的 MA/EMA 只算一次"""
+    keys = {("rsi", base.rsi_period), ("avg_volume", base.volume_period)}
+    for combo in combos:
+        for p in combo.get("ma_periods", base.ma_periods):
+            keys.add(("ma", p))
+            keys.add(("ema", p))
+    return keys
+
+
+def _compute(key, candles: dict, base: StrategyParams) -> np.ndarray:
+    kind, period = key
+    if kind == "ma":
+        return rolling_mean(candles["close"], period)
+    if kind == "ema":
+        return ema(candles["close"], period, base.ema_window)
+    if kind == "rsi":
+        return rsi(candles["close"], period)
+    return rolling_mean(candles["volume"], period)
+
+
+def _share(arrays: dict):
+    """把全部数组放进一块共享内存，返回 (共享内存, 布局)，子进程按布局直接映射，无需序列化"""
+    layout = {}
+    offset = 0
+    for name, arr in arrays.items():
+        layout[name] = (offset, len(arr), arr.dtype.str)
+        offset += arr.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for name, arr in arrays.items():
+        start, length, dtype = layout[name]
+        np.ndarray(length, dtype=dtype, buffer=shm.buf, offset=start)[:] = arr
+    return shm, layout
+
+
+def _attach(shm_name: str, layout: dict):
+    global _shm, _arrays
+    _shm = shared_memory.SharedMemory(name=shm_name)
+    _arrays = {
+        name: np.ndarray(length, dtype=dtype, buffer=_shm.buf, offset=start)
+        for name, (start, length, dtype) in layout.items()
+    }
+
+
+def _evaluate_group(args):
+    """评估同一组均线周期的所有参数组合：均线位置和密集度只算一次"""
+    ma_periods, combos, base = args
+    candles = {name: _arrays[name] for name in CANDLE_FIELDS}
+    lines = [_arrays[("ma", p)] for p in ma_periods] + [_arrays[("ema", p)] for p in ma_periods]
+    position, concentration = ma_positions(candles["close"], lines)
+    indicators = {
+        "lines": lines,
+        "rsi": _arrays[("rsi", base.rsi_period)],
+        "avg_volume": _arrays[("avg_volume", base.volume_period)],
+        "position": position,
+        "concentration": concentration,
+    }
+    rows = []
+    for combo in combos:
+        params = replace(base, **combo)
+        stats = run_backtest(candles, params, indicators).stats
+        stats.pop("exits", None)
+        rows.append({**combo, **stats})
+    return rows
+
+
+def optimize(candles: dict, combos: list, base: StrategyParams = None, workers: int = None,
+             sort_by: str = "total_pnl", group_size: int = 32) -> pd.DataFrame:
+    """在进程池上评估全部参数组合，返回按 sort_by 降序排列的结果表"""
+    base = base or StrategyParams()
+    arrays = {name: np.ascontiguousarray(candles[name]) for name in CANDLE_FIELDS}
+    for key in _indicator_keys(combos, base):
+        arrays[key] = _compute(key, candles, base)
+    shm, layout = _share(arrays)
+    del arrays
+
+    groups = {}
+    for combo in combos:
+        groups.setdefault(tuple(combo.get("ma_periods", base.ma_periods)), []).append(combo)
+    tasks = []
+    for ma_periods, members in groups.items():
+        for i in range(0, len(members), group_size):
+            tasks.append((ma_periods, members[i:i + group_size], base))
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_attach,
+                                 initargs=(shm.name, layout)) as pool:
+            rows = [row for result in pool.map(_evaluate_group, tasks) for row in result]
+    finally:
+        shm.close()
+        shm.unlink()
+    table = pd.DataFrame(rows)
+    if len(table):
+        table = table.sort_values(sort_by, ascending=False).reset_index(drop=True)
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run_bot 策略参数寻优（网格/随机搜索）")
+    parser.add_argument("path", help="K线文件（CSV 或 Parquet）")
+    parser.add_argument("--mode", choices=["grid", "random"], default="grid")
+    parser.add_argument("--samples", type=int, default=500, help="随机搜索的组合数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--sort-by", default="total_pnl")
+    # 确认计数只在位置变化的K线上累加，连续两根都“变为”之上/之下不会发生，策略默认的 2 根确认不产生信号
+    parser.add_argument("--confirm-bars", type=int, default=1, help="确认K线数（默认 1；2 与实盘一致但不会产生信号）")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--out", help="完整结果输出 CSV 路径")
+    args = parser.parse_args()
+
+    candles = load_candles(args.path)
+    combos = grid(SEARCH_SPACE) if args.mode == "grid" else random_sample(SEARCH_SPACE, args.samples, args.seed)
+    start = time.perf_counter()
+    table = optimize(candles, combos, StrategyParams(confirm_bars=args.confirm_bars), args.workers, args.sort_by)
+    elapsed = time.perf_counter() - start
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(table.head(args.top))
+    print(f"{len(combos)} 组参数, {len(candles['close'])} 根K线, 耗时 {elapsed:.1f} 秒")
+    if args.out:
+        table.to_csv(args.out, index=False)
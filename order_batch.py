@@ -0,0 +1,27 @@
+import logging
+
+BATCH_LIMIT = 20  # OKX 批量下单/撤单/改单每次最多 20 笔
+
+
+def submit_batch(method, legs: list, action: str) -> list:
+    """按每批 BATCH_LIMIT 笔调用批量接口（place/cancel/amend_multiple_orders），返回与 legs 一一对应的逐笔结果
+
+    每笔结果为 OKX 返回的 data 项（含 sCode / sMsg / ordId），sCode 为 "0" 表示该笔成功。
+    整批被拒绝且没有逐笔结果时，每笔都记为整批的错误码；失败的笔逐一记录日志。
+    """
+    results = []
+    for start in range(0, len(legs), BATCH_LIMIT):
+        chunk = legs[start:start + BATCH_LIMIT]
+        result = method(chunk)
+        data = result.get("data") or []
+        for i, leg in enumerate(chunk):
+            item = data[i] if i < len(data) else {"sCode": result.get("code") or "1", "sMsg": result.get("msg") or "未知错误"}
+            if item.get("sCode") != "0":
+                logging.error("批量%s失败: %s %s, 错误代码: %s, 错误: %s", action, leg.get("instId"),
+                              leg.get("clOrdId") or leg.get("ordId"), item.get("sCode"), item.get("sMsg"))
+            results.append(item)
+    return results
+
+
+def all_ok(results: list) -> bool:
+    return bool(results) and all(item.get("sCode") == "0" for item in results)
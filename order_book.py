@@ -0,0 +1,154 @@
+import threading
+import zlib
+from itertools import islice
+
+from sortedcontainers import SortedDict
+
+CHECKSUM_LEVELS = 25  # OKX 校验和取买卖各前 25 档
+
+
+def okx_checksum(bids, asks) -> int:
+    """OKX 订单簿校验和：买卖前 25 档按 买价:买量:卖价:卖量 交替拼接（一侧不足时只拼另一侧），取 CRC32 的有符号 32 位值
+
+    bids / asks 为从最优开始的 (价格字符串, 数量字符串) 序列，必须使用推送中的原始字符串。
+    """
+    parts = []
+    bids = list(islice(bids, CHECKSUM_LEVELS))
+    asks = list(islice(asks, CHECKSUM_LEVELS))
+    for i in range(max(len(bids), len(asks))):
+        if i < len(bids):
+            parts.extend(bids[i][:2])
+        if i < len(asks):
+            parts.extend(asks[i][:2])
+    crc = zlib.crc32(":".join(parts).encode())
+    return crc - (1 << 32) if crc >= 1 << 31 else crc
+
+
+class OrderBook:
+    """单个产品的本地 L2 订单簿，由 books / books5 频道的推送维护
+
+    买卖盘各存一个 SortedDict（买盘以负价格为键），最优价和前 N 档都从头部读取，
+    单档增删改 O(log n)。推送中的价格和数量保留原始字符串，用于校验和。
+    推送线程写入、下单线程读取，读写都持有同一把锁。
+    """
+
+    def __init__(self, inst_id: str):
+        self.inst_id = inst_id
+        self.bids = SortedDict()  # -价格 -> (价格, 数量, 价格字符串, 数量字符串)
+        self.asks = SortedDict()  # 价格 -> (价格, 数量, 价格字符串, 数量字符串)
+        self.seq_id = None
+        self.ts = 0
+        self.ready = False
+        self._lock = threading.Lock()
+
+    def apply(self, action: str, book: dict) -> bool:
+        """应用一次推送：snapshot（或 books5 这类不带 action 的全量推送）替换整本，update 增量修改
+
+        序号不连续或校验和不符时返回 False，此时订单簿不再可用，调用方应重新订阅以获取新的快照。
+        """
+        with self._lock:
+            if action == "update":
+                if not self.ready:
+                    return False
+                prev = book.get("prevSeqId")
+                if prev is not None and self.seq_id is not None and int(prev) != self.seq_id:
+                    self.ready = False
+                    return False
+            else:
+                self.bids.clear()
+                self.asks.clear()
+            for level in book.get("bids", []):
+                self._set(self.bids, -float(level[0]), level)
+            for level in book.get("asks", []):
+                self._set(self.asks, float(level[0]), level)
+            if book.get("seqId") is not None:
+                self.seq_id = int(book["seqId"])
+            self.ts = int(book.get("ts") or 0)
+            if book.get("checksum") is not None and self._checksum() != int(book["checksum"]):
+                self.ready = False
+                return False
+            self.ready = True
+            return True
+
+    def reset(self):
+        with self._lock:
+            self.bids.clear()
+            self.asks.clear()
+            self.seq_id = None
+            self.ready = False
+
+    @staticmethod
+    def _set(side: SortedDict, key: float, level):
+        px, sz = level[0], level[1]
+        size = float(sz)
+        if size == 0:
+            side.pop(key, None)
+        else:
+            side[key] = (abs(key), size, px, sz)
+
+    def _checksum(self) -> int:
+        return okx_checksum((v[2:] for v in self.bids.values()), (v[2:] for v in self.asks.values()))
+
+    def checksum(self) -> int:
+        with self._lock:
+            return self._checksum()
+
+    def best_bid(self):
+        with self._lock:
+            return self.bids.peekitem(0)[1][0] if self.bids else None
+
+    def best_ask(self):
+        with self._lock:
+            return self.asks.peekitem(0)[1][0] if self.asks else None
+
+    def mid(self):
+        with self._lock:
+            if not self.bids or not self.asks:
+                return None
+            return (self.bids.peekitem(0)[1][0] + self.asks.peekitem(0)[1][0]) / 2
+
+    def levels(self, side: str, depth: int = 5) -> list:
+        """前 depth 档 [(价格, 数量), ...]，side 为 "bids" / "asks"，从最优价开始"""
+        with self._lock:
+            book = self.bids if side == "bids" else self.asks
+            return [v[:2] for v in islice(book.values(), depth)]
+
+    def estimate_fill(self, side: str, size: float):
+        """估算市价单按当前盘口的成交：买单吃卖盘、卖单吃买盘
+
+        返回 {"avg_price", "worst_price", "filled", "slippage_bps"}，滑点相对对手方最优价（总为非负）；
+        盘口为空时返回 None。盘口深度不足时 filled 小于 size。
+        """
+        with self._lock:
+            book = self.asks if side == "buy" else self.bids
+            if not book:
+                return None
+            best = book.peekitem(0)[1][0]
+            remaining = size
+            cost = 0.0
+            price = best
+            for price, level_size, _, _ in book.values():
+                take = min(remaining, level_size)
+                cost += take * price
+                remaining -= take
+                if remaining <= 0:
+                    break
+        filled = size - max(remaining, 0.0)
+        if filled <= 0:
+            return None
+        avg = cost / filled
+        return {
+            "avg_price": avg,
+            "worst_price": price,
+            "filled": filled,
+            "slippage_bps": abs(avg - best) / best * 10000,
+        }
+
+    def protected_price(self, side: str, max_slippage_bps: float):
+        """价格保护的限价：对手方最优价向不利方向偏移 max_slippage_bps；盘口为空时返回 None"""
+        with self._lock:
+            book = self.asks if side == "buy" else self.bids
+            if not book:
+                return None
+            best = book.peekitem(0)[1][0]
+        return best * (1 + max_slippage_bps / 10000) if side == "buy" else best * (1 - max_slippage_bps / 10000)
@@ -1,67 +1,1266 @@
+import hashlib
+import math
+import os
 import re
+import stat
+import threading
 from typing import Tuple
 
+import numpy as np
+
+from indicators import rolling_mean, _decay_filter
+
+# 缓存的生成代码会被 exec，默认放在用户私有的缓存目录而不是共享的临时目录
+PINE_CACHE_DIR = os.getenv("PINE_CACHE_DIR", os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "pine_cache"))
+CODEGEN_VERSION = "1"  # 生成代码的格式变化时递增，使旧缓存失效
+
+na = float("nan")
+
+_strategies = {}  # 脚本哈希 -> PineStrategy
+_cache_lock = threading.Lock()
+
+
+class PineSyntaxError(ValueError):
+    def __init__(self, message: str, line: int = None):
+        super().__init__(f"第 {line} 行: {message}" if line else message)
+        self.line = line
+
+
+# ============ 生成代码使用的运行时函数 ============
+# 序列统一为 float64（布尔序列为 bool）数组，na 用 NaN 表示；ta.* 只允许开头的预热段为 na
+
+def series(x, n: int) -> np.ndarray:
+    if np.ndim(x) == 0:
+        return np.full(n, x, dtype=bool if np.asarray(x).dtype == bool else np.float64)
+    return x
+
+
+def shift(x, k, n: int) -> np.ndarray:
+    """x[k]：向后移动 k 根K线，前 k 个为 na（布尔序列为 False）"""
+    x = series(x, n)
+    k = int(k)
+    if k <= 0:
+        return x
+    out = np.zeros(n, dtype=bool) if x.dtype == bool else np.full(n, na)
+    out[k:] = x[:-k]
+    return out
+
+
+def nz(x, replacement=0.0):
+    if np.ndim(x) == 0:
+        return replacement if x != x else x
+    return np.where(np.isnan(x), replacement, x)
+
+
+def snz(x, replacement=0.0):
+    return replacement if x != x else x
+
+
+def is_na(x):
+    if np.ndim(x) == 0:
+        return x != x
+    return np.zeros(len(x), dtype=bool) if x.dtype == bool else np.isnan(x)
+
+
+def smax(a, b):
+    return na if a != a or b != b else (a if a >= b else b)
+
+
+def smin(a, b):
+    return na if a != a or b != b else (a if a <= b else b)
+
+
+def sdiv(a, b):
+    return a / b if b else na
+
+
+def smod(a, b):
+    return math.fmod(a, b) if b else na
+
+
+def _first_valid(x: np.ndarray) -> int:
+    valid = np.flatnonzero(~np.isnan(x))
+    return int(valid[0]) if len(valid) else len(x)
+
+
+def ta_sma(source, length) -> np.ndarray:
+    source = np.asarray(source, dtype=np.float64)
+    length = int(length)
+    out = np.full(len(source), na)
+    start = _first_valid(source)
+    out[start:] = rolling_mean(source[start:], length)
+    return out
+
+
+def _seeded_average(source, length, alpha: float) -> np.ndarray:
+    """ta.ema / ta.rma：以前 length 个值的 SMA 为初值的指数平均"""
+    source = np.asarray(source, dtype=np.float64)
+    length = int(length)
+    if length <= 1:
+        return source.copy()
+    out = np.full(len(source), na)
+    seed_at = _first_valid(source) + length - 1
+    if seed_at >= len(source):
+        return out
+    seed = source[seed_at - length + 1:seed_at + 1].mean()
+    out[seed_at:] = _decay_filter(np.concatenate(([seed], alpha * source[seed_at + 1:])), 1.0 - alpha)
+    return out
+
+
+def ta_ema(source, length) -> np.ndarray:
+    return _seeded_average(source, length, 2.0 / (int(length) + 1))
+
+
+def ta_rma(source, length) -> np.ndarray:
+    return _seeded_average(source, length, 1.0 / int(length))
+
+
+def ta_change(source, length=1) -> np.ndarray:
+    source = np.asarray(source, dtype=np.float64)
+    return source - shift(source, length, len(source))
+
+
+def ta_rsi(source, length) -> np.ndarray:
+    change = ta_change(source)
+    up = ta_rma(np.maximum(change, 0), length)
+    down = ta_rma(np.maximum(-change, 0), length)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = 100 - 100 / (1 + up / down)
+    out[down == 0] = 100
+    out[(up == 0) & (down != 0)] = 0
+    return out
+
+
+def ta_tr(high, low, close, handle_na=False) -> np.ndarray:
+    prev_close = shift(close, 1, len(close))
+    tr = np.maximum(np.maximum(high - low, np.abs(high - prev_close)), np.abs(low - prev_close))
+    if len(tr):
+        tr[0] = high[0] - low[0] if handle_na else na
+    return tr
+
+
+def ta_atr(high, low, close, length) -> np.ndarray:
+    return ta_rma(ta_tr(high, low, close, True), length)
+
+
+def ta_stdev(source, length) -> np.ndarray:
+    source = np.asarray(source, dtype=np.float64)
+    mean = ta_sma(source, length)
+    return np.sqrt(np.maximum(ta_sma(source * source, length) - mean * mean, 0))
+
+
+def _rolling_extreme(source, length, reducer) -> np.ndarray:
+    source = np.asarray(source, dtype=np.float64)
+    length = int(length)
+    out = np.full(len(source), na)
+    if len(source) >= length:
+        out[length - 1:] = reducer(np.lib.stride_tricks.sliding_window_view(source, length), axis=1)
+    return out
+
+
+def ta_highest(source, length) -> np.ndarray:
+    return _rolling_extreme(source, length, np.max)
+
+
+def ta_lowest(source, length) -> np.ndarray:
+    return _rolling_extreme(source, length, np.min)
+
+
+def ta_crossover(a, b, n: int) -> np.ndarray:
+    a, b = series(a, n), series(b, n)
+    return (a > b) & (shift(a, 1, n) <= shift(b, 1, n))
+
+
+def ta_crossunder(a, b, n: int) -> np.ndarray:
+    a, b = series(a, n), series(b, n)
+    return (a < b) & (shift(a, 1, n) >= shift(b, 1, n))
+
+
+def prepare_ohlcv(data: dict):
+    """data 为 open/high/low/close/volume 数组，或 OKX 原始K线 data["candles"]（任意顺序，统一转为从旧到新）"""
+    if "close" in data:
+        return tuple(np.asarray(data[k], dtype=np.float64) for k in ("open", "high", "low", "close", "volume"))
+    candles = data["candles"]
+    if len(candles) > 1 and float(candles[0][0]) > float(candles[-1][0]):
+        candles = candles[::-1]
+    ohlcv = np.fromiter((float(x) for c in candles for x in c[1:6]), np.float64, 5 * len(candles)).reshape(-1, 5)
+    return tuple(ohlcv[:, k] for k in range(5))
+
+
+def empty_signals(n: int) -> dict:
+    return {name: np.zeros(n, dtype=bool) for name in ("long_entry", "short_entry", "long_exit", "short_exit")}
+
+
+def last_signal(result: dict):
+    """最后一根K线的信号："buy"、"sell"、"close" 或 None"""
+    if not len(result["long_entry"]):
+        return None
+    if result["long_entry"][-1]:
+        return "buy"
+    if result["short_entry"][-1]:
+        return "sell"
+    if result["long_exit"][-1] or result["short_exit"][-1]:
+        return "close"
+    return None
+
+
+# ============ 词法和语法分析 ============
+
+_TOKEN_RE = re.compile(r"""
+    (?P<space>[ \t]+)
+  | (?P<comment>//.*)
+  | (?P<num>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+  | (?P<str>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<color>\#[0-9A-Fa-f]{6,8})
+  | (?P<name>[A-Za-z_][A-Za-z_0-9]*(?:\.[A-Za-z_][A-Za-z_0-9]*)*)
+  | (?P<op>:=|==|!=|<=|>=|=>|\+=|-=|\*=|/=|[-+*/%<>=?:()\[\],])
+""", re.X)
+_TYPE_WORDS = {"int", "float", "bool", "string", "color", "series", "simple", "const"}
+_UNSUPPORTED_WORDS = {"for", "while", "switch", "import", "export", "type", "method"}
+
+
+def _tokenize(text: str, line: int) -> list:
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if match is None:
+            raise PineSyntaxError(f"无法识别的字符 {text[pos]!r}", line)
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == "comment":
+            break
+        if kind != "space":
+            tokens.append((kind, match.group(), line))
+    return tokens
+
+
+def _logical_lines(script: str) -> list:
+    """按缩进切分逻辑行：括号未闭合或缩进不是 4 的倍数的行视为上一行的续行，返回 [行号, 缩进层级, tokens]"""
+    lines = []
+    depth = 0
+    for number, raw in enumerate(script.split("\n"), 1):
+        text = raw.expandtabs(4).rstrip()
+        tokens = _tokenize(text, number)
+        if not tokens:
+            continue
+        indent = len(text) - len(text.lstrip())
+        if depth > 0 or (lines and indent % 4 != 0):
+            lines[-1][2].extend(tokens)
+        else:
+            lines.append([number, indent // 4, tokens])
+        for kind, value, _ in tokens:
+            if kind == "op" and value in "([":
+                depth += 1
+            elif kind == "op" and value in ")]":
+                depth = max(depth - 1, 0)
+    return lines
+
+
+class _Parser:
+    """单个逻辑行的表达式解析器（递归下降），表达式用元组表示"""
+
+    _BINARY_LEVELS = [("or",), ("and",), ("==", "!="), ("<", ">", "<=", ">="), ("+", "-"), ("*", "/", "%")]
+
+    def __init__(self, tokens: list, line: int):
+        self.tokens = tokens
+        self.line = line
+        self.pos = 0
+
+    def peek(self, offset: int = 0):
+        index = self.pos + offset
+        return self.tokens[index][1] if index < len(self.tokens) else None
+
+    def peek_kind(self, offset: int = 0):
+        index = self.pos + offset
+        return self.tokens[index][0] if index < len(self.tokens) else None
+
+    def next(self):
+        if self.pos >= len(self.tokens):
+            raise PineSyntaxError("语句不完整", self.line)
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, value: str):
+        token = self.next()
+        if token[1] != value:
+            raise PineSyntaxError(f"应为 {value!r}，实际为 {token[1]!r}", self.line)
+        return token
+
+    def done(self) -> bool:
+        return self.pos >= len(self.tokens)
+
+    def finish(self):
+        if not self.done():
+            raise PineSyntaxError(f"多余的内容 {self.peek()!r}", self.line)
+
+    def expression(self):
+        cond = self.binary(0)
+        if self.peek() == "?":
+            self.next()
+            when_true = self.expression()
+            self.expect(":")
+            return ("cond", cond, when_true, self.expression())
+        return cond
+
+    def binary(self, level: int):
+        if level == len(self._BINARY_LEVELS):
+            return self.unary()
+        left = self.binary(level + 1)
+        while self.peek() in self._BINARY_LEVELS[level] and self.peek_kind() in ("op", "name"):
+            op = self.next()[1]
+            left = ("bin", op, left, self.binary(level + 1))
+        return left
+
+    def unary(self):
+        if self.peek() in ("-", "+", "not") and self.peek_kind() in ("op", "name"):
+            op = self.next()[1]
+            operand = self.unary()
+            return operand if op == "+" else ("un", op, operand)
+        return self.postfix()
+
+    def postfix(self):
+        node = self.primary()
+        while self.peek() == "[":
+            self.next()
+            offset = self.expression()
+            self.expect("]")
+            node = ("hist", node, offset)
+        return node
+
+    def primary(self):
+        kind, value, _ = self.next()
+        if kind == "num":
+            return ("num", float(value) if any(c in value for c in ".eE") else int(value))
+        if kind == "str":
+            return ("str", value[1:-1])
+        if kind == "color":
+            return ("color", value)
+        if kind == "op" and value == "(":
+            node = self.expression()
+            self.expect(")")
+            return node
+        if kind == "op" and value == "[":
+            items = []
+            while self.peek() != "]":
+                items.append(self.expression())
+                if self.peek() == ",":
+                    self.next()
+            self.expect("]")
+            return ("list", items)
+        if kind != "name":
+            raise PineSyntaxError(f"意外的符号 {value!r}", self.line)
+        if value in ("true", "false"):
+            return ("bool", value == "true")
+        if self.peek() == "(":
+            return self.call(value)
+        if value == "na":
+            return ("na",)
+        return ("name", value)
+
+    def call(self, name: str):
+        self.expect("(")
+        args, kwargs = [], {}
+        while self.peek() != ")":
+            if self.peek_kind() == "name" and self.peek(1) == "=":
+                key = self.next()[1]
+                self.next()
+                kwargs[key] = self.expression()
+            else:
+                args.append(self.expression())
+            if self.peek() == ",":
+                self.next()
+            elif self.peek() != ")":
+                raise PineSyntaxError(f"函数参数之间应为 ','，实际为 {self.peek()!r}", self.line)
+        self.expect(")")
+        return ("call", name, args, kwargs)
+
+
+def _parse_statement(tokens: list, line: int):
+    parser = _Parser(tokens, line)
+    first = parser.peek()
+    if first in _UNSUPPORTED_WORDS:
+        raise PineSyntaxError(f"暂不支持 {first} 语句", line)
+    if any(value == "=>" for _, value, _ in tokens):
+        raise PineSyntaxError("暂不支持自定义函数", line)
+    if first == "[" and any(value == "=" for _, value, _ in tokens):
+        raise PineSyntaxError("暂不支持元组赋值", line)
+    is_var = False
+    if first in ("var", "varip"):
+        parser.next()
+        is_var = True
+    # 跳过类型声明：float x = ...
+    while parser.peek() in _TYPE_WORDS and parser.peek_kind(1) == "name":
+        parser.next()
+    if parser.peek_kind() == "name" and parser.peek(1) in ("=", ":=", "+=", "-=", "*=", "/="):
+        name = parser.next()[1]
+        op = parser.next()[1]
+        value = parser.expression()
+        parser.finish()
+        if op == "=":
+            return ("decl", name, value, is_var, line)
+        if is_var:
+            raise PineSyntaxError("var 声明只能使用 =", line)
+        if op != ":=":
+            value = ("bin", op[0], ("name", name), value)
+        return ("assign", name, value, line)
+    if is_var:
+        raise PineSyntaxError("var 后应为变量声明", line)
+    value = parser.expression()
+    parser.finish()
+    return ("expr", value, line)
+
+
+def parse_pine(script: str) -> list:
+    """解析 Pine v5 子集，返回语句列表（if 语句包含分支和 else 块）"""
+    lines = _logical_lines(script)
+
+    def block(index: int, level: int):
+        statements = []
+        while index < len(lines):
+            line, indent, tokens = lines[index]
+            if indent < level:
+                break
+            if indent > level:
+                raise PineSyntaxError("缩进错误", line)
+            if tokens[0][1] == "else":
+                raise PineSyntaxError("else 没有对应的 if", line)
+            if tokens[0][1] != "if":
+                statements.append(_parse_statement(tokens, line))
+                index += 1
+                continue
+            branches = []
+            else_body = []
+            cond_tokens = tokens[1:]
+            while True:
+                parser = _Parser(cond_tokens, line)
+                cond = parser.expression()
+                parser.finish()
+                body, index = block(index + 1, level + 1)
+                if not body:
+                    raise PineSyntaxError("if 语句缺少代码块", line)
+                branches.append((cond, body))
+                if index >= len(lines) or lines[index][1] != level or lines[index][2][0][1] != "else":
+                    break
+                line, _, tokens = lines[index]
+                if len(tokens) > 1 and tokens[1][1] == "if":
+                    cond_tokens = tokens[2:]
+                    continue
+                if len(tokens) > 1:
+                    raise PineSyntaxError("else 后应换行", line)
+                else_body, index = block(index + 1, level + 1)
+                break
+            statements.append(("if", branches, else_body, line))
+        return statements, index
+
+    statements, _ = block(0, 0)
+    return statements
+
+
+# ============ 代码生成 ============
+
+_PRICE_SERIES = {
+    "open": "b_open", "high": "b_high", "low": "b_low", "close": "b_close", "volume": "b_volume",
+    "hl2": "b_hl2", "hlc3": "b_hlc3", "ohlc4": "b_ohlc4", "hlcc4": "b_hlcc4", "bar_index": "b_bar_index",
+}
+_DERIVED_SERIES = {
+    "b_hl2": "(b_high + b_low) / 2",
+    "b_hlc3": "(b_high + b_low + b_close) / 3",
+    "b_ohlc4": "(b_open + b_high + b_low + b_close) / 4",
+    "b_hlcc4": "(b_high + b_low + 2 * b_close) / 4",
+    "b_bar_index": "np.arange(n, dtype=np.float64)",
+}
+# 参数表：(参数名, 默认值)，None 表示必填
+_TA_SIGNATURES = {
+    "ta.sma": (("source", None), ("length", None)),
+    "ta.ema": (("source", None), ("length", None)),
+    "ta.rma": (("source", None), ("length", None)),
+    "ta.rsi": (("source", None), ("length", None)),
+    "ta.stdev": (("source", None), ("length", None)),
+    "ta.change": (("source", None), ("length", ("num", 1))),
+    "ta.highest": (("source", None), ("length", None)),
+    "ta.lowest": (("source", None), ("length", None)),
+    "ta.atr": (("length", None),),
+    "ta.tr": (("handle_na", ("bool", False)),),
+    "ta.crossover": (("source1", None), ("source2", None)),
+    "ta.crossunder": (("source1", None), ("source2", None)),
+}
+_MATH_FUNCTIONS = {"math.abs": "np.abs", "math.sqrt": "np.sqrt", "math.log": "np.log", "math.log10": "np.log10",
+                   "math.exp": "np.exp", "math.sign": "np.sign", "math.round": "np.round", "math.pow": "np.power"}
+# v4 写法的函数名
+_ALIASES = {"sma": "ta.sma", "ema": "ta.ema", "rma": "ta.rma", "rsi": "ta.rsi", "stdev": "ta.stdev", "change": "ta.change",
+            "highest": "ta.highest", "lowest": "ta.lowest", "atr": "ta.atr", "tr": "ta.tr", "crossover": "ta.crossover",
+            "crossunder": "ta.crossunder", "max": "math.max", "min": "math.min", "abs": "math.abs", "sqrt": "math.sqrt",
+            "log": "math.log", "exp": "math.exp", "pow": "math.pow", "round": "math.round", "sign": "math.sign"}
+_IGNORED_CALLS = {"plot", "plotshape", "plotchar", "plotcandle", "plotbar", "plotarrow", "fill", "hline", "bgcolor",
+                  "barcolor", "alertcondition", "alert", "indicator", "strategy", "study", "max_bars_back"}
+_IGNORED_PREFIXES = ("label.", "line.", "box.", "table.", "log.", "runtime.", "linefill.", "polyline.")
+_COMPARISONS = ("==", "!=", "<", ">", "<=", ">=")
+
+
+def _call_name(node) -> str:
+    return _ALIASES.get(node[1], node[1]) if node[0] == "call" else None
+
+
+def _is_ignored_call(node) -> bool:
+    name = _call_name(node)
+    return name is not None and (name in _IGNORED_CALLS or name.startswith(_IGNORED_PREFIXES))
+
+
+def _is_input_call(node) -> bool:
+    name = _call_name(node)
+    return name is not None and (name == "input" or name.startswith("input."))
+
+
+def _and_all(parts: list):
+    parts = [p for p in parts if p is not None]
+    if not parts:
+        return None
+    node = parts[0]
+    for part in parts[1:]:
+        node = ("bin", "and", node, part)
+    return node
+
+
+class _Compiler:
+    """把解析后的语句编译成在整段数组上运行的 Python 代码
+
+    没有递推关系的序列直接生成 NumPy 数组运算；var 变量、依赖自身历史值（如 up[1]）的变量
+    以及依赖它们的变量，在同一个逐根K线循环中按原顺序计算，其余序列先算好再在循环中按下标读取。
+    """
+
+    def __init__(self, statements: list):
+        self.ops = []
+        self.inputs = {}  # 输入参数 -> 默认值
+        self.ignored = set()  # 只用于绘图的变量
+        self.declared = set()
+        self.entry_directions = {}
+        self.temp_count = 0
+        self._flatten(statements, None)
+        self.by_name = {}
+        for index, op in enumerate(self.ops):
+            op["index"] = index
+            if op["kind"] == "assign":
+                self.by_name.setdefault(op["name"], []).append(op)
+        self.is_bool = {}
+        for name, ops in self.by_name.items():
+            self.is_bool[name] = self._expr_is_bool(ops[0]["expr"]) if "input" not in ops[0] else isinstance(ops[0]["input"], bool)
+        self.recurrent, self.dependent = self._recurrent_names()
+        self.kinds = self._infer_kinds()
+        self.hoisted = {}
+        self.used_series = set()
+
+    # ---------- 展开 if：每条赋值带上守卫条件 ----------
+
+    def _temp(self, expr, line: int) -> str:
+        self.temp_count += 1
+        name = f"@{self.temp_count}"
+        self._check_refs(expr, line)
+        self.declared.add(name)
+        self.ops.append({"kind": "assign", "name": name, "expr": expr, "guard": None, "var": False, "line": line})
+        return name
+
+    def _flatten(self, statements: list, guard):
+        for stmt in statements:
+            kind, line = stmt[0], stmt[-1]
+            if kind == "decl":
+                self._assign(stmt[1], stmt[2], guard, True, stmt[3], line)
+            elif kind == "assign":
+                self._assign(stmt[1], stmt[2], guard, False, False, line)
+            elif kind == "expr":
+                self._statement_call(stmt[1], guard, line)
+            else:
+                _, branches, else_body, _ = stmt
+                taken = []
+                for cond, body in branches:
+                    raw = self._temp(cond, line)
+                    parts = [("name", guard) if guard else None] + [("un", "not", ("name", t)) for t in taken]
+                    branch_guard = self._temp(_and_all(parts + [("name", raw)]), line)
+                    self._flatten(body, branch_guard)
+                    taken.append(raw)
+                if else_body:
+                    parts = [("name", guard) if guard else None] + [("un", "not", ("name", t)) for t in taken]
+                    self._flatten(else_body, self._temp(_and_all(parts), line))
+
+    def _assign(self, name: str, expr, guard, is_decl: bool, is_var: bool, line: int):
+        if name in _PRICE_SERIES or "." in name:
+            raise PineSyntaxError(f"不能给内置变量 {name} 赋值", line)
+        if is_decl and _is_ignored_call(expr):
+            self.ignored.add(name)
+            return
+        if not is_decl and name not in self.declared:
+            raise PineSyntaxError(f"变量 {name} 未声明就使用 :=", line)
+        op = {"kind": "assign", "name": name, "expr": expr, "guard": guard, "var": is_var, "line": line}
+        if _is_input_call(expr):
+            default = expr[3].get("defval", expr[2][0] if expr[2] else None)
+            if default is None:
+                raise PineSyntaxError("input 缺少默认值", line)
+            if default[0] in ("num", "bool", "str") and is_decl and guard is None and not is_var:
+                op["input"] = default[1]
+                self.inputs[name] = default[1]
+            op["expr"] = default
+        self._check_refs(op["expr"], line)
+        self.declared.add(name)
+        self.ops.append(op)
+
+    def _statement_call(self, expr, guard, line: int):
+        name = _call_name(expr)
+        if name is None:
+            raise PineSyntaxError("表达式语句只能是函数调用", line)
+        if _is_ignored_call(expr):
+            return
+        _, _, args, kwargs = expr
+        if "when" in kwargs:
+            self._check_refs(kwargs["when"], line)
+            guard = self._temp(_and_all([("name", guard) if guard else None, kwargs["when"]]), line)
+        if name == "strategy.entry":
+            direction = kwargs.get("direction", args[1] if len(args) > 1 else None)
+            if not args or args[0][0] != "str" or direction not in (("name", "strategy.long"), ("name", "strategy.short")):
+                raise PineSyntaxError("strategy.entry 需要字符串 id 和 strategy.long / strategy.short", line)
+            side = direction[1].split(".")[1]
+            self.entry_directions.setdefault(args[0][1], side)
+            self.ops.append({"kind": "event", "action": "entry", "side": side, "guard": guard, "line": line})
+        elif name == "strategy.close":
+            if not args or args[0][0] != "str":
+                raise PineSyntaxError("strategy.close 需要字符串 id", line)
+            self.ops.append({"kind": "event", "action": "close", "id": args[0][1], "guard": guard, "line": line})
+        elif name == "strategy.close_all":
+            self.ops.append({"kind": "event", "action": "close_all", "guard": guard, "line": line})
+        else:
+            raise PineSyntaxError(f"不支持的函数调用 {name}", line)
+
+    def _check_refs(self, expr, line: int):
+        for name, _ in self._refs(expr):
+            if name in self.ignored:
+                raise PineSyntaxError(f"绘图变量 {name} 不能参与计算", line)
+            if name not in self.declared:
+                raise PineSyntaxError(f"未定义的变量 {name}", line)
+
+    # ---------- 分析 ----------
+
+    def _refs(self, expr, history: bool = False):
+        """表达式引用的用户变量：(变量名, 是否读取历史值)"""
+        kind = expr[0]
+        if kind == "name":
+            name = expr[1]
+            if name in _PRICE_SERIES or name in ("ta.tr", "strategy.long", "strategy.short"):
+                return
+            if "." in name:
+                raise PineSyntaxError(f"不支持的内置变量 {name}")
+            yield name, history
+        elif kind == "hist":
+            yield from self._refs(expr[1], True)
+            yield from self._refs(expr[2], history)
+        elif kind == "call":
+            windowed = _call_name(expr).startswith("ta.")
+            for arg in list(expr[2]) + list(expr[3].values()):
+                yield from self._refs(arg, history or windowed)
+        elif kind == "bin":
+            yield from self._refs(expr[2], history)
+            yield from self._refs(expr[3], history)
+        elif kind == "un":
+            yield from self._refs(expr[2], history)
+        elif kind == "cond":
+            for part in expr[1:]:
+                yield from self._refs(part, history)
+        elif kind == "list":
+            for item in expr[1]:
+                yield from self._refs(item, history)
+
+    def _op_refs(self, op):
+        refs = list(self._refs(op["expr"])) if op["kind"] == "assign" else []
+        if op["guard"]:
+            refs.append((op["guard"], False))
+        return refs
+
+    def _recurrent_names(self):
+        """返回 (需要逐根K线递推的变量, 依赖递推结果、可在循环之后向量化计算的变量)"""
+        reads = {name: set() for name in self.by_name}
+        history_refs = set()
+        for op in self.ops:
+            for ref, history in self._op_refs(op):
+                if history:
+                    history_refs.add(ref)
+                if op["kind"] == "assign":
+                    reads[op["name"]].add((ref, history))
+
+        def upstream(names) -> set:
+            seen, stack = set(), list(names)
+            while stack:
+                name = stack.pop()
+                if name not in seen:
+                    seen.add(name)
+                    stack.extend(ref for ref, _ in reads.get(name, ()))
+            return seen
+
+        def downstream(names) -> set:
+            found = set(names)
+            changed = True
+            while changed:
+                changed = False
+                for name, refs in reads.items():
+                    if name not in found and any(ref in found for ref, _ in refs):
+                        found.add(name)
+                        changed = True
+            return found - set(names)
+
+        multi = {name for name, ops in self.by_name.items() if len(ops) > 1}
+        last_assign = {name: ops[-1]["index"] for name, ops in self.by_name.items()}
+        recurrent = {name for name, ops in self.by_name.items() if any(op["var"] for op in ops)}
+        recurrent |= multi & history_refs
+        for name, refs in reads.items():
+            if any(history and name in upstream([ref]) for ref, history in refs):
+                recurrent.add(name)
+        while True:
+            read_by_recurrent = {ref for name in recurrent for ref, _ in reads[name]}
+            on_cycle = upstream(read_by_recurrent)
+            dependent = downstream(recurrent)
+            added = set()
+            for name in self.by_name:
+                if name in recurrent:
+                    continue
+                if name in dependent and name in on_cycle:
+                    added.add(name)  # 与递推变量互相依赖
+                elif name in multi and name in read_by_recurrent:
+                    added.add(name)  # 循环中读取的必须是赋值当时的值
+                elif name in dependent and any(
+                        not history and ref in multi and last_assign[ref] > op["index"]
+                        for op in self.by_name[name] for ref, history in self._op_refs(op)):
+                    added.add(name)  # 循环之后只能读到多次赋值变量的最终值
+            if not added:
+                return recurrent, dependent
+            recurrent |= added
+
+    def _infer_kinds(self) -> dict:
+        kinds = {name: "series" if name in self.recurrent else "scalar" for name in self.by_name}
+        changed = True
+        while changed:
+            changed = False
+            for op in self.ops:
+                if op["kind"] != "assign" or kinds[op["name"]] == "series":
+                    continue
+                if op["guard"] or op["var"] or self._expr_kind(op["expr"], kinds) == "series":
+                    kinds[op["name"]] = "series"
+                    changed = True
+        return kinds
+
+    def _expr_kind(self, expr, kinds=None) -> str:
+        kinds = self.kinds if kinds is None else kinds
+        kind = expr[0]
+        if kind == "name":
+            name = expr[1]
+            if name in _PRICE_SERIES or name == "ta.tr":
+                return "series"
+            return kinds.get(name, "scalar")
+        if kind == "call":
+            name = _call_name(expr)
+            if name.startswith("ta."):
+                return "series"
+            parts = list(expr[2]) + list(expr[3].values())
+        elif kind in ("hist", "un"):
+            parts = [expr[1]] if kind == "hist" else [expr[2]]
+        elif kind == "bin":
+            parts = [expr[2], expr[3]]
+        elif kind == "cond":
+            parts = list(expr[1:])
+        else:
+            return "scalar"
+        return "series" if any(self._expr_kind(p, kinds) == "series" for p in parts) else "scalar"
+
+    def _expr_is_bool(self, expr) -> bool:
+        kind = expr[0]
+        if kind == "bool":
+            return True
+        if kind == "bin":
+            return expr[1] in _COMPARISONS or expr[1] in ("and", "or")
+        if kind == "un":
+            return expr[1] == "not"
+        if kind == "name":
+            return self.is_bool.get(expr[1], False)
+        if kind == "hist":
+            return self._expr_is_bool(expr[1])
+        if kind == "cond":
+            return self._expr_is_bool(expr[2]) and self._expr_is_bool(expr[3])
+        if kind == "call":
+            name = _call_name(expr)
+            if name in ("ta.crossover", "ta.crossunder", "na"):
+                return True
+            if name == "nz" and expr[2]:
+                return self._expr_is_bool(expr[2][0])
+        return False
+
+    def _reads_recurrent(self, expr) -> bool:
+        return any(name in self.recurrent for name, _ in self._refs(expr))
+
+    # ---------- 表达式 ----------
+
+    @staticmethod
+    def _var(name: str) -> str:
+        return f"t_{name[1:]}" if name.startswith("@") else f"v_{name}"
+
+    def _bind(self, name: str, args: list, kwargs: dict, line: int) -> list:
+        values = []
+        for index, (param, default) in enumerate(_TA_SIGNATURES[name]):
+            value = args[index] if index < len(args) else kwargs.get(param, default)
+            if value is None:
+                raise PineSyntaxError(f"{name} 缺少参数 {param}", line)
+            values.append(value)
+        return values
+
+    def _price(self, name: str) -> str:
+        py = _PRICE_SERIES[name]
+        self.used_series.add(py)
+        return py
+
+    def vector(self, expr, line: int) -> str:
+        """整段数组的表达式代码"""
+        kind = expr[0]
+        if kind == "num":
+            return repr(expr[1])
+        if kind == "str":
+            return repr(expr[1])
+        if kind == "bool":
+            return repr(expr[1])
+        if kind == "na":
+            return "na"
+        if kind == "name":
+            name = expr[1]
+            if name in _PRICE_SERIES:
+                return self._price(name)
+            if name == "ta.tr":
+                return f"rt.ta_tr({self._price('high')}, {self._price('low')}, {self._price('close')})"
+            return self._var(name)
+        if kind == "hist":
+            return f"rt.shift({self.vector(expr[1], line)}, {self.vector(expr[2], line)}, n)"
+        if kind == "bin":
+            op, left, right = expr[1], self.vector(expr[2], line), self.vector(expr[3], line)
+            if op == "and":
+                return f"np.logical_and({left}, {right})"
+            if op == "or":
+                return f"np.logical_or({left}, {right})"
+            if op == "%":
+                return f"np.fmod({left}, {right})"
+            return f"({left} {op} {right})"
+        if kind == "un":
+            operand = self.vector(expr[2], line)
+            return f"np.logical_not({operand})" if expr[1] == "not" else f"(-{operand})"
+        if kind == "cond":
+            cond, when_true, when_false = (self.vector(part, line) for part in expr[1:])
+            if self._expr_kind(expr) == "scalar":
+                return f"({when_true} if {cond} else {when_false})"
+            return f"np.where({cond}, {when_true}, {when_false})"
+        if kind == "call":
+            return self._vector_call(expr, line)
+        raise PineSyntaxError(f"不支持的表达式 {kind}", line)
+
+    def _vector_call(self, expr, line: int) -> str:
+        name, args, kwargs = _call_name(expr), expr[2], expr[3]
+        if _is_input_call(expr):
+            default = kwargs.get("defval", args[0] if args else None)
+            if default is None:
+                raise PineSyntaxError("input 缺少默认值", line)
+            return self.vector(default, line)
+        if name in ("ta.highest", "ta.lowest") and len(args) == 1 and "length" not in kwargs:
+            args = [("name", "high" if name == "ta.highest" else "low")] + list(args)
+        if name in _TA_SIGNATURES:
+            values = self._bind(name, args, kwargs, line)
+            hlc = f"{self._price('high')}, {self._price('low')}, {self._price('close')}" if name in ("ta.atr", "ta.tr") else ""
+            if name == "ta.atr":
+                return f"rt.ta_atr({hlc}, {self.vector(values[0], line)})"
+            if name == "ta.tr":
+                return f"rt.ta_tr({hlc}, {self.vector(values[0], line)})"
+            if name in ("ta.crossover", "ta.crossunder"):
+                return f"rt.{name.replace('.', '_')}({self.vector(values[0], line)}, {self.vector(values[1], line)}, n)"
+            source = f"rt.series({self.vector(values[0], line)}, n)"
+            return f"rt.{name.replace('.', '_')}({source}, {self.vector(values[1], line)})"
+        if name.startswith("ta."):
+            raise PineSyntaxError(f"不支持的函数 {name}", line)
+        codes = [self.vector(arg, line) for arg in args]
+        if name == "nz":
+            return f"rt.nz({', '.join(codes)})"
+        if name == "na":
+            return f"rt.is_na({codes[0]})"
+        if name == "iff":
+            return self.vector(("cond",) + tuple(args), line)
+        if name in ("math.max", "math.min") and len(codes) >= 2:
+            func = "np.maximum" if name == "math.max" else "np.minimum"
+            code = codes[0]
+            for other in codes[1:]:
+                code = f"{func}({code}, {other})"
+            return code
+        if name in _MATH_FUNCTIONS:
+            return f"{_MATH_FUNCTIONS[name]}({', '.join(codes)})"
+        if name in ("float", "int") and len(codes) == 1:
+            return codes[0] if name == "float" else f"np.trunc({codes[0]})"
+        raise PineSyntaxError(f"不支持的函数 {name}", line)
+
+    def _hoist(self, expr, line: int) -> str:
+        code = self.vector(expr, line)
+        if code not in self.hoisted:
+            self.hoisted[code] = f"h_{len(self.hoisted) + 1}"
+        return self.hoisted[code]
+
+    def scalar(self, expr, line: int) -> str:
+        """逐根K线循环中的表达式代码（下标 i）"""
+        if not self._reads_recurrent(expr):
+            if self._expr_kind(expr) == "scalar":
+                return self.vector(expr, line)
+            return f"{self._hoist(expr, line)}[i]"
+        kind = expr[0]
+        if kind == "name":
+            return f"{self._var(expr[1])}[i]"
+        if kind == "hist":
+            inner, offset = expr[1], expr[2]
+            if inner[0] != "name" or self._reads_recurrent(offset):
+                raise PineSyntaxError("递推变量的历史引用只支持 变量名[常量]", line)
+            var = self._var(inner[1])
+            empty = "False" if self.is_bool.get(inner[1]) else "na"
+            k = self.vector(offset, line)
+            if offset[0] == "num":
+                return f"({var}[i - {k}] if i >= {k} else {empty})"
+            return f"({var}[i - int({k})] if i >= {k} else {empty})"
+        if kind == "bin":
+            op, left, right = expr[1], self.scalar(expr[2], line), self.scalar(expr[3], line)
+            if op == "/":
+                return f"sdiv({left}, {right})"
+            if op == "%":
+                return f"smod({left}, {right})"
+            return f"({left} {op} {right})"
+        if kind == "un":
+            operand = self.scalar(expr[2], line)
+            return f"(not {operand})" if expr[1] == "not" else f"(-{operand})"
+        if kind == "cond":
+            cond, when_true, when_false = (self.scalar(part, line) for part in expr[1:])
+            return f"({when_true} if {cond} else {when_false})"
+        name, args = _call_name(expr), expr[2]
+        if name.startswith("ta."):
+            raise PineSyntaxError(f"{name} 的参数不能依赖递推变量", line)
+        codes = [self.scalar(arg, line) for arg in args]
+        if name == "nz":
+            return f"snz({', '.join(codes)})"
+        if name == "na":
+            return f"({codes[0]} != {codes[0]})"
+        if name == "iff":
+            return self.scalar(("cond",) + tuple(args), line)
+        if name in ("math.max", "math.min") and len(codes) >= 2:
+            func = "smax" if name == "math.max" else "smin"
+            code = codes[0]
+            for other in codes[1:]:
+                code = f"{func}({code}, {other})"
+            return code
+        if name == "math.abs":
+            return f"abs({codes[0]})"
+        if name in _MATH_FUNCTIONS:
+            return f"float({_MATH_FUNCTIONS[name]}({', '.join(codes)}))"
+        if name in ("float", "int") and len(codes) == 1:
+            return codes[0] if name == "float" else f"float(np.trunc({codes[0]}))"
+        raise PineSyntaxError(f"不支持的函数 {name}", line)
+
+    # ---------- 语句 ----------
+
+    def generate(self, script_hash: str) -> str:
+        pre, loop, post, events = [], [], [], []
+        assigned = set()
+        for op in self.ops:
+            if op["kind"] == "event":
+                events.append(op)
+                continue
+            name, line = op["name"], op["line"]
+            var = self._var(name)
+            if name in self.recurrent:
+                value = self.scalar(op["expr"], line)
+                if op["var"]:
+                    loop.append(f"{var}[i] = {value} if i == 0 else {var}[i - 1]")
+                elif op["guard"]:
+                    loop.append(f"if {self.scalar(('name', op['guard']), line)}:")
+                    loop.append(f"    {var}[i] = {value}")
+                else:
+                    loop.append(f"{var}[i] = {value}")
+                continue
+            target = post if name in self.dependent else pre
+            if "input" in op:
+                target.append(f"{var} = inputs.get({name!r}, {op['input']!r})")
+            elif op["guard"]:
+                previous = var if name in assigned else ("False" if self.is_bool[name] else "na")
+                target.append(f"{var} = rt.series(np.where({self._var(op['guard'])}, {self.vector(op['expr'], line)}, {previous}), n)")
+            elif self.kinds[name] == "series":
+                target.append(f"{var} = rt.series({self.vector(op['expr'], line)}, n)")
+            else:
+                target.append(f"{var} = {self.vector(op['expr'], line)}")
+            assigned.add(name)
+
+        body = pre
+        if loop:
+            body.append("# === 递推部分：逐根K线计算 ===")
+            body += [f"{code} = rt.series({vector}, n).tolist()" for vector, code in self.hoisted.items()]
+            recurrent = [name for name in self.by_name if name in self.recurrent]
+            for name in recurrent:
+                body.append(f"{self._var(name)} = [{'False' if self.is_bool[name] else 'na'}] * n")
+            body.append("snz, smax, smin, sdiv, smod = rt.snz, rt.smax, rt.smin, rt.sdiv, rt.smod")
+            body.append("for i in range(n):")
+            body += ["    " + code for code in loop]
+            for name in recurrent:
+                dtype = "bool" if self.is_bool[name] else "np.float64"
+                body.append(f"{self._var(name)} = np.array({self._var(name)}, dtype={dtype})")
+        body += post
+        if events:
+            body.append("# === 交易信号 ===")
+        for op in events:
+            guard = f"rt.series({self._var(op['guard'])}, n)" if op["guard"] else "True"
+            if op["action"] == "entry":
+                targets = [f"{op['side']}_entry"]
+            elif op["action"] == "close":
+                if op["id"] not in self.entry_directions:
+                    raise PineSyntaxError(f"strategy.close 的 id {op['id']!r} 没有对应的 strategy.entry", op["line"])
+                targets = [f"{self.entry_directions[op['id']]}_exit"]
+            else:
+                targets = ["long_exit", "short_exit"]
+            for target in targets:
+                body.append(f"signals[{target!r}] |= {guard}")
+        outputs = ", ".join(f"{name!r}: {self._var(name)}" for name in self.by_name if not name.startswith("@"))
+
+        header = [
+            f"# 由 PineScriptConverter 生成（脚本 sha256: {script_hash}），请勿手动修改",
+            "import numpy as np",
+            "",
+            "import pine_converter as rt",
+            "",
+            "na = rt.na",
+            f"INPUTS = {self.inputs!r}",
+            "",
+            "",
+            "def run(data, **inputs):",
+            '    """在整段K线上计算，返回 long_entry / short_entry / long_exit / short_exit 布尔数组和各变量序列"""',
+            "    b_open, b_high, b_low, b_close, b_volume = rt.prepare_ohlcv(data)",
+            "    n = len(b_close)",
+            "    signals = rt.empty_signals(n)",
+        ]
+        header += [f"    {py} = {_DERIVED_SERIES[py]}" for py in sorted(self.used_series) if py in _DERIVED_SERIES]
+        footer = [
+            f"    signals['series'] = {{{outputs}}}",
+            "    return signals",
+            "",
+            "",
+            "def generate_signal(data):",
+            "    return rt.last_signal(run(data))",
+            "",
+        ]
+        return "\n".join(header + ['    with np.errstate(all="ignore"):'] + ["        " + code for code in body or ["pass"]] + footer)
+
+
+def generate_python(pine_script: str, script_hash: str = "") -> str:
+    return _Compiler(parse_pine(pine_script)).generate(script_hash)
+
+
+def script_hash(pine_script: str) -> str:
+    return hashlib.sha256(f"{CODEGEN_VERSION}\n{pine_script}".encode()).hexdigest()
+
+
+class PineStrategy:
+    """编译后的 Pine 策略：run 在整段K线数组上计算信号，generate_signal 返回最后一根K线的信号"""
+
+    def __init__(self, script_hash: str, source: str):
+        self.script_hash = script_hash
+        self.source = source
+        namespace = {}
+        exec(compile(source, f"<pine {script_hash[:12]}>", "exec"), namespace)
+        self.inputs = dict(namespace["INPUTS"])
+        self._run = namespace["run"]
+
+    def run(self, data: dict, **inputs) -> dict:
+        return self._run(data, **inputs)
+
+    def generate_signal(self, data: dict, **inputs):
+        return last_signal(self.run(data, **inputs))
+
+
+def _is_private(st) -> bool:
+    """文件或目录属于当前用户，且组和其他用户不可写"""
+    owner_ok = not hasattr(os, "getuid") or st.st_uid == os.getuid()
+    return owner_ok and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _private_cache_dir():
+    """创建（0700）并检查 PINE_CACHE_DIR，不是当前用户私有的真实目录时返回 None，只使用内存缓存"""
+    try:
+        os.makedirs(PINE_CACHE_DIR, mode=0o700, exist_ok=True)
+        st = os.lstat(PINE_CACHE_DIR)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or not _is_private(st):
+        return None
+    return PINE_CACHE_DIR
+
+
+def _read_cached(path: str):
+    """读取缓存的生成代码；不是当前用户私有的普通文件（如其他用户放入的文件、符号链接）时返回 None"""
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+    except OSError:
+        return None
+    with os.fdopen(fd, encoding="utf-8") as f:
+        st = os.fstat(f.fileno())
+        if not stat.S_ISREG(st.st_mode) or not _is_private(st):
+            return None
+        return f.read()
+
+
+def compile_pine(pine_script: str) -> PineStrategy:
+    """编译 Pine 脚本，按脚本哈希缓存（内存 + PINE_CACHE_DIR 下的生成代码），同一脚本只解析一次
+
+    缓存目录和文件必须属于当前用户且他人不可写，否则不读取，避免 exec 他人放入的代码。
+    """
+    key = script_hash(pine_script)
+    with _cache_lock:
+        strategy = _strategies.get(key)
+        if strategy is not None:
+            return strategy
+        cache_dir = _private_cache_dir()
+        path = os.path.join(cache_dir, f"{key}.py") if cache_dir else None
+        source = _read_cached(path) if path else None
+        if source is None:
+            source = generate_python(pine_script, key)
+            if path:
+                try:
+                    tmp_path = f"{path}.{os.getpid()}.tmp"
+                    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_NOFOLLOW", 0), 0o600)
+                    with os.fdopen(fd, "w", encoding="utf-8") as f:
+                        f.write(source)
+                    os.replace(tmp_path, path)
+                except OSError:
+                    pass  # 缓存目录不可写时只使用内存缓存
+        strategy = _strategies[key] = PineStrategy(key, source)
+        return strategy
+
+
+# 未提供脚本时输出的内置 SuperTrend（向量化 + 增量版本）
+SUPERTREND_TEMPLATE = [
+    'import numpy as np',
+    '',
+    '# === 参数 ===',
+    'Periods = 10',
+    'Multiplier = 3.0',
+    '',
+    '',
+    'def _ohlc(data):',
+    '    # 支持直接传入 high/low/close 数组，或 OKX 原始K线（任意顺序，统一转为从旧到新）',
+    '    if "close" in data:',
+    '        return tuple(np.asarray(data[k], dtype=float) for k in ("high", "low", "close"))',
+    '    candles = data["candles"]',
+    '    if len(candles) > 1 and float(candles[0][0]) > float(candles[-1][0]):',
+    '        candles = candles[::-1]',
+    '    hlc = np.fromiter((float(x) for c in candles for x in c[2:5]), float, 3 * len(candles)).reshape(-1, 3)',
+    '    return hlc[:, 0], hlc[:, 1], hlc[:, 2]',
+    '',
+    '',
+    'def supertrend(high, low, close, periods=Periods, multiplier=Multiplier):',
+    '    """整段计算 SuperTrend，返回 (up, dn, trend) 数组"""',
+    '    n = len(close)',
+    '    # === 计算 ATR（向量化） ===',
+    '    prev_close = np.concatenate(([np.nan], close[:-1]))',
+    '    tr = np.fmax(np.fmax(np.abs(high - low), np.abs(high - prev_close)), np.abs(low - prev_close))',
+    '    csum = np.concatenate(([0.0], np.cumsum(tr)))',
+    '    atr = np.full(n, np.nan)',
+    '    if n >= periods:',
+    '        atr[periods - 1:] = (csum[periods:] - csum[:-periods]) / periods',
+    '    src = (high + low) / 2',
+    '    up = (src - multiplier * atr).tolist()',
+    '    dn = (src + multiplier * atr).tolist()',
+    '    c = close.tolist()',
+    '    trend = [1] * n',
+    '    # === 轨道和趋势依赖上一根的结果，在纯 float 列表上递推 ===',
+    '    for i in range(1, n):',
+    '        up1 = up[i - 1] if up[i - 1] == up[i - 1] else up[i]',
+    '        dn1 = dn[i - 1] if dn[i - 1] == dn[i - 1] else dn[i]',
+    '        if c[i - 1] > up1 and up1 > up[i]:',
+    '            up[i] = up1',
+    '        if c[i - 1] < dn1 and dn1 < dn[i]:',
+    '            dn[i] = dn1',
+    '        t = trend[i - 1]',
+    '        if t == -1 and c[i] > dn1:',
+    '            t = 1',
+    '        elif t == 1 and c[i] < up1:',
+    '            t = -1',
+    '        trend[i] = t',
+    '    return np.array(up), np.array(dn), np.array(trend)',
+    '',
+    '',
+    'def generate_signal(data):',
+    '    high, low, close = _ohlc(data)',
+    '    trend = supertrend(high, low, close)[2]',
+    '    # === 信号输出 ===',
+    '    if len(trend) >= 2 and trend[-1] == 1 and trend[-2] == -1:',
+    '        return "buy"',
+    '    if len(trend) >= 2 and trend[-1] == -1 and trend[-2] == 1:',
+    '        return "sell"',
+    '    return None',
+    '',
+    '',
+    'class SuperTrendState:',
+    '    """增量 SuperTrend：每根收盘K线调用一次 update，O(1)，结果与 supertrend() 一致"""',
+    '',
+    '    def __init__(self, periods=Periods, multiplier=Multiplier):',
+    '        self.periods = periods',
+    '        self.multiplier = multiplier',
+    '        self.prev_close = None',
+    '        self.up = float("nan")',
+    '        self.dn = float("nan")',
+    '        self.trend = 1',
+    '        self._tr = []',
+    '',
+    '    def update(self, high, low, close):',
+    '        """返回该K线产生的信号："buy"、"sell" 或 None"""',
+    '        prev = self.prev_close',
+    '        tr = abs(high - low) if prev is None else max(abs(high - low), abs(high - prev), abs(low - prev))',
+    '        self._tr.append(tr)',
+    '        if len(self._tr) > self.periods:',
+    '            del self._tr[0]',
+    '        atr = sum(self._tr) / self.periods if len(self._tr) == self.periods else float("nan")',
+    '        src = (high + low) / 2',
+    '        up = src - self.multiplier * atr',
+    '        dn = src + self.multiplier * atr',
+    '        up1 = self.up if self.up == self.up else up',
+    '        dn1 = self.dn if self.dn == self.dn else dn',
+    '        trend = self.trend',
+    '        if prev is not None:',
+    '            if prev > up1 and up1 > up:',
+    '                up = up1',
+    '            if prev < dn1 and dn1 < dn:',
+    '                dn = dn1',
+    '            if trend == -1 and close > dn1:',
+    '                trend = 1',
+    '            elif trend == 1 and close < up1:',
+    '                trend = -1',
+    '        signal = None',
+    '        if trend == 1 and self.trend == -1:',
+    '            signal = "buy"',
+    '        elif trend == -1 and self.trend == 1:',
+    '            signal = "sell"',
+    '        self.prev_close, self.up, self.dn, self.trend = close, up, dn, trend',
+    '        return signal',
+    '',
+    '    def update_candle(self, candle):',
+    '        """candle 为 OKX 格式 [ts, o, h, l, c, ...]"""',
+    '        return self.update(float(candle[2]), float(candle[3]), float(candle[4]))',
+]
+
+
 class PineScriptConverter:
+    """Pine Script（v5 子集）转 Python：convert 返回生成的源码，compile 返回可直接运行的 PineStrategy
+
+    支持 input / input.*、ta.sma/ema/rma/rsi/atr/tr/stdev/change/highest/lowest/crossover/crossunder、
+    nz/na、math.*、var、历史引用 [n]、if / else if / else、三元表达式和 strategy.entry/close/close_all，
+    plot 等绘图语句会被忽略。脚本为空时返回内置的 SuperTrend 模板。
+    """
+
     def convert(self, pine_script: str) -> Tuple[bool, str, str]:
         try:
-            lines = pine_script.split('\n')
-            python_lines = [
-                'def generate_signal(data):',
-                '    import pandas as pd',
-                '    import numpy as np',
-                '    df = pd.DataFrame(data["candles"], columns=["ts","open","high","low","close","volume","volCcy","volCcyQuote","confirm"]).astype(float)',
-                '    close = df["close"]',
-                '    high = df["high"]',
-                '    low = df["low"]',
-                '    open = df["open"]',
-                '    hl2 = (high + low) / 2',
-                '    tr = pd.concat([',
-                '        (high - low).abs(),',
-                '        (high - close.shift(1).fillna(high)).abs(),',
-                '        (low - close.shift(1).fillna(low)).abs()',
-                '    ], axis=1).max(axis=1)',
-                '    # === 参数 ===',
-                '    Periods = 10',
-                '    Multiplier = 3.0',
-                '    changeATR = True',
-                '    src = hl2',
-                '    # === 计算 ATR ===',
-                '    atr = tr.rolling(Periods).mean()',
-                '    # === 初始化 ===',
-                '    up = src - Multiplier * atr',
-                '    dn = src + Multiplier * atr',
-                '    trend = pd.Series(0, index=df.index)',
-                '    up_final = pd.Series(np.nan, index=df.index)',
-                '    dn_final = pd.Series(np.nan, index=df.index)',
-                '    # === 逐行计算 ===',
-                '    for i in range(1, len(df)):',
-                '        # up',
-                '        up_curr = src.iloc[i] - Multiplier * atr.iloc[i]',
-                '        up_prev = up_final.iloc[i-1] if i > 0 else up_curr',
-                '        up_final.iloc[i] = up_curr if close.iloc[i-1] > up_prev else max(up_curr, up_prev)',
-                '        # dn',
-                '        dn_curr = src.iloc[i] + Multiplier * atr.iloc[i]',
-                '        dn_prev = dn_final.iloc[i-1] if i > 0 else dn_curr',
-                '        dn_final.iloc[i] = dn_curr if close.iloc[i-1] < dn_prev else min(dn_curr, dn_prev)',
-                '        # trend',
-                '        if i == 0:',
-                '            trend.iloc[i] = 1',
-                '        else:',
-                '            prev_trend = trend.iloc[i-1]',
-                '            if prev_trend == 1 and close.iloc[i] < up_final.iloc[i-1]:',
-                '                trend.iloc[i] = -1',
-                '            elif prev_trend == -1 and close.iloc[i] > dn_final.iloc[i-1]:',
-                '                trend.iloc[i] = 1',
-                '            else:',
-                '                trend.iloc[i] = prev_trend',
-                '    # === 信号输出 ===',
-                '    if len(trend) >= 2 and trend.iloc[-1] == 1 and trend.iloc[-2] == -1:',
-                '        return "buy"',
-                '    if len(trend) >= 2 and trend.iloc[-1] == -1 and trend.iloc[-2] == 1:',
-                '        return "sell"',
-                '    return None',
-            ]
-
-            return True, '\n'.join(python_lines), ''
+            if not pine_script.strip():
+                return True, '\n'.join(SUPERTREND_TEMPLATE), ''
+            return True, compile_pine(pine_script).source, ''
         except Exception as e:
             return False, '', str(e)
+
+    def compile(self, pine_script: str) -> PineStrategy:
+        return compile_pine(pine_script)
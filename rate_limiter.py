@@ -0,0 +1,288 @@
+import base64
+import functools
+import hashlib
+import heapq
+import hmac
+import itertools
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import httpx
+
+from metrics import RATE_LIMIT_HITS, RETRIES
+
+# 优先级：数值越小越先拿到令牌。下单/平仓 > 账户查询 > 行情
+PRIORITY_TRADE = 0
+PRIORITY_ACCOUNT = 1
+PRIORITY_MARKET = 2
+
+# OKX 各接口限速：路径 -> (请求数, 秒)，见 OKX API 文档各接口的“限速”说明
+ENDPOINT_LIMITS = {
+    "/api/v5/market/ticker": (20, 2),
+    "/api/v5/market/tickers": (20, 2),
+    "/api/v5/market/candles": (40, 2),
+    "/api/v5/market/history-candles": (20, 2),
+    "/api/v5/public/instruments": (20, 2),
+    "/api/v5/account/positions": (10, 2),
+    "/api/v5/account/config": (5, 2),
+    "/api/v5/trade/order": (60, 2),
+    "/api/v5/trade/cancel-order": (60, 2),
+    "/api/v5/trade/amend-order": (60, 2),
+    "/api/v5/trade/close-position": (20, 2),
+    "/api/v5/trade/order-algo": (20, 2),
+    "/api/v5/trade/orders-pending": (60, 2),
+    "/api/v5/trade/cancel-algos": (20, 2),
+    # 批量接口按订单数限速（300 笔/2 秒），按每批最多 20 笔折算成请求数
+    "/api/v5/trade/batch-orders": (15, 2),
+    "/api/v5/trade/cancel-batch-orders": (15, 2),
+    "/api/v5/trade/amend-batch-orders": (15, 2),
+}
+DEFAULT_LIMIT = (10, 2)  # 未列出的接口按较保守的限速处理
+ACQUIRE_TIMEOUT = 10  # 等待令牌的最长秒数
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8
+BREAKER_THRESHOLD = 5  # 连续失败多少次后熔断
+BREAKER_RESET = 15  # 熔断后多少秒放行一个试探请求
+
+_local = threading.local()
+
+
+class RateLimitTimeout(httpx.TransportError):
+    """等待令牌超时，请求未发出"""
+
+
+class CircuitOpenError(httpx.TransportError):
+    """接口处于熔断状态，请求未发出"""
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    """带全抖动的指数退避：在 [0, min(cap, base * 2^attempt)] 内均匀取值，避免多个调用方同时重试"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def set_thread_priority(priority: int):
+    """设置当前线程发出请求的默认优先级（可作为线程池 initializer）"""
+    _local.priority = priority
+
+
+@contextmanager
+def request_priority(priority: int):
+    """临时指定当前线程发出请求的优先级"""
+    previous = getattr(_local, "priority", None)
+    _local.priority = priority
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def endpoint_priority(path: str) -> int:
+    """接口本身的优先级，线程未指定优先级时使用"""
+    if path.startswith("/api/v5/trade/"):
+        return PRIORITY_TRADE
+    if path.startswith("/api/v5/account/"):
+        return PRIORITY_ACCOUNT
+    return PRIORITY_MARKET
+
+
+class TokenBucket:
+    """令牌桶：容量 capacity，每秒补充 rate 个。等待者按 (优先级, 到达顺序) 排队，令牌总是先给队首"""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, priority: int = PRIORITY_MARKET, timeout: float = ACQUIRE_TIMEOUT) -> bool:
+        deadline = time.monotonic() + timeout
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._waiters[0] == ticket and self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+                    if now >= deadline:
+                        return False
+                    wait = (1 - self._tokens) / self.rate if self._waiters[0] == ticket else deadline - now
+                    self._cond.wait(min(max(wait, 0.001), deadline - now))
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def drain(self):
+        """收到 429 后清空令牌，让其他线程一起等待补充"""
+        with self._cond:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0.0)
+
+
+class CircuitBreaker:
+    """连续失败 threshold 次后熔断 reset_timeout 秒，之后放行一个试探请求：成功则恢复，失败则继续熔断"""
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, reset_timeout: float = BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def release_trial(self):
+        """放行的试探请求最终没有发出（如等待令牌超时）时归还试探名额，下一个请求可以再试探"""
+        with self._lock:
+            self._trial = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> bool:
+        """记录一次失败，返回是否因此进入熔断"""
+        with self._lock:
+            self.failures += 1
+            was_open = self.opened_at is not None
+            if self._trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+                self._trial = False
+                return not was_open
+            return False
+
+
+class RequestScheduler:
+    """所有 OKX REST 请求的统一调度：按接口限速排队、按优先级分配令牌、失败时抖动退避重试、连续失败时熔断
+
+    只重试确定未被处理的请求：429（OKX 在处理前拒绝）和建连失败对任何方法都重试；
+    5xx 和读超时只重试 GET，下单等 POST 请求交给调用方判断，避免重复下单。
+    签名请求重试前用 resign 更新 OK-ACCESS-TIMESTAMP 和签名，避免退避后超出 OKX 30 秒的时间戳窗口。
+    enabled=False 时不排队限速（如本地假服务的基准测试），重试和熔断照常。
+    """
+
+    def __init__(self, limits: dict = None, max_retries: int = MAX_RETRIES, acquire_timeout: float = ACQUIRE_TIMEOUT):
+        self.limits = ENDPOINT_LIMITS if limits is None else limits
+        self.max_retries = max_retries
+        self.acquire_timeout = acquire_timeout
+        self.enabled = True
+        self._buckets = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _endpoint(self, path: str):
+        with self._lock:
+            bucket = self._buckets.get(path)
+            if bucket is None:
+                count, seconds = self.limits.get(path, DEFAULT_LIMIT)
+                bucket = self._buckets[path] = TokenBucket(count, count / seconds)
+                self._breakers[path] = CircuitBreaker()
+            return bucket, self._breakers[path]
+
+    def send(self, send, request: httpx.Request, resign=None) -> httpx.Response:
+        path = request.url.path
+        bucket, breaker = self._endpoint(path)
+        priority = getattr(_local, "priority", None)
+        if priority is None:
+            priority = endpoint_priority(path)
+        idempotent = request.method == "GET"
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(f"{path} 熔断中，{breaker.reset_timeout} 秒后重试", request=request)
+            try:
+                if self.enabled and not bucket.acquire(priority, self.acquire_timeout):
+                    raise RateLimitTimeout(f"{path} 等待限速令牌超时", request=request)
+                if attempt and resign is not None:
+                    resign(request)
+            except BaseException:
+                breaker.release_trial()  # 请求没有发出，不占用试探名额
+                raise
+            try:
+                response = send(request)
+            except httpx.TransportError as e:
+                # 建连失败时请求没有发出，可以安全重试
+                retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                self._on_failure(path, breaker, type(e).__name__)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+            else:
+                if response.status_code == 429:
+                    RATE_LIMIT_HITS.inc(source="okx")
+                    breaker.record_success()  # 接口可达，只是限流
+                    bucket.drain()
+                    retryable = True
+                elif response.status_code >= 500:
+                    self._on_failure(path, breaker, f"HTTP {response.status_code}")
+                    retryable = idempotent
+                else:
+                    breaker.record_success()
+                    return response
+                if not retryable or attempt >= self.max_retries:
+                    return response
+                response.close()
+            RETRIES.inc(operation="okx_request")
+            delay = backoff_delay(attempt)
+            attempt += 1
+            logging.debug("OKX 请求重试: %s 第 %s 次，%.2f 秒后", path, attempt, delay)
+            time.sleep(delay)
+
+    def _on_failure(self, path: str, breaker: CircuitBreaker, reason: str):
+        if breaker.record_failure():
+            logging.warning("OKX 接口熔断: %s 连续失败 %s 次（%s），%s 秒内不再请求", path, breaker.failures, reason, breaker.reset_timeout)
+
+
+def request_signature(request: httpx.Request, timestamp: str, secret_key: str) -> str:
+    """OKX 私有接口签名：Base64(HMAC-SHA256(timestamp + method + requestPath + body))"""
+    message = f"{timestamp}{request.method.upper()}{request.url.raw_path.decode()}{request.content.decode()}"
+    return base64.b64encode(hmac.new(secret_key.encode(), message.encode(), hashlib.sha256).digest()).decode()
+
+
+def resign_request(request: httpx.Request, secret_key: str):
+    """用当前时间更新签名请求的 OK-ACCESS-TIMESTAMP 和签名，未签名的公共接口请求不变"""
+    if "OK-ACCESS-SIGN" not in request.headers:
+        return
+    timestamp = datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+    request.headers["OK-ACCESS-TIMESTAMP"] = timestamp
+    request.headers["OK-ACCESS-SIGN"] = request_signature(request, timestamp, secret_key)
+
+
+class ScheduledTransport(httpx.BaseTransport):
+    """把 httpx 传输层的请求交给 RequestScheduler 调度；给定 secret_key 时重试前重新签名"""
+
+    def __init__(self, transport: httpx.BaseTransport, scheduler: RequestScheduler, secret_key: str = None):
+        self._transport = transport
+        self._scheduler = scheduler
+        self._secret_key = secret_key
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        resign = functools.partial(resign_request, secret_key=self._secret_key) if self._secret_key else None
+        return self._scheduler.send(self._transport.handle_request, request, resign)
+
+    def close(self):
+        self._transport.close()
@@ -0,0 +1,562 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+import okx_clients
+from backtest import INTRABAR_FRACTIONS, intrabar_ticks, load_candles
+from candle_archive import BAR_SECONDS
+from fake_okx import FakeOkxRestServer
+
+WARMUP_BARS = 200  # 回放开始前可供回补的K线数，需不少于机器人的 CANDLE_LIMIT
+SYNTHETIC_START_MS = 1_700_000_000_000
+TICK_SIZE = "0.1"
+
+
+class ReplayFinished(BaseException):
+    """虚拟时间到达回放终点。继承 BaseException，不会被主循环的 except Exception 吞掉"""
+
+
+class VirtualClock:
+    """虚拟时钟：替换被回放模块的 time，time() 返回虚拟时间，sleep() 直接推进虚拟时间
+
+    speed 为 0 时尽快运行；否则按倍速真实等待（如 1000 表示虚拟 1000 秒对应真实 1 秒）。
+    推进超过 end 时抛出 ReplayFinished。perf_counter/monotonic 仍为真实时间，只用于计时和限速。
+    """
+
+    perf_counter = staticmethod(time.perf_counter)
+    monotonic = staticmethod(time.monotonic)
+
+    def __init__(self, start: float, end: float = None, speed: float = 0.0):
+        self.now = float(start)
+        self.end = end
+        self.speed = speed
+
+    def time(self) -> float:
+        return self.now
+
+    def time_ns(self) -> int:
+        return int(self.now * 1e9)
+
+    def sleep(self, seconds: float):
+        self.advance_to(self.now + max(seconds, 0))
+
+    def advance_to(self, t: float):
+        if self.end is not None and t > self.end:
+            self.now = max(self.now, self.end)
+            raise ReplayFinished()
+        if self.speed and t > self.now:
+            time.sleep((t - self.now) / self.speed)
+        self.now = max(self.now, t)
+
+    def datetime_class(self):
+        """datetime 的子类，now() 返回虚拟时间，用于替换被回放模块的 datetime"""
+        clock = self
+
+        class ClockDatetime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return datetime.fromtimestamp(clock.time(), tz)
+
+        return ClockDatetime
+
+
+def synthetic_candles(bars: int, seed: int = 0, start_ms: int = SYNTHETIC_START_MS, bar: str = "1m",
+                      price: float = 50000.0, volatility: float = 0.002) -> dict:
+    """随机游走K线（从旧到新），格式与 backtest.load_candles 相同；相同 seed 得到相同数据"""
+    rng = np.random.default_rng(seed)
+    close = price * np.exp(np.cumsum(rng.normal(0, volatility, bars)))
+    open_ = np.concatenate(([price], close[:-1]))
+    return {
+        "ts": start_ms + np.arange(bars, dtype=np.int64) * BAR_SECONDS[bar] * 1000,
+        "open": open_,
+        "high": np.maximum(open_, close) * (1 + rng.uniform(0, volatility, bars)),
+        "low": np.minimum(open_, close) * (1 - rng.uniform(0, volatility, bars)),
+        "close": close,
+        "volume": rng.lognormal(3, 0.8, bars),
+    }
+
+
+def _fmt(value: float) -> str:
+    return f"{value:.10g}"
+
+
+def _aggregate(ts, o, h, l, c, v, bucket_ms: int) -> tuple:
+    """把从旧到新的小周期K线按 bucket_ms 聚合"""
+    keys = ts // bucket_ms * bucket_ms
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(ts)] - 1
+    return (keys[starts], o[starts], np.maximum.reduceat(h, starts), np.minimum.reduceat(l, starts),
+            c[ends], np.add.reduceat(v, starts))
+
+
+class MarketReplay:
+    """回放行情：每个产品一组基础周期K线（从旧到新），K线内按 backtest.intrabar_ticks 的固定顺序合成成交价
+
+    止损止盈的触发顺序因此是确定的。任一虚拟时刻的行情只由此前的成交价决定：未收盘的K线由已发生的成交价拼出，大周期由基础周期聚合。
+    """
+
+    def __init__(self, candles: dict, bar: str = "1m"):
+        self.bar = bar
+        self.interval_ms = BAR_SECONDS[bar] * 1000
+        self.candles = {}
+        self.ticks = {}
+        for symbol, columns in candles.items():
+            cols = {name: np.ascontiguousarray(columns[name], dtype=np.int64 if name == "ts" else np.float64)
+                    for name in ("ts", "open", "high", "low", "close", "volume")}
+            self.candles[symbol] = cols
+            self.ticks[symbol] = intrabar_ticks(cols["ts"], cols["open"], cols["high"], cols["low"], cols["close"], self.interval_ms)
+
+    @property
+    def symbols(self) -> list:
+        return sorted(self.candles)
+
+    def bounds(self, warmup: int = WARMUP_BARS) -> tuple:
+        """可回放的时间范围 (起, 止)（毫秒）：各产品都留出 warmup 根历史K线之后，到最早结束的产品的最后一根收盘"""
+        start = max(int(c["ts"][min(warmup, len(c["ts"]) - 1)]) for c in self.candles.values())
+        end = min(int(c["ts"][-1]) for c in self.candles.values()) + self.interval_ms
+        return start, end
+
+    def tick_times(self, start_ms: int, end_ms: int) -> np.ndarray:
+        """[start_ms, end_ms) 内所有产品的成交时刻（去重、升序）"""
+        times = [ts[(ts >= start_ms) & (ts < end_ms)] for ts, _ in self.ticks.values()]
+        return np.unique(np.concatenate(times))
+
+    def ticks_between(self, symbol: str, after_ms: int, until_ms: int) -> tuple:
+        """(after_ms, until_ms] 内该产品的成交 (时刻数组, 价格数组)"""
+        ts, px = self.ticks[symbol]
+        lo, hi = np.searchsorted(ts, after_ms, "right"), np.searchsorted(ts, until_ms, "right")
+        return ts[lo:hi], px[lo:hi]
+
+    def price(self, symbol: str, now_ms: int):
+        ts, px = self.ticks.get(symbol, (None, None))
+        if ts is None:
+            return None
+        i = int(np.searchsorted(ts, now_ms, "right")) - 1
+        return float(px[i]) if i >= 0 else None
+
+    def candles_at(self, symbol: str, bar: str, now_ms: int, after: int = None, limit: int = 100) -> list:
+        """now_ms 时刻 OKX 会返回的K线（最新在前，OKX 字符串格式），after 只返回更早的K线"""
+        cols = self.candles.get(symbol)
+        bucket_ms = BAR_SECONDS.get(bar, 0) * 1000
+        if cols is None or bucket_ms < self.interval_ms or bucket_ms % self.interval_ms:
+            return []
+        ts = cols["ts"]
+        current = int(np.searchsorted(ts, now_ms, "right")) - 1
+        if current < 0:
+            return []
+        end_bucket = int(ts[current]) // bucket_ms * bucket_ms
+        if after is not None:
+            end_bucket = min(end_bucket, -(-after // bucket_ms) * bucket_ms - bucket_ms)
+        start_bucket = end_bucket - (limit - 1) * bucket_ms
+        lo = int(np.searchsorted(ts, start_bucket))
+        hi = min(int(np.searchsorted(ts, end_bucket + bucket_ms)), current + 1)
+        if lo >= hi:
+            return []
+        rows = [cols[name][lo:hi].copy() for name in ("ts", "open", "high", "low", "close", "volume")]
+        if hi == current + 1:
+            # 未收盘的基础K线：只用已经发生的成交价
+            seen_ts, seen_px = self.ticks_between(symbol, int(ts[current]) - 1, now_ms)
+            rows[2][-1], rows[3][-1], rows[4][-1] = seen_px.max(), seen_px.min(), seen_px[-1]
+            rows[5][-1] *= len(seen_px) / len(INTRABAR_FRACTIONS)
+        if bucket_ms != self.interval_ms:
+            rows = _aggregate(*rows, bucket_ms)
+        data = []
+        for t, o, h, l, c, v in zip(*rows):
+            confirm = "1" if t + bucket_ms <= now_ms else "0"
+            data.append([str(int(t)), _fmt(o), _fmt(h), _fmt(l), _fmt(c), _fmt(v), "0", "0", confirm])
+        return data[::-1]
+
+
+class SimExchange:
+    """模拟撮合：市价单按当前成交价（加滑点）立即全部成交，支持双向/单向持仓、市价全平和开仓附带的止盈止损
+
+    数量按币的个数计算盈亏（不区分合约面值）。每次收到请求前先按虚拟时间处理此前的成交价，
+    触发附带的止盈止损时按触发时的成交价平仓。
+    """
+
+    def __init__(self, market: MarketReplay, clock: VirtualClock, pos_mode: str = "long_short_mode",
+                 slippage_bps: float = 0.0, fee_rate: float = 0.0005):
+        self.market = market
+        self.clock = clock
+        self.pos_mode = pos_mode
+        self.slippage_bps = slippage_bps
+        self.fee_rate = fee_rate
+        self.positions = {}  # (产品, posSide) -> {"pos", "avgPx", "mgnMode", "algo"}
+        self.algo_orders = {}  # attachAlgoClOrdId -> 状态
+        self.fills = []  # 全部成交记录，即回放的决策结果
+        self.realized_pnl = 0.0
+        self.fees = 0.0
+        self._synced_ms = None
+        self._lock = threading.Lock()
+
+    def now_ms(self) -> int:
+        return int(round(self.clock.time() * 1000))
+
+    def sync(self):
+        """处理上次同步之后、当前虚拟时刻之前的成交价，触发附带的止盈止损"""
+        now_ms = self.now_ms()
+        if self._synced_ms is None:
+            self._synced_ms = now_ms
+            return
+        if now_ms <= self._synced_ms:
+            return
+        for key in sorted(self.positions):
+            algo = self.positions[key].get("algo")
+            if algo is None:
+                continue
+            direction = 1 if self._direction_of(key, self.positions[key]) > 0 else -1
+            for ts, px in zip(*self.market.ticks_between(key[0], self._synced_ms, now_ms)):
+                reason = None
+                if algo.get("sl") is not None and (px - algo["sl"]) * direction <= 0:
+                    reason = "sl"
+                elif algo.get("tp") is not None and (px - algo["tp"]) * direction >= 0:
+                    reason = "tp"
+                if reason:
+                    self.algo_orders[algo["id"]] = "effective"
+                    self._close(key, float(px), int(ts), reason)
+                    break
+        self._synced_ms = now_ms
+
+    @staticmethod
+    def _direction_of(key: tuple, position: dict) -> float:
+        """持仓方向和数量：多为正、空为负"""
+        return -position["pos"] if key[1] == "short" else position["pos"]
+
+    def _fill_price(self, price: float, side: str) -> float:
+        slip = price * self.slippage_bps / 10000
+        return price + slip if side == "buy" else price - slip
+
+    def _record(self, ts: int, inst_id: str, side: str, pos_side: str, px: float, sz: float, reason: str, pnl: float):
+        fee = abs(px * sz) * self.fee_rate
+        self.fees += fee
+        self.realized_pnl += pnl
+        self.fills.append({"ts": ts, "instId": inst_id, "side": side, "posSide": pos_side, "px": round(px, 8),
+                           "sz": round(sz, 8), "reason": reason, "pnl": round(pnl, 8), "fee": round(fee, 8)})
+
+    def _close(self, key: tuple, price: float, ts: int, reason: str):
+        position = self.positions.pop(key)
+        amount = self._direction_of(key, position)
+        side = "sell" if amount > 0 else "buy"
+        px = self._fill_price(price, side)
+        pnl = (px - position["avgPx"]) * amount
+        self._record(ts, key[0], side, key[1], px, abs(amount), reason, pnl)
+        algo = position.get("algo")
+        if algo is not None and self.algo_orders.get(algo["id"]) == "live":
+            self.algo_orders[algo["id"]] = "canceled"
+
+    def place_order(self, body: dict) -> tuple:
+        """处理下单请求，返回 (错误码, 错误信息)，成功为 ("0", "")"""
+        with self._lock:
+            self.sync()
+            inst_id, side = body.get("instId"), body.get("side")
+            price = self.market.price(inst_id, self.now_ms())
+            if price is None:
+                return "51001", "产品不存在或尚无行情"
+            if body.get("ordType") != "market":
+                return "51000", "回放只支持市价单"
+            sz = float(body.get("sz") or 0)
+            if sz <= 0:
+                return "51000", "数量必须大于 0"
+            if self.pos_mode == "long_short_mode":
+                pos_side = body.get("posSide")
+                if pos_side not in ("long", "short"):
+                    return "51000", "双向持仓模式需要 posSide"
+                opening = (side == "buy") == (pos_side == "long")
+                delta = sz if opening else -sz  # 双向持仓的 pos 总为正
+            else:
+                pos_side = "net"
+                delta = sz if side == "buy" else -sz
+                current = self.positions.get((inst_id, pos_side), {}).get("pos", 0.0)
+                opening = current == 0 or (current > 0) == (delta > 0)
+            key = (inst_id, pos_side)
+            px = self._fill_price(price, side)
+            position = self.positions.get(key)
+            if position is None and not opening:
+                return "51000", "没有可减少的持仓"
+            ts = self.now_ms()
+            if opening:
+                if position is None:
+                    position = self.positions[key] = {"pos": 0.0, "avgPx": 0.0, "mgnMode": body.get("tdMode", "cross"), "algo": None}
+                total = abs(position["pos"]) + sz
+                position["avgPx"] = (position["avgPx"] * abs(position["pos"]) + px * sz) / total
+                position["pos"] += delta
+                self._record(ts, inst_id, side, pos_side, px, sz, "open", 0.0)
+                for algo in body.get("attachAlgoOrds") or []:
+                    algo_id = algo.get("attachAlgoClOrdId") or f"algo{len(self.algo_orders)}"
+                    position["algo"] = {
+                        "id": algo_id,
+                        "tp": float(algo["tpTriggerPx"]) if algo.get("tpTriggerPx") else None,
+                        "sl": float(algo["slTriggerPx"]) if algo.get("slTriggerPx") else None,
+                    }
+                    self.algo_orders[algo_id] = "live"
+            else:
+                reduce = min(sz, abs(position["pos"]))
+                amount = reduce if self._direction_of(key, position) > 0 else -reduce
+                pnl = (px - position["avgPx"]) * amount
+                self._record(ts, inst_id, side, pos_side, px, reduce, "reduce", pnl)
+                position["pos"] -= amount if pos_side == "net" else reduce
+                if abs(position["pos"]) < 1e-12:
+                    self.positions.pop(key)
+                    algo = position.get("algo")
+                    if algo is not None:
+                        self.algo_orders[algo["id"]] = "canceled"
+            return "0", ""
+
+    def close_position(self, body: dict) -> bool:
+        with self._lock:
+            self.sync()
+            key = (body.get("instId"), body.get("posSide") or "net")
+            if key not in self.positions:
+                return False
+            self._close(key, self.market.price(key[0], self.now_ms()), self.now_ms(), "close")
+            return True
+
+    def position_rows(self, inst_id: str = None) -> list:
+        with self._lock:
+            self.sync()
+            rows = []
+            for (symbol, pos_side), position in sorted(self.positions.items()):
+                if inst_id is not None and symbol != inst_id:
+                    continue
+                rows.append({"instId": symbol, "posSide": pos_side, "pos": _fmt(position["pos"]),
+                             "avgPx": _fmt(position["avgPx"]), "mgnMode": position["mgnMode"]})
+            return rows
+
+    def summary(self) -> dict:
+        reasons = {}
+        for fill in self.fills:
+            reasons[fill["reason"]] = reasons.get(fill["reason"], 0) + 1
+        return {
+            "fills": len(self.fills),
+            "by_reason": reasons,
+            "realized_pnl": round(self.realized_pnl, 6),
+            "fees": round(self.fees, 6),
+            "open_positions": len(self.positions),
+            "digest": hashlib.sha256(json.dumps(self.fills, sort_keys=True).encode()).hexdigest(),
+        }
+
+
+class ReplayOkxServer(FakeOkxRestServer):
+    """按虚拟时钟提供行情、持仓和撮合的本地 OKX REST 服务"""
+
+    def __init__(self, market: MarketReplay, exchange: SimExchange, host: str = "127.0.0.1", port: int = 0):
+        super().__init__(host, port)
+        self.market = market
+        self.exchange = exchange
+
+    def _now_ms(self) -> int:
+        return self.exchange.now_ms()
+
+    def _ticker(self, params, body):
+        inst_id = params.get("instId")
+        price = self.market.price(inst_id, self._now_ms())
+        if price is None:
+            return {"code": "51001", "msg": f"Instrument ID {inst_id} does not exist", "data": []}
+        return {"code": "0", "msg": "", "data": [{"instId": inst_id, "last": _fmt(price), "ts": str(self._now_ms())}]}
+
+    def _tickers(self, params, body):
+        now_ms = self._now_ms()
+        data = [{"instId": s, "instType": params.get("instType", "SWAP"), "last": _fmt(self.market.price(s, now_ms)), "ts": str(now_ms)}
+                for s in self.market.symbols if self.market.price(s, now_ms) is not None]
+        return {"code": "0", "msg": "", "data": data}
+
+    def _candles(self, params, body):
+        after = int(params["after"]) if params.get("after") else None
+        limit = min(int(params.get("limit") or 100), 300)
+        data = self.market.candles_at(params.get("instId"), params.get("bar") or "1m", self._now_ms(), after, limit)
+        return {"code": "0", "msg": "", "data": data}
+
+    def _positions(self, params, body):
+        return {"code": "0", "msg": "", "data": self.exchange.position_rows(params.get("instId"))}
+
+    def _account_config(self, params, body):
+        return {"code": "0", "msg": "", "data": [{"posMode": self.exchange.pos_mode}]}
+
+    def _instruments(self, params, body):
+        return {"code": "0", "msg": "", "data": [{"instId": params.get("instId"), "instType": params.get("instType"), "tickSz": TICK_SIZE}]}
+
+    def _place_order(self, params, body):
+        self.orders.append(body)
+        code, msg = self.exchange.place_order(body)
+        data = [{"ordId": str(len(self.orders)), "clOrdId": body.get("clOrdId", ""), "sCode": code, "sMsg": msg}]
+        return {"code": "0" if code == "0" else "1", "msg": msg, "data": data}
+
+    def _get_algo_order(self, params, body):
+        cl_id = params.get("algoClOrdId")
+        with self.exchange._lock:
+            self.exchange.sync()
+            state = self.exchange.algo_orders.get(cl_id)
+        if state is None:
+            return {"code": "51603", "msg": "Order does not exist", "data": []}
+        return {"code": "0", "msg": "", "data": [{"algoClOrdId": cl_id, "state": state}]}
+
+    def _close_position(self, params, body):
+        if not self.exchange.close_position(body):
+            return {"code": "51023", "msg": "Position does not exist", "data": []}
+        return {"code": "0", "msg": "", "data": [{"instId": body.get("instId"), "posSide": body.get("posSide"), "clOrdId": body.get("clOrdId", "")}]}
+
+
+class MessageRecorder:
+    """替换 TelegramNotifier，只记录消息不发送"""
+
+    def __init__(self):
+        self.messages = []
+
+    def start(self):
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        pass
+
+    def notify(self, message: str) -> bool:
+        self.messages.append(message)
+        return True
+
+
+async def _inline_call(pool, func, *args, timeout: float = None):
+    """回放时在事件循环线程内直接执行阻塞调用，保证顺序确定"""
+    return func(*args)
+
+
+def replay_app(market: MarketReplay, exchange: SimExchange, clock: VirtualClock, start_ms: int, end_ms: int) -> MessageRecorder:
+    """在每个成交时刻依次执行 BotRuntime 的取价、风控、信号、下单四步"""
+    import app
+
+    recorder = MessageRecorder()
+    app._notifier = recorder
+    app.time = clock
+    app.SYMBOLS = market.symbols
+    app.get_pos_mode()
+    states = app.build_states()
+    runtime = app.BotRuntime(states)
+    runtime.call = _inline_call
+
+    async def steps():
+        # 两次成交之间价格不变，机器人按 CHECK_INTERVAL 轮询得到的结果相同，只在成交时刻唤醒
+        for t in market.tick_times(start_ms, end_ms):
+            clock.advance_to(int(t) / 1000)
+            prices = await runtime.refresh_prices(int(clock.time()))
+            if prices:
+                runtime.check_risk(*runtime.price_updates.get_nowait())
+            while not runtime.signal_queue.empty():
+                await runtime.process_symbol(runtime.signal_queue.get_nowait())
+            while not runtime.order_queue.empty():
+                _, _, state, intent = runtime.order_queue.get_nowait()
+                await runtime.run_order(state, intent)
+
+    asyncio.run(steps())
+    return recorder
+
+
+def replay_main(market: MarketReplay, exchange: SimExchange, clock: VirtualClock, start_ms: int, end_ms: int) -> MessageRecorder:
+    """运行 main.run 的主循环，sleep 推进虚拟时钟，到达终点时结束"""
+    import main
+
+    recorder = MessageRecorder()
+    main.notifier.stop()
+    main.notifier = recorder
+    main.time = clock
+    main.datetime = clock.datetime_class()
+    main.USE_WEBSOCKET = False
+    main.SYMBOL = market.symbols[0]
+    main.BAR_INTERVAL = market.bar
+    clock.end = end_ms / 1000
+    try:
+        main.run()
+    except ReplayFinished:
+        pass
+    return recorder
+
+
+ENTRIES = {"app": replay_app, "main": replay_main}
+
+
+def run_replay(candles: dict, entry: str = "app", bar: str = "1m", warmup: int = WARMUP_BARS, speed: float = 0.0,
+               slippage_bps: float = 0.0, fee_rate: float = 0.0005, seed: int = 0) -> dict:
+    """在本地假交易所上回放一段行情，返回成交记录和汇总；同一输入每次得到相同的成交（digest 相同）"""
+    random.seed(seed)
+    market = MarketReplay(candles, bar)
+    start_ms, end_ms = market.bounds(warmup)
+    clock = VirtualClock(start_ms / 1000, speed=speed)
+    exchange = SimExchange(market, clock, slippage_bps=slippage_bps, fee_rate=fee_rate)
+    server = ReplayOkxServer(market, exchange).start()
+    for key in ("BOT_TOKEN", "CHAT_ID", "API_KEY", "SECRET_KEY", "PASS_PHRASE"):
+        os.environ.setdefault(key, "replay")
+    os.environ["TELEGRAM_API_URL"] = server.url
+    os.environ["MARKET_DATA_MODE"] = "rest"  # WebSocket 推送的到达时刻不确定，回放只走 REST
+    os.environ["ACCOUNT_DATA_MODE"] = "rest"
+    os.environ["CANDLE_ARCHIVE_DIR"] = ""
+    os.environ["STATE_SNAPSHOT_FILE"] = ""
+    okx_clients.OKX_DOMAIN = server.url
+    okx_clients.get_scheduler().enabled = False  # 限速按真实时间计算，回放时不排队
+    started = time.perf_counter()
+    try:
+        recorder = ENTRIES[entry](market, exchange, clock, start_ms, end_ms)
+    finally:
+        okx_clients.close_all()
+        server.stop()
+    elapsed = time.perf_counter() - started
+    return {
+        "entry": entry,
+        "symbols": market.symbols,
+        "start_ms": start_ms,
+        "end_ms": end_ms,
+        "virtual_seconds": (end_ms - start_ms) / 1000,
+        "elapsed_seconds": elapsed,
+        "speedup": (end_ms - start_ms) / 1000 / elapsed if elapsed else 0.0,
+        "requests": server.requests,
+        "messages": len(recorder.messages),
+        "summary": exchange.summary(),
+        "fills": exchange.fills,
+    }
+
+
+def _load_candle_args(specs, symbols, bars: int, seed: int, bar: str) -> dict:
+    """有 --candles SYMBOL=PATH 时回放录制的K线，否则为每个产品生成随机游走K线"""
+    if not specs:
+        return {symbol: synthetic_candles(bars + WARMUP_BARS, seed + i, bar=bar) for i, symbol in enumerate(symbols)}
+    return {symbol: load_candles(path) for symbol, _, path in (spec.partition("=") for spec in specs)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="确定性行情回放：本地假 OKX 交易所 + 虚拟时钟")
+    parser.add_argument("--entry", choices=list(ENTRIES), default="app")
+    parser.add_argument("--symbols", default="BTC-USDT-SWAP", help="随机游走行情的产品（逗号分隔）")
+    parser.add_argument("--candles", action="append", default=[], metavar="SYMBOL=PATH", help="录制的K线文件（CSV/Parquet/.ohlcv），可重复")
+    parser.add_argument("--bar", default="1m", choices=list(BAR_SECONDS), help="行情数据的K线周期")
+    parser.add_argument("--bars", type=int, default=1440, help="随机游走回放的K线数（不含预热）")
+    parser.add_argument("--warmup", type=int, default=WARMUP_BARS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--speed", type=float, default=0.0, help="回放倍速，0 为尽快运行")
+    parser.add_argument("--slippage-bps", type=float, default=0.0)
+    parser.add_argument("--fee-rate", type=float, default=0.0005)
+    parser.add_argument("--output", help="把成交记录和汇总写入 JSON 文件")
+    parser.add_argument("--verbose", action="store_true", help="显示机器人的日志和输出")
+    args = parser.parse_args()
+
+    symbols = [s.strip() for s in args.symbols.split(",") if s.strip()]
+    candles = _load_candle_args(args.candles, symbols, args.bars, args.seed, args.bar)
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+    with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w")):
+        result = run_replay(candles, args.entry, args.bar, args.warmup, args.speed, args.slippage_bps, args.fee_rate, args.seed)
+    summary = result["summary"]
+    print(f"{result['entry']}: {', '.join(result['symbols'])}, 虚拟 {result['virtual_seconds'] / 3600:.1f} 小时, "
+          f"用时 {result['elapsed_seconds']:.1f} 秒（{result['speedup']:.0f} 倍速）, 请求 {result['requests']} 次, 消息 {result['messages']} 条")
+    print(f"成交 {summary['fills']} 笔 {summary['by_reason']}, 已实现盈亏 {summary['realized_pnl']:.4f}, "
+          f"手续费 {summary['fees']:.4f}, 未平仓 {summary['open_positions']}")
+    print(f"digest: {summary['digest']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存: {args.output}")
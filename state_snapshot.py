@@ -0,0 +1,70 @@
+import logging
+import os
+import pickle
+import stat
+import time
+
+SNAPSHOT_VERSION = 1
+
+
+def _is_private(st) -> bool:
+    """文件或目录属于当前用户，且组和其他用户不可写"""
+    owner_ok = not hasattr(os, "getuid") or st.st_uid == os.getuid()
+    return owner_ok and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _private_dir(path: str) -> bool:
+    """快照所在目录是否为当前用户私有的真实目录（不是符号链接）"""
+    try:
+        st = os.lstat(os.path.dirname(os.path.abspath(path)))
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and _is_private(st)
+
+
+def write_snapshot(path: str, payload: dict) -> int:
+    """原子写入快照：先写临时文件（0600）并 fsync，再 os.replace 覆盖，中途退出不会留下半个文件；返回字节数
+
+    目录不存在时以 0700 创建；目录不是当前用户私有时抛出 PermissionError，不写入。
+    """
+    data = pickle.dumps({"version": SNAPSHOT_VERSION, "saved_at": time.time(), **payload}, protocol=pickle.HIGHEST_PROTOCOL)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+    if not _private_dir(path):
+        raise PermissionError(f"快照目录不是当前用户私有的目录: {os.path.dirname(os.path.abspath(path))}")
+    tmp = f"{path}.tmp{os.getpid()}"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_NOFOLLOW", 0), 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(data)
+
+
+def read_snapshot(path: str):
+    """读取快照，文件不存在、损坏或版本不符时返回 None
+
+    快照是 pickle 格式，加载时会执行其中的代码：目录和文件都必须属于当前用户且他人不可写，
+    否则不读取，避免加载他人放入的文件。
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logging.warning("状态快照无法打开，忽略: %s, %s", path, e)
+        return None
+    with os.fdopen(fd, "rb") as f:
+        st = os.fstat(f.fileno())
+        if not _private_dir(path) or not stat.S_ISREG(st.st_mode) or not _is_private(st):
+            logging.warning("状态快照不是当前用户私有的文件，忽略: %s", path)
+            return None
+        try:
+            snapshot = pickle.load(f)
+        except Exception as e:
+            logging.warning("状态快照无法读取，忽略: %s, %s", path, e)
+            return None
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        logging.warning("状态快照版本不符，忽略: %s", path)
+        return None
+    return snapshot
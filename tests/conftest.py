@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 仓库为扁平模块布局，测试直接导入根目录下的模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
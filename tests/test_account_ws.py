@@ -0,0 +1,87 @@
+import json
+import time
+
+import pytest
+
+from account_ws import AccountStateCache
+from fake_okx import FakeOkxWebSocketServer
+
+SYMBOL = "BTC-USDT-SWAP"
+TIMEOUT = 5
+
+
+def _position(pos_side: str, pos: str = "0.1", u_time: int = 1) -> dict:
+    return {"instId": SYMBOL, "posSide": pos_side, "pos": pos, "mgnMode": "cross", "uTime": str(u_time)}
+
+
+def _wait_until(condition, timeout: float = TIMEOUT) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+def _push(cache: AccountStateCache, data: list):
+    cache._on_message(json.dumps({"arg": {"channel": "positions", "instType": "ANY"}, "data": data}))
+
+
+def _sides(cache: AccountStateCache) -> set:
+    return {p["posSide"] for p in cache.get_positions(SYMBOL)}
+
+
+def test_first_push_after_subscribe_replaces_cache():
+    cache = AccountStateCache("k", "s", "p", url="ws://127.0.0.1:1")
+    cache._subscribed_at = 0
+    _push(cache, [_position("long"), _position("short")])
+    assert cache.ready and _sides(cache) == {"long", "short"}
+    # 重新订阅后的快照中没有空单：断线期间已平仓，应从缓存移除
+    cache.ready = False
+    cache._subscribed_at = time.time() * 1000
+    _push(cache, [_position("long", u_time=2)])
+    assert cache.ready and _sides(cache) == {"long"}
+
+
+def test_later_pushes_merge():
+    cache = AccountStateCache("k", "s", "p", url="ws://127.0.0.1:1")
+    cache._subscribed_at = 0
+    _push(cache, [_position("long")])
+    _push(cache, [_position("short", u_time=2)])
+    assert _sides(cache) == {"long", "short"}
+    _push(cache, [_position("long", pos="0", u_time=3)])
+    assert _sides(cache) == {"short"}
+
+
+def test_not_ready_before_snapshot():
+    cache = AccountStateCache("k", "s", "p", url="ws://127.0.0.1:1")
+    assert not cache.ready
+    cache._on_message(json.dumps({"arg": {"channel": "orders", "instType": "ANY"}, "data": []}))
+    assert not cache.ready
+
+
+@pytest.fixture
+def server():
+    server = FakeOkxWebSocketServer().start()
+    yield server
+    server.stop()
+
+
+def test_reconnect_snapshot_drops_positions_closed_while_disconnected(server):
+    server.positions = [_position("long"), _position("short")]
+    cache = AccountStateCache("k", "s", "p", url=server.url)
+    cache.start()
+    try:
+        assert _wait_until(lambda: cache.ready)
+        assert server.logins == 1 and _sides(cache) == {"long", "short"}
+        server.push_positions([_position("long", pos="0.2", u_time=2)])
+        assert _wait_until(lambda: cache.get_positions(SYMBOL) and
+                           {p["posSide"]: p["pos"] for p in cache.get_positions(SYMBOL)}["long"] == "0.2")
+
+        server.positions = [_position("long", pos="0.2", u_time=3)]
+        server.drop_connections()
+        assert _wait_until(lambda: not cache.ready)
+        assert _wait_until(lambda: cache.ready and cache.reconnects == 1)
+        assert _sides(cache) == {"long"}
+    finally:
+        cache.stop()
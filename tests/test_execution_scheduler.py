@@ -0,0 +1,128 @@
+import pytest
+
+import okx_clients
+from execution_scheduler import ExecutionScheduler
+from fake_okx import FakeOkxRestServer
+
+SYMBOL = "BTC-USDT-SWAP"
+
+
+class FakeClock:
+    """sleep 只推进虚拟时间，拆单循环不真正等待"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def server():
+    server = FakeOkxRestServer().start()
+    scheduler = okx_clients.get_scheduler()
+    enabled, scheduler.enabled = scheduler.enabled, False
+    yield server
+    scheduler.enabled = enabled
+    okx_clients.close_all()
+    server.stop()
+
+
+def _rest_post_only(server, fills: dict = None):
+    """只挂单默认不成交（fills 中指定的 ordId 除外），市价单全部成交"""
+    fills = fills if fills is not None else {}
+
+    def get_order(params, body):
+        ord_id = params.get("ordId")
+        order = server.orders[int(ord_id) - 1]
+        if order.get("ordType") == "post_only":
+            server.order_fills[ord_id] = fills.get(ord_id, "0")
+        else:
+            server.order_fills.pop(ord_id, None)
+        return original(params, body)
+
+    original = server._get_order
+    server._httpd.routes[("GET", "/api/v5/trade/order")] = get_order
+    return fills
+
+
+def _executor(server, clock, **kwargs) -> ExecutionScheduler:
+    trade = okx_clients.get_trade_api("k", "s", "p", "1", server.url)
+    return ExecutionScheduler(trade, SYMBOL, quote=lambda side: 50000.0, format_price=lambda px: f"{px:.1f}",
+                              lot_size=0.1, poll_interval=1.0, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def _sizes(server, ord_type: str) -> list:
+    return [float(o["sz"]) for o in server.orders if o["ordType"] == ord_type]
+
+
+def test_twap_releases_even_slices_then_tops_up(server):
+    _rest_post_only(server)
+    clock = FakeClock()
+    parent = _executor(server, clock).run("buy", 0.6, "twap", duration=30, arrival_price=50000.0, slices=3)
+    assert _sizes(server, "post_only") == [0.2, 0.2, 0.2]
+    assert _sizes(server, "market") == [0.6]
+    assert {c["ordId"] for c in server.canceled} == {"1", "2", "3"}
+    assert parent.filled == pytest.approx(0.6)
+
+
+def test_pov_follows_market_volume(server):
+    clock = FakeClock()
+    start = clock()
+    # 市场每秒成交 1，参与率 0.1：每秒释放 0.1，挂单立即成交
+    executor = _executor(server, clock, market_volume=lambda since: clock() - start)
+    parent = executor.run("sell", 0.5, "pov", duration=100, arrival_price=50000.0, rate=0.1)
+    assert parent.filled == pytest.approx(0.5)
+    assert _sizes(server, "market") == []
+    assert all(size == pytest.approx(0.1) for size in _sizes(server, "post_only"))
+    assert clock() - start < 10
+
+
+def test_iceberg_shows_one_slice_at_a_time(server):
+    _rest_post_only(server)
+    clock = FakeClock()
+    parent = _executor(server, clock).run("buy", 0.5, "iceberg", duration=20, arrival_price=50000.0, display_size=0.2)
+    # 第一片一直未成交，不会露出第二片；到期后市价补齐
+    assert _sizes(server, "post_only") == [0.2]
+    assert _sizes(server, "market") == [0.5]
+    assert parent.filled == pytest.approx(0.5)
+
+
+def test_iceberg_refills_after_each_fill(server):
+    clock = FakeClock()
+    parent = _executor(server, clock).run("buy", 0.5, "iceberg", duration=20, arrival_price=50000.0, display_size=0.2)
+    assert _sizes(server, "post_only") == [0.2, 0.2, 0.1]
+    assert parent.filled == pytest.approx(0.5)
+
+
+def test_finish_tops_up_partial_fill(server):
+    _rest_post_only(server, fills={"1": "0.1"})
+    clock = FakeClock()
+    parent = _executor(server, clock).run("buy", 0.3, "twap", duration=10, arrival_price=50000.0, slices=1)
+    assert _sizes(server, "market") == [0.2]
+    assert parent.filled == pytest.approx(0.3)
+    assert parent.report()["children"] == 2
+
+
+def test_finish_retries_failed_cancel_before_top_up(server):
+    _rest_post_only(server)
+    failures = {"1": 1}
+    cancel = server._cancel_order
+
+    def flaky_cancel(params, body):
+        if failures.get(body.get("ordId"), 0):
+            failures[body["ordId"]] -= 1
+            return {"code": "1", "msg": "", "data": [{"ordId": body["ordId"], "sCode": "51000", "sMsg": "系统繁忙"}]}
+        return cancel(params, body)
+
+    server._httpd.routes[("POST", "/api/v5/trade/cancel-batch-orders")] = lambda params, body: server._batch(flaky_cancel, params, body)
+    clock = FakeClock()
+    parent = _executor(server, clock).run("buy", 0.3, "twap", duration=10, arrival_price=50000.0, slices=1)
+    # 第一次撤单失败的子单被重试撤销，确认撤单后才市价补齐
+    assert [c["ordId"] for c in server.canceled] == ["1"]
+    assert parent.children[0].state == "canceled"
+    assert _sizes(server, "market") == [0.3]
+    assert parent.filled == pytest.approx(0.3)
@@ -0,0 +1,69 @@
+import os
+import time
+
+import pytest
+
+for _key in ("BOT_TOKEN", "CHAT_ID", "API_KEY", "SECRET_KEY", "PASS_PHRASE"):
+    os.environ.setdefault(_key, "test")
+os.environ.setdefault("STATE_SNAPSHOT_FILE", "")
+os.environ.setdefault("CANDLE_ARCHIVE_DIR", "")
+
+import app
+from account_ws import AccountStateCache
+
+SYMBOL = "BTC-USDT-SWAP"
+POSITION = {"instId": SYMBOL, "posSide": "long", "pos": "0.1", "uTime": "1"}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = AccountStateCache("k", "s", "p", url="ws://127.0.0.1:1")
+    cache.ready = True
+    monkeypatch.setattr(app, "_account_cache", cache)
+    monkeypatch.setattr(app, "send_telegram_message", lambda *args, **kwargs: None)
+    return cache
+
+
+@pytest.fixture
+def state():
+    state = app.StrategyState(SYMBOL, "1m")
+    state.apply_open("buy", 50000, 49000, 52000, int(time.time()), "algo1")
+    return state
+
+
+def _check(state, price: float = 50500):
+    runtime = app.BotRuntime([state])
+    runtime.request_algo_confirm = lambda state, now: None
+    runtime.check_risk({SYMBOL: price}, int(time.time()))
+    return runtime
+
+
+def test_missing_position_before_first_push_is_not_closed(cache, state):
+    # 开仓后持仓推送还没到：不能当作已被交易所平仓
+    assert app.get_exchange_exit_status(SYMBOL, "long", "algo1") is None
+    _check(state)
+    assert state.current_position == "long"
+
+
+def test_position_disappearing_after_seen_is_closed(cache, state):
+    cache.apply_positions([POSITION])
+    cache.apply_algo_orders([{"algoClOrdId": "algo1", "instId": SYMBOL, "state": "live"}])
+    _check(state)
+    assert state.current_position == "long" and state.position_seen
+    cache.discard_position(SYMBOL, "long")
+    _check(state)
+    assert state.current_position is None
+
+
+def test_triggered_algo_is_closed_without_position_push(cache, state):
+    cache.apply_algo_orders([{"algoClOrdId": "algo1", "instId": SYMBOL, "state": "effective"}])
+    assert app.get_exchange_exit_status(SYMBOL, "long", "algo1") == "closed"
+
+
+def test_live_algo_is_protected(cache, state):
+    cache.apply_positions([POSITION])
+    cache.apply_algo_orders([{"algoClOrdId": "algo1", "instId": SYMBOL, "state": "live"}])
+    assert app.get_exchange_exit_status(SYMBOL, "long", "algo1", position_seen=True) == "protected"
+    # 已在保护中，本地价格触及止损也不重复平仓
+    runtime = _check(state, price=48000)
+    assert runtime.order_queue.empty()
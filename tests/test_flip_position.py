@@ -0,0 +1,55 @@
+import functools
+import os
+
+import pytest
+
+for _key in ("BOT_TOKEN", "CHAT_ID", "API_KEY", "SECRET_KEY", "PASS_PHRASE"):
+    os.environ.setdefault(_key, "test")
+os.environ.setdefault("STATE_SNAPSHOT_FILE", "")
+os.environ.setdefault("CANDLE_ARCHIVE_DIR", "")
+
+import app
+import okx_clients
+from fake_okx import FakeOkxRestServer
+
+SYMBOL = "BTC-USDT-SWAP"
+SHORT = {"instId": SYMBOL, "posSide": "short", "pos": "0.1", "mgnMode": "cross"}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeOkxRestServer().start()
+    scheduler = okx_clients.get_scheduler()
+    enabled, scheduler.enabled = scheduler.enabled, False
+    monkeypatch.setattr(okx_clients, "OKX_DOMAIN", server.url)
+    monkeypatch.setattr(app, "get_pos_mode", lambda: "long_short_mode")
+    monkeypatch.setattr(app, "get_tick_size", lambda symbol: "0.1")
+    monkeypatch.setattr(app, "send_telegram_message", lambda *args, **kwargs: None)
+    yield server
+    scheduler.enabled = enabled
+    okx_clients.close_all()
+    server.stop()
+
+
+def test_flip_closes_then_opens(server):
+    closed, order = app.flip_position(SYMBOL, [SHORT], "buy", 0.1, 49000, 52000, algo_cl_ord_id="old")
+    assert closed and order is not None
+    assert len(server.batches) == 1
+    assert [(o["side"], o.get("posSide"), o["ordType"]) for o in server.orders] == [
+        ("buy", "short", "market"), ("buy", "long", "market")]
+    assert server.orders[1].get("attachAlgoOrds")
+    assert [a.get("algoClOrdId") for a in server.canceled_algos] == ["old"]
+
+
+def test_failed_close_leg_does_not_open(server):
+    def reject(params, body):
+        result = original(params, body)
+        result["data"][0].update(sCode="51000", sMsg="rejected")
+        return result
+
+    original = server._place_order
+    server._httpd.routes[("POST", "/api/v5/trade/batch-orders")] = functools.partial(server._batch, reject)
+    closed, order = app.flip_position(SYMBOL, [SHORT], "buy", 0.1, 49000, 52000, algo_cl_ord_id="old")
+    assert (closed, order) == (False, None)
+    assert [o.get("posSide") for o in server.orders] == ["short"]  # 只有被拒绝的平仓腿，没有开仓单
+    assert server.canceled_algos == []
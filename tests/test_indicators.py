@@ -0,0 +1,116 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import indicators
+from indicators import IndicatorEngine
+
+RSI_PERIOD = 14
+MA_PERIODS = (5, 20, 60)
+VOLUME_PERIOD = 10
+TOLERANCE = 1e-9
+
+
+def _series(n: int, seed: int = 7):
+    rng = np.random.default_rng(seed)
+    closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    volumes = rng.uniform(1, 100, n)
+    return closes, volumes
+
+
+def _reference(closes, volumes, window=None) -> dict:
+    """pandas 参考实现：rolling 均值、ewm(adjust=False)，window 不为 None 时只取最近 window 根"""
+    close = pd.Series(closes)
+    volume = pd.Series(volumes)
+    ema_close = close if window is None else close.iloc[-window:]
+    delta = close.diff()
+    gain = delta.clip(lower=0).rolling(RSI_PERIOD).mean().iloc[-1]
+    loss = (-delta).clip(lower=0).rolling(RSI_PERIOD).mean().iloc[-1]
+    return {
+        "rsi": 100 - 100 / (1 + gain / loss),
+        "ma": {p: close.rolling(p).mean().iloc[-1] for p in MA_PERIODS},
+        "ema": {p: ema_close.ewm(span=p, adjust=False).mean().iloc[-1] for p in MA_PERIODS},
+        "avg_volume": volume.rolling(VOLUME_PERIOD).mean().iloc[-1],
+    }
+
+
+def _close(a, b) -> bool:
+    if a is None or (isinstance(a, float) and math.isnan(a)):
+        return b is None or math.isnan(b)
+    return math.isclose(a, b, rel_tol=TOLERANCE, abs_tol=TOLERANCE)
+
+
+def _assert_engine_matches(engine: IndicatorEngine, closes, volumes, window):
+    ref = _reference(closes, volumes, window)
+    assert _close(engine.rsi, ref["rsi"])
+    assert _close(engine.avg_volume, ref["avg_volume"])
+    for p in MA_PERIODS:
+        assert _close(engine.ma[f"MA{p}"], ref["ma"][p])
+        assert _close(engine.ema[f"EMA{p}"], ref["ema"][p])
+
+
+@pytest.mark.parametrize("window", [None, 80])
+def test_engine_append_matches_pandas(window):
+    closes, volumes = _series(300)
+    engine = IndicatorEngine(RSI_PERIOD, MA_PERIODS, VOLUME_PERIOD, window=window)
+    for i in range(len(closes)):
+        assert engine.on_candle(i * 60_000, closes[i], volumes[i])
+        _assert_engine_matches(engine, closes[:i + 1], volumes[:i + 1], window)
+
+
+@pytest.mark.parametrize("window", [None, 80])
+def test_engine_patch_last_bar_matches_pandas(window):
+    closes, volumes = _series(300)
+    engine = IndicatorEngine(RSI_PERIOD, MA_PERIODS, VOLUME_PERIOD, window=window)
+    rng = np.random.default_rng(1)
+    for i in range(len(closes)):
+        engine.on_candle(i * 60_000, closes[i], volumes[i])
+        # 同一根K线多次修正（未收盘K线的实时更新），最后一次为最终值
+        for _ in range(3):
+            close = closes[i] * (1 + rng.normal(0, 0.005))
+            volume = volumes[i] * rng.uniform(1, 2)
+            engine.on_candle(i * 60_000, close, volume)
+            patched_closes = np.append(closes[:i], close)
+            patched_volumes = np.append(volumes[:i], volume)
+            _assert_engine_matches(engine, patched_closes, patched_volumes, window)
+        engine.on_candle(i * 60_000, closes[i], volumes[i])
+
+
+def test_engine_ignores_older_candle():
+    engine = IndicatorEngine(RSI_PERIOD, MA_PERIODS, VOLUME_PERIOD)
+    engine.on_candle(120_000, 100.0, 1.0)
+    assert not engine.on_candle(60_000, 90.0, 1.0)
+    assert engine.count == 1
+
+
+def test_vectorized_matches_pandas():
+    closes, _ = _series(2000)
+    close = pd.Series(closes)
+    for p in MA_PERIODS:
+        np.testing.assert_allclose(indicators.rolling_mean(closes, p), close.rolling(p).mean(), rtol=TOLERANCE, equal_nan=True)
+        np.testing.assert_allclose(indicators.ema(closes, p), close.ewm(span=p, adjust=False).mean(), rtol=TOLERANCE)
+    delta = close.diff()
+    gain = delta.clip(lower=0).rolling(RSI_PERIOD).mean()
+    loss = (-delta).clip(lower=0).rolling(RSI_PERIOD).mean()
+    np.testing.assert_allclose(indicators.rsi(closes, RSI_PERIOD), 100 - 100 / (1 + gain / loss), rtol=TOLERANCE, equal_nan=True)
+
+
+def test_vectorized_window_ema_matches_pandas():
+    closes, _ = _series(500)
+    window = 80
+    out = indicators.ema(closes, 20, window=window)
+    for t in range(len(closes)):
+        start = max(0, t - window + 1)
+        expected = pd.Series(closes[start:t + 1]).ewm(span=20, adjust=False).mean().iloc[-1]
+        assert math.isclose(out[t], expected, rel_tol=TOLERANCE)
+
+
+def test_vectorized_rsi_edge_cases():
+    # 只涨不跌为 100，只跌不涨为 0，无波动为 NaN
+    rising = np.linspace(50, 100, 40)
+    flat = np.full(40, 100.0)
+    assert indicators.rsi(rising, RSI_PERIOD)[-1] == 100
+    assert indicators.rsi(rising[::-1], RSI_PERIOD)[-1] == 0
+    assert math.isnan(indicators.rsi(flat, RSI_PERIOD)[-1])
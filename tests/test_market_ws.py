@@ -0,0 +1,120 @@
+import time
+
+import pytest
+
+from fake_okx import FakeOkxWebSocketServer
+from market_ws import MarketDataFeed
+
+SYMBOL = "BTC-USDT-SWAP"
+BAR = "1m"
+TIMEOUT = 5
+
+BIDS = [["50000.0", "1"], ["49999.5", "2"]]
+ASKS = [["50000.5", "0.5"], ["50001.0", "3"]]
+
+
+def _wait_until(condition, timeout: float = TIMEOUT) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture
+def server():
+    server = FakeOkxWebSocketServer().start()
+    yield server
+    server.stop()
+
+
+def _start_feed(server, book_channel=None) -> MarketDataFeed:
+    feed = MarketDataFeed(SYMBOL, BAR, public_url=server.url, business_url=server.url, book_channel=book_channel)
+    feed.start()
+    channels = ["tickers", f"candle{BAR}"] + ([book_channel] if book_channel else [])
+    assert _wait_until(lambda: all(server.subscriber_count(c) == 1 for c in channels))
+    return feed
+
+
+@pytest.fixture
+def feed(server):
+    feed = _start_feed(server)
+    yield feed
+    feed.stop()
+
+
+@pytest.fixture
+def book_feed(server):
+    feed = _start_feed(server, book_channel="books")
+    yield feed
+    feed.stop()
+
+
+def test_subscribes_to_tickers_and_candles(server, feed):
+    channels = {(arg["channel"], arg.get("instId")) for arg in server.subscriptions}
+    assert channels == {("tickers", SYMBOL), (f"candle{BAR}", SYMBOL)}
+
+
+def test_delivers_ticker(server, feed):
+    server.push_ticker(SYMBOL, 50123.5)
+    assert _wait_until(lambda: feed.last_price == 50123.5)
+    assert feed.wait_for_update(0)
+    assert feed.last_tick_time > 0
+
+
+def test_delivers_candles_newest_first(server, feed):
+    older = [1700000000000, 1, 2, 0.5, 1.5, 10, 0, 0, 1]
+    newer = [1700000060000, 1.5, 3, 1, 2.5, 20, 0, 0, 0]
+    server.push_candle(SYMBOL, BAR, older)
+    server.push_candle(SYMBOL, BAR, newer)
+    drained = []
+
+    def drain():
+        chunk = feed.drain_candles(SYMBOL, BAR)
+        if chunk:
+            drained.append([int(c[0]) for c in chunk])
+        return sum(len(c) for c in drained) == 2
+
+    assert _wait_until(drain)
+    # 与 OKX REST 一致，每次取出的K线最新在前
+    assert all(chunk == sorted(chunk, reverse=True) for chunk in drained)
+    assert sorted(ts for chunk in drained for ts in chunk) == [1700000000000, 1700000060000]
+    assert feed.drain_candles(SYMBOL, BAR) == []
+
+
+def test_reconnect_resubscribes_and_requests_resync(server, feed):
+    assert not feed.take_resync(SYMBOL, BAR)
+    server.drop_connections()
+    # 公共频道和业务频道两条连接都要重连
+    assert _wait_until(lambda: feed.reconnects == 2 and server.subscriber_count(f"candle{BAR}") == 1
+                       and server.subscriber_count("tickers") == 1)
+    assert feed.take_resync(SYMBOL, BAR)
+    assert not feed.take_resync(SYMBOL, BAR)  # 每次重连只返回一次
+    server.push_ticker(SYMBOL, 50200.0)
+    assert _wait_until(lambda: feed.last_price == 50200.0)
+
+
+def test_book_snapshot_and_update(server, book_feed):
+    server.push_book(SYMBOL, BIDS, ASKS, seq_id=10)
+    assert _wait_until(lambda: book_feed.get_book(SYMBOL) is not None)
+    book = book_feed.get_book(SYMBOL)
+    assert book.best_bid() == 50000.0
+    assert book.best_ask() == 50000.5
+    state = {"bids": BIDS, "asks": [["50000.5", "0.2"], ["50001.0", "3"]]}
+    server.push_book(SYMBOL, [], [["50000.5", "0.2"]], action="update", seq_id=11, prev_seq_id=10, book_state=state)
+    assert _wait_until(lambda: book.levels("asks", 1)[0][1] == 0.2)
+    assert book_feed.book_resyncs == 0
+
+
+def test_book_checksum_mismatch_resubscribes(server, book_feed):
+    server.push_book(SYMBOL, BIDS, ASKS, seq_id=10)
+    assert _wait_until(lambda: book_feed.get_book(SYMBOL) is not None)
+    server.push_book(SYMBOL, [], [["50000.5", "0.1"]], action="update", seq_id=11, prev_seq_id=10, checksum=123)
+    assert _wait_until(lambda: book_feed.book_resyncs == 1)
+    assert book_feed.get_book(SYMBOL) is None  # 等待新快照前不可用
+    # 退订后重新订阅，订阅记录中出现第二次 books 订阅
+    assert _wait_until(lambda: sum(arg["channel"] == "books" for arg in server.subscriptions) == 2
+                       and server.subscriber_count("books") == 1)
+    server.push_book(SYMBOL, BIDS, ASKS, seq_id=20)
+    assert _wait_until(lambda: book_feed.get_book(SYMBOL) is not None)
@@ -0,0 +1,38 @@
+import requests
+
+import notifier
+from notifier import TelegramNotifier, retry_after_seconds
+
+
+def _response(status: int, body: bytes = b"", headers: dict = None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.headers.update(headers or {})
+    return response
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.posts = 0
+
+    def post(self, url, json, timeout):
+        self.posts += 1
+        return self.responses.pop(0)
+
+
+def test_retry_after_from_json_header_or_default():
+    assert retry_after_seconds(_response(429, b'{"ok":false,"parameters":{"retry_after":7}}')) == 7
+    assert retry_after_seconds(_response(429, b"<html>Too Many Requests</html>", {"Retry-After": "12"})) == 12
+    assert retry_after_seconds(_response(429, b"[]")) == notifier.DEFAULT_RETRY_AFTER
+    assert retry_after_seconds(_response(429, b"")) == notifier.DEFAULT_RETRY_AFTER
+
+
+def test_non_json_429_is_retried(monkeypatch):
+    session = FakeSession([_response(429, b"rate limited", {"Retry-After": "0"}), _response(200, b'{"ok":true}')])
+    monkeypatch.setattr(notifier, "get_http_session", lambda: session)
+    sender = TelegramNotifier("token", "chat", min_interval=0)
+    assert sender._send("hello")
+    assert session.posts == 2
+    assert sender.rate_limited == 1 and sender.sent == 1
@@ -0,0 +1,171 @@
+import threading
+import time
+
+import httpx
+import pytest
+
+import rate_limiter
+from rate_limiter import (CircuitBreaker, CircuitOpenError, RateLimitTimeout, RequestScheduler, ScheduledTransport,
+                          TokenBucket, request_signature, PRIORITY_MARKET, PRIORITY_TRADE)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "backoff_delay", lambda attempt, *args, **kwargs: 0)
+
+
+def _request(method: str = "GET", path: str = "/api/v5/market/ticker") -> httpx.Request:
+    return httpx.Request(method, f"https://www.okx.com{path}")
+
+
+def _responses(*statuses):
+    """依次返回给定状态码（或抛出给定异常）的 send 函数，记录每次收到的请求头"""
+    calls = []
+
+    def send(request):
+        calls.append(dict(request.headers))
+        status = statuses[min(len(calls), len(statuses)) - 1]
+        if isinstance(status, Exception):
+            raise status
+        return httpx.Response(status, request=request)
+
+    return send, calls
+
+
+def test_bucket_limits_burst_and_refills():
+    bucket = TokenBucket(2, 20)
+    assert bucket.acquire(timeout=0) and bucket.acquire(timeout=0)
+    assert not bucket.acquire(timeout=0)
+    assert bucket.acquire(timeout=1)  # 20 个/秒，约 50ms 后补充
+
+
+def test_bucket_serves_higher_priority_first():
+    bucket = TokenBucket(1, 5)
+    bucket.acquire(timeout=0)
+    order = []
+
+    def wait(priority, name):
+        bucket.acquire(priority, timeout=2)
+        order.append(name)
+
+    market = threading.Thread(target=wait, args=(PRIORITY_MARKET, "market"))
+    market.start()
+    time.sleep(0.05)
+    trade = threading.Thread(target=wait, args=(PRIORITY_TRADE, "trade"))
+    trade.start()
+    market.join()
+    trade.join()
+    assert order == ["trade", "market"]
+
+
+def test_bucket_drain_blocks_until_refill():
+    bucket = TokenBucket(5, 5)
+    bucket.drain()
+    assert not bucket.acquire(timeout=0)
+
+
+def test_breaker_opens_after_threshold_and_allows_one_trial():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=0.05)
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()  # 试探请求结束前不再放行
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_breaker_failed_trial_reopens():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+
+def test_acquire_timeout_releases_trial_slot():
+    scheduler = RequestScheduler(limits={"/api/v5/market/ticker": (1, 1000)}, acquire_timeout=0)
+    bucket, breaker = scheduler._endpoint("/api/v5/market/ticker")
+    breaker.reset_timeout = 0
+    breaker.opened_at = time.monotonic()
+    bucket.acquire(timeout=0)  # 令牌已耗尽，试探请求等不到令牌
+    with pytest.raises(RateLimitTimeout):
+        scheduler.send(_responses(200)[0], _request())
+    assert breaker.allow()  # 试探名额已归还
+
+
+def test_open_breaker_rejects_without_sending():
+    scheduler = RequestScheduler()
+    _, breaker = scheduler._endpoint("/api/v5/market/ticker")
+    breaker.opened_at = time.monotonic()
+    send, calls = _responses(200)
+    with pytest.raises(CircuitOpenError):
+        scheduler.send(send, _request())
+    assert calls == []
+
+
+def test_retries_429_for_any_method():
+    scheduler = RequestScheduler(max_retries=3)
+    send, calls = _responses(429, 429, 200)
+    assert scheduler.send(send, _request("POST", "/api/v5/trade/order")).status_code == 200
+    assert len(calls) == 3
+
+
+def test_retries_5xx_only_for_get():
+    scheduler = RequestScheduler(max_retries=3)
+    send, calls = _responses(502, 200)
+    assert scheduler.send(send, _request()).status_code == 200
+    assert len(calls) == 2
+    send, calls = _responses(502, 200)
+    assert scheduler.send(send, _request("POST", "/api/v5/trade/order")).status_code == 502
+    assert len(calls) == 1
+
+
+def test_retries_connect_error_for_post_but_not_read_timeout():
+    scheduler = RequestScheduler(max_retries=3)
+    send, calls = _responses(httpx.ConnectError("refused"), 200)
+    assert scheduler.send(send, _request("POST", "/api/v5/trade/order")).status_code == 200
+    send, calls = _responses(httpx.ReadTimeout("slow"), 200)
+    with pytest.raises(httpx.ReadTimeout):
+        scheduler.send(send, _request("POST", "/api/v5/trade/order"))
+    assert len(calls) == 1
+
+
+def test_gives_up_after_max_retries():
+    scheduler = RequestScheduler(max_retries=2)
+    send, calls = _responses(429)
+    assert scheduler.send(send, _request()).status_code == 429
+    assert len(calls) == 3
+
+
+def test_retry_resigns_with_fresh_timestamp():
+    request = _request("POST", "/api/v5/trade/order")
+    request.headers["OK-ACCESS-TIMESTAMP"] = "2020-01-01T00:00:00.000Z"
+    request.headers["OK-ACCESS-SIGN"] = "stale"
+    send, calls = _responses(429, 200)
+    transport = ScheduledTransport(httpx.MockTransport(send), RequestScheduler(max_retries=2), secret_key="secret")
+    assert transport.handle_request(request).status_code == 200
+    first, second = calls
+    assert first["ok-access-sign"] == "stale"
+    assert second["ok-access-timestamp"] != "2020-01-01T00:00:00.000Z"
+    assert second["ok-access-sign"] == request_signature(request, second["ok-access-timestamp"], "secret")
+
+
+def test_signature_matches_okx_sdk():
+    from okx import Trade
+
+    captured = []
+
+    def handler(request):
+        captured.append(request)
+        return httpx.Response(200, json={"code": "0", "data": []})
+
+    client = Trade.TradeAPI("key", "secret", "pass", flag="1", domain="https://www.okx.com")
+    client._transport = httpx.MockTransport(handler)
+    client.get_order(instId="BTC-USDT-SWAP", ordId="1")
+    client.place_order(instId="BTC-USDT-SWAP", tdMode="cross", side="buy", ordType="market", sz="1")
+    assert len(captured) == 2
+    for request in captured:
+        assert request.headers["OK-ACCESS-SIGN"] == request_signature(request, request.headers["OK-ACCESS-TIMESTAMP"], "secret")
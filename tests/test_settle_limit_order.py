@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+for _key in ("BOT_TOKEN", "CHAT_ID", "API_KEY", "SECRET_KEY", "PASS_PHRASE"):
+    os.environ.setdefault(_key, "test")
+os.environ.setdefault("STATE_SNAPSHOT_FILE", "")
+os.environ.setdefault("CANDLE_ARCHIVE_DIR", "")
+
+import app
+
+SYMBOL = "BTC-USDT-SWAP"
+ACCEPTED = {"code": "0", "data": [{"ordId": "1", "sCode": "0"}]}
+
+
+class ScriptedTrade:
+    """按顺序返回订单状态的交易接口，最后一个状态一直重复"""
+
+    def __init__(self, states):
+        self.states = list(states)
+        self.canceled = []
+        self.orders = []
+
+    def get_order(self, instId, ordId):
+        state, filled = self.states.pop(0) if len(self.states) > 1 else self.states[0]
+        return {"code": "0", "data": [{"ordId": ordId, "state": state, "accFillSz": filled}]}
+
+    def cancel_order(self, instId, ordId):
+        self.canceled.append(ordId)
+        return {"code": "0", "data": [{"ordId": ordId, "sCode": "0"}]}
+
+    def place_order(self, **params):
+        self.orders.append(params)
+        return {"code": "0", "data": [{"ordId": str(len(self.orders) + 1), "sCode": "0"}]}
+
+
+@pytest.fixture(autouse=True)
+def fast_poll(monkeypatch):
+    monkeypatch.setattr(app, "POST_ONLY_WAIT", 0)
+    monkeypatch.setattr(app, "ORDER_POLL_INTERVAL", 0)
+
+
+def _settle(trade):
+    return app.settle_limit_order(trade, dict(ACCEPTED), "post_only", "buy", 0.01, 49000, 52000, SYMBOL, {}, None)
+
+
+def test_late_fill_after_cancel_reduces_top_up():
+    # 撤单请求发出后订单仍报 live，之后补报成交 0.006 才进入 canceled
+    trade = ScriptedTrade([("live", "0"), ("live", "0"), ("partially_filled", "0.004"), ("canceled", "0.006")])
+    order, _ = _settle(trade)
+    assert trade.canceled == ["1"]
+    assert [o["sz"] for o in trade.orders] == ["0.004"]
+    assert order["filled_sz"] == 0.01
+
+
+def test_fully_filled_during_cancel_skips_top_up():
+    trade = ScriptedTrade([("live", "0"), ("filled", "0.01")])
+    order, _ = _settle(trade)
+    assert trade.orders == []
+    assert order["filled_sz"] == 0.01
+
+
+def test_unconfirmed_cancel_skips_top_up(monkeypatch):
+    monkeypatch.setattr(app, "CANCEL_CONFIRM_TIMEOUT", 0)
+    trade = ScriptedTrade([("partially_filled", "0.003")])
+    order, _ = _settle(trade)
+    assert trade.orders == []
+    assert order["filled_sz"] == 0.003
+
+    trade = ScriptedTrade([("live", "0")])
+    order, _ = _settle(trade)
+    assert trade.orders == [] and order["code"] != "0"
@@ -0,0 +1,85 @@
+import os
+import time
+
+import pytest
+
+for _key in ("BOT_TOKEN", "CHAT_ID", "API_KEY", "SECRET_KEY", "PASS_PHRASE"):
+    os.environ.setdefault(_key, "test")
+os.environ.setdefault("STATE_SNAPSHOT_FILE", "")
+os.environ.setdefault("CANDLE_ARCHIVE_DIR", "")
+
+import app
+from state_snapshot import read_snapshot, write_snapshot
+
+SYMBOL = "BTC-USDT-SWAP"
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "state" / "bot_state.pkl")
+
+
+def test_round_trip_creates_private_files(path):
+    write_snapshot(path, {"states": {(SYMBOL, "1m"): {"current_position": "long"}}})
+    assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    snapshot = read_snapshot(path)
+    assert snapshot["states"] == {(SYMBOL, "1m"): {"current_position": "long"}}
+    assert read_snapshot(path + ".missing") is None
+
+
+def test_writable_by_others_is_ignored(path):
+    write_snapshot(path, {"states": {}})
+    os.chmod(path, 0o666)
+    assert read_snapshot(path) is None
+    os.chmod(path, 0o600)
+    os.chmod(os.path.dirname(path), 0o777)
+    assert read_snapshot(path) is None
+    with pytest.raises(PermissionError):
+        write_snapshot(path, {"states": {}})
+
+
+def test_symlink_is_ignored(path, tmp_path):
+    write_snapshot(path, {"states": {}})
+    link = str(tmp_path / "state" / "link.pkl")
+    os.symlink(path, link)
+    assert read_snapshot(link) is None
+
+
+@pytest.fixture
+def snapshot_file(monkeypatch, path):
+    monkeypatch.setattr(app, "SNAPSHOT_FILE", path)
+    monkeypatch.setattr(app, "send_telegram_message", lambda *args, **kwargs: None)
+    monkeypatch.setattr(app, "fetch_exit_algo", lambda symbol, algo_cl_ord_id: None)
+    return path
+
+
+def _restored(positions, monkeypatch):
+    saved = app.StrategyState(SYMBOL, "1m")
+    saved.apply_open("buy", 50000, 49000, 52000, int(time.time()), "algo1")
+    app.save_state_snapshot({(saved.symbol, saved.bar): saved.snapshot()})
+    state = app.StrategyState(SYMBOL, "1m")
+    assert app.restore_state_snapshot([state])
+    assert (state.current_position, state.entry_price, state.algo_cl_ord_id) == ("long", 50000, "algo1")
+    monkeypatch.setattr(app, "fetch_all_positions", lambda: positions)
+    app.reconcile_restored_states([state])
+    return state
+
+
+def test_restore_keeps_open_position(snapshot_file, monkeypatch):
+    state = _restored([{"instId": SYMBOL, "posSide": "long", "pos": "0.1"}], monkeypatch)
+    assert state.current_position == "long"
+
+
+def test_restore_clears_position_closed_while_down(snapshot_file, monkeypatch):
+    state = _restored([], monkeypatch)
+    assert state.current_position is None
+
+
+def test_restore_keeps_position_when_query_fails(snapshot_file, monkeypatch):
+    state = _restored(None, monkeypatch)
+    assert state.current_position == "long"
+
+
+def test_no_snapshot_is_not_restored(snapshot_file):
+    assert not app.restore_state_snapshot([app.StrategyState(SYMBOL, "1m")])